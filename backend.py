@@ -0,0 +1,493 @@
+# backend.py
+# Хранилище таблиц для sheets.py и ledger.py. Интерфейс — подмножество gspread.Client:
+# open_by_key() -> worksheet()/values_batch_get(), http_client.get_file_drive_metadata().
+# Реализации: настоящий gspread (по умолчанию) и FakeClient в памяти для замеров без Google.
+# Таблица и листы открываются один раз на процесс: get_spreadsheet(), get_worksheet(title).
+import datetime
+import functools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from gspread.cell import Cell
+from gspread.exceptions import GSpreadException, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+from config import (
+    SPREADSHEET_ID, SERVICE_ACCOUNT_FILE, SHEETS_BACKEND,
+    FAKE_SEED_FILE, FAKE_LATENCY, FAKE_QUOTA_ERROR_RATE,
+    SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE, SHEETS_RATE_BURST,
+    SHEETS_RETRY_ATTEMPTS, SHEETS_RETRY_BASE_DELAY, SHEETS_RETRY_MAX_DELAY,
+    SHEETS_BREAKER_THRESHOLD, SHEETS_BREAKER_COOLDOWN,
+    SHEETS_HTTP_POOL_SIZE, SHEETS_TOKEN_REFRESH_MARGIN
+)
+from throttle import RateLimiter, ThrottledProxy
+
+logger = logging.getLogger(__name__)
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+RANGE_NAME = re.compile(r"^'?(.*?)'?(?:!(.+))?$")
+
+_client = None
+_client_lock = threading.Lock()
+
+# Один ограничитель на процесс: квота общая для всех потоков и клиентов
+limiter = RateLimiter(
+    SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE, SHEETS_RATE_BURST,
+    SHEETS_RETRY_ATTEMPTS, SHEETS_RETRY_BASE_DELAY, SHEETS_RETRY_MAX_DELAY,
+    SHEETS_BREAKER_THRESHOLD, SHEETS_BREAKER_COOLDOWN
+)
+
+
+class BackendError(GSpreadException):
+    """Ошибка хранилища с HTTP-статусом (429 — превышена квота)"""
+
+    def __init__(self, status, message):
+        super().__init__(f"[{status}] {message}")
+        self.status = status
+
+
+def create_gspread_client():
+    # Импорт здесь: без ключа сервисного аккаунта работает только fake-хранилище
+    import gspread
+    from google.oauth2.service_account import Credentials
+    from requests.adapters import HTTPAdapter
+    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPE)
+    client = gspread.authorize(creds)
+    # Одна сессия на все потоки: пул по умолчанию (10 соединений) меньше числа потоков,
+    # лишние соединения закрывались бы после каждого запроса. Повторы делает RateLimiter
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SHEETS_HTTP_POOL_SIZE, max_retries=0)
+    client.http_client.session.mount("https://", adapter)
+    TokenRefresher(creds, SHEETS_TOKEN_REFRESH_MARGIN).start()
+    return client
+
+
+class TokenRefresher:
+    """Обновляет OAuth-токен сервисного аккаунта в фоне за margin секунд до истечения.
+    google-auth обновляет токен сам, но лениво — внутри первого запроса после истечения"""
+
+    RETRY_DELAY = 30
+
+    def __init__(self, credentials, margin):
+        self.credentials = credentials
+        self.margin = margin
+
+    def start(self):
+        threading.Thread(target=self._run, name="token-refresh", daemon=True).start()
+
+    def seconds_left(self):
+        expiry = self.credentials.expiry
+        if not self.credentials.token or expiry is None:
+            return 0
+        # expiry в google-auth — UTC без часового пояса
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds()
+
+    def _run(self):
+        from google.auth.transport.requests import Request
+        request = Request()
+        while True:
+            wait = self.seconds_left() - self.margin
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                self.credentials.refresh(request)
+                logger.info(f"OAuth-токен обновлён, действует до {self.credentials.expiry} UTC")
+            except Exception as e:
+                logger.error(f"Ошибка обновления OAuth-токена: {e}")
+                time.sleep(self.RETRY_DELAY)
+
+
+def create_client(kind=SHEETS_BACKEND):
+    if kind == "gspread":
+        return create_gspread_client()
+    if kind == "fake":
+        return FakeClient.from_cache_file(FAKE_SEED_FILE, latency=FAKE_LATENCY, quota_error_rate=FAKE_QUOTA_ERROR_RATE)
+    raise ValueError(f"Неизвестное хранилище SHEETS_BACKEND={kind!r}, ожидается 'gspread' или 'fake'")
+
+
+def get_client():
+    """Клиент хранилища, создаётся при первом обращении"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ThrottledProxy(create_client(), limiter)
+                logger.info(f"Хранилище таблиц: {SHEETS_BACKEND}")
+    return _client
+
+
+def set_client(client, throttled=True):
+    """Подменяет клиент хранилища (бенчмарки, отладка без доступа к Google)"""
+    global _client
+    with _client_lock:
+        _client = ThrottledProxy(client, limiter) if throttled else client
+    handles.forget()
+
+
+def is_missing_worksheet(error):
+    """Лист удалён или переименован: gspread сообщает об этом как 400 "Unable to parse range" """
+    if isinstance(error, WorksheetNotFound):
+        return True
+    status = getattr(error, "code", None) or getattr(error, "status", None)
+    return status == 400 and "Unable to parse range" in str(error)
+
+
+class HandlePool:
+    """Таблица и её листы, открытые один раз на процесс. open_by_key() и worksheet() — это
+    запросы метаданных; без пула каждая запись делала бы их заново. Лист забывается
+    только когда его не нашли, остальные ошибки на пул не влияют"""
+
+    def __init__(self, key):
+        self.key = key
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = get_client().open_by_key(self.key)
+            return self._spreadsheet
+
+    def worksheet(self, title):
+        with self._lock:
+            handle = self._worksheets.get(title)
+        if handle is None:
+            try:
+                worksheet = self.spreadsheet().worksheet(title)
+            except WorksheetNotFound:
+                # Вместе с листом могли переименовать или пересоздать таблицу — откроем заново
+                self.forget()
+                raise
+            handle = PooledWorksheet(self, title, worksheet)
+            with self._lock:
+                handle = self._worksheets.setdefault(title, handle)
+        return handle
+
+    def forget(self, title=None):
+        with self._lock:
+            if title is None:
+                self._spreadsheet = None
+                self._worksheets.clear()
+            else:
+                self._worksheets.pop(title, None)
+
+
+class PooledWorksheet:
+    """Лист из пула: если вызов показал, что листа больше нет, он убирается из пула"""
+
+    def __init__(self, pool, title, worksheet):
+        self._pool = pool
+        self._title = title
+        self._worksheet = worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except Exception as e:
+                if is_missing_worksheet(e):
+                    logger.warning(f"Лист '{self._title}' не найден, будет открыт заново: {e}")
+                    self._pool.forget(self._title)
+                raise
+        return call
+
+
+handles = HandlePool(SPREADSHEET_ID)
+
+
+def get_spreadsheet():
+    return handles.spreadsheet()
+
+
+def get_worksheet(title):
+    return handles.worksheet(title)
+
+
+def get_sheets_stats():
+    """Счётчики ограничителя: вызовы, ожидания квоты, повторы, отказы предохранителя"""
+    return limiter.snapshot()
+
+
+# --- FAKE-ХРАНИЛИЩЕ В ПАМЯТИ ---
+def to_cell(value):
+    # API отдаёт отформатированные значения строками
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def trim_values(values):
+    # Как и API, не возвращаем пустые ячейки в конце строк и пустые строки в конце диапазона
+    rows = []
+    for row in values:
+        row = list(row)
+        while row and row[-1] == "":
+            row.pop()
+        rows.append(row)
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+def records_to_values(records, headers=None):
+    headers = headers or (list(records[0].keys()) if records else [])
+    return [list(headers)] + [[to_cell(record.get(key, "")) for key in headers] for record in records]
+
+
+def cache_to_sheets(data):
+    """Восстанавливает значения листов из кэша cach.json (для fake-хранилища)"""
+    sheets = {
+        "Проекты": records_to_values(data.get("projects") or []),
+        "Сотрудники": records_to_values(data.get("employees") or []),
+        "Действия и разрешения": [[to_cell(cell) for cell in row] for row in data.get("permissions") or []],
+        "URL действия": records_to_values([{"Действие": k, "URL": v} for k, v in (data.get("urls") or {}).items()], ["Действие", "URL"]),
+        "Инструмент": records_to_values(data.get("instruments") or []),
+        "Где инструмент": records_to_values(data.get("where_instruments") or []),
+        "Данные": [["№ строки"]]  # журнал в кэш не попадает, бот только дописывает его
+    }
+
+    materials = [["Категория", "ID", "Наименование", "Ед. измерения", "Тип сделки"]]
+    for cat in data.get("material_categories") or []:
+        for item in (data.get("materials_by_category") or {}).get(cat, []):
+            materials.append([cat, item.get("ID", ""), item.get("Наименование", ""), item.get("Ед. измерения", ""), item.get("Тип сделки", "")])
+    sheets["Материалы"] = materials
+
+    # Пластины: строка заголовков категорий, типы пластин в колонке B строк 2-6, дальше сами пластины
+    plates = [["Категория", "ID", "Наименование", "Тип пластин", "Ед. измерения", "Кол-во на складе", "Вычисления"]]
+    plate_types = list(data.get("plate_types") or [])[:5]
+    plates += [["", plate_type] for plate_type in plate_types] + [[""]] * (5 - len(plate_types))
+    for cat in data.get("plate_categories") or []:
+        for item in (data.get("plates_by_category") or {}).get(cat, []):
+            plates.append([cat] + [to_cell(item.get(key, "")) for key in plates[0][1:]])
+    sheets["Пластины МЗП"] = plates
+    return sheets
+
+
+class FakeHTTPClient:
+    def __init__(self, client):
+        self._client = client
+
+    def get_file_drive_metadata(self, id):
+        self._client.call("get_file_drive_metadata")
+        spreadsheet = self._client._spreadsheets[id]
+        return {"id": id, "name": spreadsheet.title, "modifiedTime": spreadsheet.get_lastUpdateTime()}
+
+
+class FakeClient:
+    """Хранилище в памяти с интерфейсом gspread.Client (только то, чем пользуется бот).
+
+    latency — задержка каждого вызова API (сек), quota_error_rate — доля вызовов,
+    завершающихся ошибкой 429. calls считает вызовы по методам.
+    """
+
+    def __init__(self, sheets=None, latency=0.0, quota_error_rate=0.0, seed=None):
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.calls = Counter()
+        self.http_client = FakeHTTPClient(self)
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._spreadsheets = {}
+        self.add_spreadsheet(SPREADSHEET_ID, sheets or {})
+
+    @classmethod
+    def from_cache_file(cls, path, **kwargs):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать {path} для fake-хранилища: {e}. Таблица будет пустой.")
+            data = {}
+        return cls(cache_to_sheets(data), **kwargs)
+
+    def add_spreadsheet(self, key, sheets):
+        with self._lock:
+            self._spreadsheets[key] = FakeSpreadsheet(self, key, sheets)
+        return self._spreadsheets[key]
+
+    def call(self, method):
+        """Имитация сетевого вызова: учёт, задержка, ошибки квоты"""
+        with self._lock:
+            self.calls[method] += 1
+            failed = self.quota_error_rate and self._random.random() < self.quota_error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise BackendError(429, f"Quota exceeded ({method})")
+
+    def open_by_key(self, key):
+        self.call("open_by_key")
+        try:
+            return self._spreadsheets[key]
+        except KeyError:
+            raise BackendError(404, f"Requested entity was not found: {key}")
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, key, sheets):
+        self.client = client
+        self.id = key
+        self.title = "fake"
+        self._worksheets = {name: FakeWorksheet(self, name, values) for name, values in sheets.items()}
+        self._modified = datetime.datetime.now(datetime.timezone.utc)
+
+    def touch(self):
+        # modifiedTime меняется при каждой записи, даже если две записи попали в одну миллисекунду
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self._modified = max(now, self._modified + datetime.timedelta(milliseconds=1))
+
+    def get_lastUpdateTime(self):
+        return self._modified.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+    def worksheet(self, title):
+        self.client.call("worksheet")
+        try:
+            return self._worksheets[title]
+        except KeyError:
+            raise WorksheetNotFound(title)
+
+    def worksheets(self):
+        self.client.call("worksheets")
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title, rows=1000, cols=26):
+        self.client.call("add_worksheet")
+        with self.client._lock:
+            self._worksheets[title] = FakeWorksheet(self, title, [], cols)
+            self.touch()
+        return self._worksheets[title]
+
+    def values_batch_get(self, ranges, params=None):
+        self.client.call("values_batch_get")
+        value_ranges = []
+        with self.client._lock:
+            for range_name in ranges:
+                title, a1 = RANGE_NAME.match(range_name).groups()
+                if title not in self._worksheets:
+                    raise BackendError(400, f"Unable to parse range: {range_name}")
+                value_ranges.append({"range": range_name, "values": self._worksheets[title].read(a1)})
+        return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, values, cols=26):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self._rows = [[to_cell(cell) for cell in row] for row in values]
+        # Ширина сетки, как у настоящего листа: запись правее неё отклоняется
+        self._cols = max([cols] + [len(row) for row in self._rows])
+
+    @property
+    def client(self):
+        return self.spreadsheet.client
+
+    @property
+    def col_count(self):
+        return self._cols
+
+    def add_cols(self, cols):
+        self.client.call("add_cols")
+        with self.client._lock:
+            self._cols += cols
+            self.spreadsheet.touch()
+
+    def read(self, a1=None):
+        """Значения диапазона A1 (без учёта вызова API)"""
+        if not a1:
+            return trim_values(self._rows)
+        grid = a1_range_to_grid_range(a1)
+        start_row, end_row = grid.get("startRowIndex", 0), grid.get("endRowIndex", len(self._rows))
+        start_col, end_col = grid.get("startColumnIndex", 0), grid.get("endColumnIndex")
+        return trim_values([row[start_col:end_col] for row in self._rows[start_row:end_row]])
+
+    def write(self, row, col, values):
+        width = max((len(values_row) for values_row in values), default=0)
+        if col - 1 + width > self._cols:
+            raise BackendError(400, f"Range ('{self.title}'!{rowcol_to_a1(row, col - 1 + width)}) exceeds grid limits. Max columns: {self._cols}")
+        for i, values_row in enumerate(values):
+            while len(self._rows) < row + i:
+                self._rows.append([])
+            target = self._rows[row + i - 1]
+            if len(target) < col - 1 + len(values_row):
+                target.extend([""] * (col - 1 + len(values_row) - len(target)))
+            target[col - 1:col - 1 + len(values_row)] = [to_cell(value) for value in values_row]
+        self.spreadsheet.touch()
+
+    def get_all_values(self):
+        self.client.call("get_all_values")
+        with self.client._lock:
+            return [list(row) for row in trim_values(self._rows)]
+
+    def col_values(self, col):
+        self.client.call("col_values")
+        with self.client._lock:
+            column = [row[col - 1] if len(row) >= col else "" for row in self._rows]
+        while column and column[-1] == "":
+            column.pop()
+        return column
+
+    def batch_get(self, ranges, **kwargs):
+        self.client.call("batch_get")
+        with self.client._lock:
+            return [self.read(a1) for a1 in ranges]
+
+    def find(self, query, in_column=None):
+        self.client.call("find")
+        with self.client._lock:
+            for r, row in enumerate(self._rows, start=1):
+                for c, value in enumerate(row, start=1):
+                    if (in_column is None or c == in_column) and value == str(query):
+                        return Cell(r, c, value)
+        return None
+
+    def update(self, values=None, range_name=None, **kwargs):
+        # Поддерживаем и старый порядок аргументов update(range, values)
+        if isinstance(values, str) and not isinstance(range_name, str):
+            values, range_name = range_name, values
+        self.client.call("update")
+        with self.client._lock:
+            grid = a1_range_to_grid_range(range_name or "A1")
+            self.write(grid.get("startRowIndex", 0) + 1, grid.get("startColumnIndex", 0) + 1, values)
+        return {"updatedRange": f"'{self.title}'!{range_name}", "updatedRows": len(values)}
+
+    def batch_update(self, data, **kwargs):
+        self.client.call("batch_update")
+        with self.client._lock:
+            for item in data:
+                grid = a1_range_to_grid_range(item["range"])
+                self.write(grid.get("startRowIndex", 0) + 1, grid.get("startColumnIndex", 0) + 1, item["values"])
+        return {"totalUpdatedCells": sum(len(row) for item in data for row in item["values"])}
+
+    def update_cell(self, row, col, value):
+        self.client.call("update_cell")
+        with self.client._lock:
+            self.write(row, col, [[value]])
+        return {"updatedRange": f"'{self.title}'!{rowcol_to_a1(row, col)}"}
+
+    def append_rows(self, values, value_input_option="RAW", insert_data_option=None, table_range=None, **kwargs):
+        self.client.call("append_rows")
+        with self.client._lock:
+            start_row = len(trim_values(self._rows)) + 1
+            self.write(start_row, 1, values)
+            end_row = start_row + len(values) - 1
+            width = max((len(row) for row in values), default=1)
+        updated_range = f"'{self.title}'!A{start_row}:{rowcol_to_a1(end_row, width)}"
+        return {"updates": {"updatedRange": updated_range, "updatedRows": len(values)}}
+
+    def append_row(self, values, value_input_option="RAW", insert_data_option=None, table_range=None, **kwargs):
+        return self.append_rows([values], value_input_option, insert_data_option, table_range)
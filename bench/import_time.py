@@ -0,0 +1,88 @@
+# bench/import_time.py
+# Замер времени импорта модулей бота в чистом процессе (python -X importtime) и проверка,
+# что импорт не имеет побочных эффектов: не создаёт клиент Google, не запускает потоки,
+# не настраивает логирование.
+#
+#   python bench/import_time.py --repeat 5
+#   python bench/import_time.py --modules sheets,bot_handlers --top 10
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["config", "scheduler", "snapshot", "journal", "throttle", "backend", "ledger", "sheets", "utils", "bot_handlers", "bot_main"]
+
+# Выполняется в дочернем процессе после импорта: что импорт оставил после себя
+PROBE = """
+import {module}
+import json, logging, sys, threading
+backend = sys.modules.get("backend")
+print(json.dumps({{
+    "threads": sorted(t.name for t in threading.enumerate() if t is not threading.main_thread()),
+    "client": bool(backend and backend._client is not None),
+    "logging": bool(logging.getLogger().handlers),
+    "modules": len(sys.modules),
+    "handlers": sorted(name for name in sys.modules if name.startswith("handlers."))
+}}))
+"""
+
+
+def measure(module):
+    """Один импорт в новом процессе: (время по модулям в мкс, результат проверки)"""
+    env = dict(os.environ, SHEETS_BACKEND=os.environ.get("SHEETS_BACKEND", "fake"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Импорт {module} не удался:\n{result.stderr.strip().splitlines()[-1]}")
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(total)
+        if name.strip() == module:
+            # Модуль импортируется первым; дальше идут импорты самой проверки
+            break
+    return cumulative, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    modules = args.modules.split(",") if args.modules else MODULES
+    print(f"{'модуль':<16}{'медиана, мс':>12}{'мин, мс':>10}{'модулей':>10}  побочные эффекты")
+    for module in modules:
+        totals, deps = [], defaultdict(list)
+        for _ in range(args.repeat):
+            cumulative, probe = measure(module)
+            totals.append(cumulative.get(module, 0) / 1000)
+            for name, value in cumulative.items():
+                deps[name].append(value / 1000)
+        effects = []
+        if probe["client"]:
+            effects.append("создан клиент Google")
+        if probe["threads"]:
+            effects.append(f"потоки: {', '.join(probe['threads'])}")
+        if probe["logging"]:
+            effects.append("настроено логирование")
+        if probe["handlers"]:
+            effects.append(f"обработчиков импортировано: {len(probe['handlers'])}")
+        print(f"{module:<16}{statistics.median(totals):>12.1f}{min(totals):>10.1f}{probe['modules']:>10}  {'; '.join(effects) or 'нет'}")
+        if args.top:
+            heaviest = sorted(deps.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+            for name, values in heaviest[1:args.top + 1]:
+                print(f"    {name:<40}{statistics.median(values):>10.1f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Время импорта модулей бота и побочные эффекты импорта")
+    parser.add_argument("--modules", default="", help=f"через запятую, по умолчанию: {','.join(MODULES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="запусков на модуль, берётся медиана")
+    parser.add_argument("--top", type=int, default=0, help="показать N самых тяжёлых зависимостей модуля")
+    main(parser.parse_args())
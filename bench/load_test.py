@@ -0,0 +1,302 @@
+# bench/load_test.py
+# Нагрузочный прогон бота без сети: настоящие обработчики из bot_handlers.register_handlers,
+# синтетические апдейты Telegram и fake-хранилище таблиц (backend.FakeClient).
+#
+#   python bench/load_test.py --users 30 --rounds 3 --sheets-latency 0.3
+#
+# Отчёт: p50/p95/p99 по каждому шагу диалога, пропускная способность
+# и число обращений к Sheets на одну отправку отчёта.
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SHEETS_BACKEND", "fake")
+os.environ.setdefault("FAKE_SEED_FILE", os.path.join(ROOT, "cach.json"))
+# Снимок кэша и журнал отправок бенчмарка не должны затирать рабочие
+BENCH_DIR = tempfile.mkdtemp(prefix="svbot-bench-")
+os.environ.setdefault("CACHE_SNAPSHOT_FILE", os.path.join(BENCH_DIR, "cach.snapshot"))
+os.environ.setdefault("LEDGER_JOURNAL_FILE", os.path.join(BENCH_DIR, "ledger.journal"))
+
+logging.basicConfig(level=logging.WARNING)
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+from telegram.warnings import PTBUserWarning  # noqa: E402
+
+import backend  # noqa: E402
+import sheets  # noqa: E402
+from bot_handlers import register_handlers  # noqa: E402
+
+# Предупреждения per_message от ConversationHandler к замерам отношения не имеют
+warnings.filterwarnings("ignore", category=PTBUserWarning)
+
+SCENARIOS = ["write_off", "ferma_write_off", "instrument", "delivery", "expense"]
+
+# Сколько раз за диалог отчёт уходит в таблицу
+SUBMIT_STEP = "submit"
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Bot API без сети: каждый вызов ждёт latency и возвращает правдоподобный ответ"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot",
+                      "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = message_json(int(params.get("chat_id") or 0), next(self._message_ids), params.get("text", ""))
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+def user_json(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"Прораб {user_id}"}
+
+
+def message_json(chat_id, message_id, text=""):
+    return {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+
+class SimulatedUser:
+    """Один сотрудник: своя переписка, свои ID апдейтов и сообщений"""
+
+    update_ids = itertools.count(1)
+
+    def __init__(self, app, user_id):
+        self.app = app
+        self.user_id = user_id
+        self.message_ids = itertools.count(1)
+
+    def text_update(self, text):
+        message = message_json(self.user_id, next(self.message_ids), text)
+        message["from"] = user_json(self.user_id)
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def callback_update(self, data):
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)),
+                "from": user_json(self.user_id),
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": dict(message_json(self.user_id, next(self.message_ids)), **{"from": user_json(1)})
+            }
+        }
+
+    async def send(self, kind, payload):
+        raw = self.text_update(payload) if kind == "text" else self.callback_update(payload)
+        await self.app.process_update(Update.de_json(raw, self.app.bot))
+
+
+def pick_login():
+    # Первый сотрудник с доступом и ролью, которой видны проекты
+    for employee in sheets.caches["employees"]:
+        role = str(employee.get("Роль", ""))
+        if str(employee.get("Доступ", "")).upper() == "TRUE" and sheets.get_projects_list(role):
+            return str(employee["Логин"]), str(employee["Пароль"]), role
+    raise SystemExit("В cach.json нет сотрудника с доступом к проектам")
+
+
+def build_scenarios(role, rng):
+    """Шаги диалогов: (название шага, тип апдейта, данные). Данные выбираются из кэша случайно"""
+    # Проекты без ID или номера договора на клавиатуре есть, но выбрать их нельзя
+    projects = [p for p in sheets.get_projects_list(role) if str(p.get("ID проекта", "")).strip() and str(p.get("Номер договора", "")).strip()]
+    categories = [cat for cat in sheets.caches.get("material_categories") or [] if sheets.get_materials_by_category(cat)]
+    plate_categories = [cat for cat in sheets.get_plate_categories() if sheets.get_plates_by_category(cat)]
+    instruments = sheets.get_instruments()
+
+    def write_off():
+        cat = rng.choice(categories)
+        material = rng.choice(sheets.get_materials_by_category(cat))
+        return [
+            ("menu", "cb", "write_off"),
+            ("project", "cb", f"proj_{rng.choice(projects)['ID проекта']}"),
+            ("category", "cb", f"cat_{cat}"),
+            ("material", "cb", f"mat_{material['ID']}"),
+            ("quantity", "text", str(rng.randint(1, 20))),
+            (SUBMIT_STEP, "cb", "submit"),
+        ]
+
+    def ferma_write_off():
+        cat = rng.choice(plate_categories)
+        plate = rng.choice(sheets.get_plates_by_category(cat))
+        return [
+            ("menu", "cb", "ferma_write_off"),
+            ("project", "cb", f"proj_{rng.choice(projects)['ID проекта']}"),
+            ("type", "cb", "type_plates"),
+            ("category", "cb", f"cat_{cat}"),
+            ("plate", "cb", f"plate_{plate['ID']}"),
+            ("quantity", "text", str(rng.randint(1, 50))),
+            (SUBMIT_STEP, "cb", "submit"),
+        ]
+
+    def instrument():
+        chosen = rng.choice(instruments)
+        return [
+            ("menu", "cb", "instrument"),
+            ("project", "cb", f"proj_{rng.choice(projects)['ID проекта']}"),
+            ("type", "cb", rng.choice(["Приход", "Расход"])),
+            ("recipient", "text", "Иванов И.И."),
+            ("search", "text", str(chosen["name"]).split()[0]),
+            ("instrument", "cb", f"inst_{chosen['id']}"),
+            ("quantity", "text", "1"),
+            (SUBMIT_STEP, "cb", "submit"),
+        ]
+
+    def delivery():
+        return [
+            ("menu", "cb", "delivery"),
+            ("project", "cb", f"proj_{rng.choice(projects)['ID проекта']}"),
+            ("department", "cb", "Строительство"),
+            ("amount", "text", str(rng.randint(1000, 9000))),
+            (SUBMIT_STEP, "cb", "skip_note"),
+        ]
+
+    def expense():
+        return [
+            ("menu", "cb", "add_expense"),
+            ("project", "cb", f"proj_{rng.choice(projects)['Номер договора']}"),
+            ("details", "text", f"Саморезы, {rng.randint(1, 9)}, уп, 350"),
+            (SUBMIT_STEP, "cb", "submit"),
+        ]
+
+    return {"write_off": write_off, "ferma_write_off": ferma_write_off, "instrument": instrument,
+            "delivery": delivery, "expense": expense}
+
+
+async def run_user(app, user_id, scenarios, names, rounds, credentials, timings, rng, double_tap=0.0):
+    user = SimulatedUser(app, user_id)
+    login, password, _ = credentials
+    for kind, payload in (("text", "/start"), ("text", login), ("text", password)):
+        await user.send(kind, payload)
+    for _ in range(rounds):
+        name = rng.choice(names)
+        for step, kind, payload in scenarios[name]():
+            started = time.perf_counter()
+            if step == SUBMIT_STEP and rng.random() < double_tap:
+                # Двойное нажатие "Отправить": второй колбэк приходит, пока первый ещё обрабатывается
+                await asyncio.gather(user.send(kind, payload), user.send(kind, payload))
+            else:
+                await user.send(kind, payload)
+            timings[(name, step)].append(time.perf_counter() - started)
+
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def ledger_rows(client):
+    spreadsheet = client.open_by_key(sheets.SPREADSHEET_ID)
+    return sum(len(spreadsheet.worksheet(name).read()) for name in ("Данные", "Где инструмент"))
+
+
+def print_report(timings, elapsed, users, sheets_calls, telegram_calls, rows_written):
+    print(f"\n{'сценарий / шаг':<32}{'n':>6}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for (name, step), values in sorted(timings.items()):
+        print(f"{name + ' / ' + step:<32}{len(values):>6}"
+              f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}")
+    submissions = sum(len(values) for (_, step), values in timings.items() if step == SUBMIT_STEP)
+    steps = sum(len(values) for values in timings.values())
+    all_steps = [value for values in timings.values() for value in values]
+    print(f"\nПользователей: {users}, шагов: {steps}, отправок отчётов: {submissions}, время: {elapsed:.2f} с")
+    print(f"Пропускная способность: {steps / elapsed:.1f} шагов/с, {submissions / elapsed:.2f} отправок/с")
+    print(f"Все шаги: p50 {percentile(all_steps, 50) * 1000:.1f} мс, p95 {percentile(all_steps, 95) * 1000:.1f} мс, "
+          f"p99 {percentile(all_steps, 99) * 1000:.1f} мс")
+    print(f"Строк дописано в журналы таблицы: {rows_written} (по одной на отправку ожидается {submissions})")
+    total_sheets = sum(sheets_calls.values())
+    print(f"Обращений к Sheets: {total_sheets} ({total_sheets / max(submissions, 1):.2f} на отправку): "
+          + ", ".join(f"{method}={count}" for method, count in sorted(sheets_calls.items())))
+    print("Вызовов Bot API: " + ", ".join(f"{method}={count}" for method, count in sorted(telegram_calls.items())))
+    print("Ограничитель Sheets: " + ", ".join(f"{key}={value}" for key, value in sorted(backend.get_sheets_stats().items())))
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    client = backend.FakeClient.from_cache_file(
+        os.environ["FAKE_SEED_FILE"], latency=args.sheets_latency, quota_error_rate=args.quota_error_rate, seed=args.seed
+    )
+    backend.set_client(client)
+    sheets.load_caches(force=True)
+
+    telegram = FakeTelegramRequest(latency=args.telegram_latency)
+    app = Application.builder().token("123456:BENCH").request(telegram).get_updates_request(FakeTelegramRequest()).build()
+    register_handlers(app)
+    await app.initialize()
+
+    credentials = pick_login()
+    scenarios = build_scenarios(credentials[2], rng)
+    names = args.scenarios.split(",") if args.scenarios else SCENARIOS
+    timings = defaultdict(list)
+    rows_before = ledger_rows(client)
+    client.calls.clear()
+    telegram.calls.clear()
+
+    started = time.perf_counter()
+    # Обработчики печатают отладку в stdout — в отчёт её не пускаем
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(
+            run_user(app, 10_000 + i, scenarios, names, args.rounds, credentials, timings, random.Random(args.seed + i), args.double_tap)
+            for i in range(args.users)
+        ))
+        sheets.drain_ledgers(timeout=60)
+    elapsed = time.perf_counter() - started
+
+    await app.shutdown()
+    sheets.get_executor().shutdown(wait=True)
+    calls = dict(client.calls)
+    print_report(timings, elapsed, args.users, calls, dict(telegram.calls), ledger_rows(client) - rows_before)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон диалогов бота на fake-хранилище")
+    parser.add_argument("--users", type=int, default=20, help="одновременных сотрудников")
+    parser.add_argument("--rounds", type=int, default=3, help="диалогов на сотрудника")
+    parser.add_argument("--scenarios", default="", help=f"через запятую, по умолчанию все: {','.join(SCENARIOS)}")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="задержка вызова Sheets API, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка вызова Bot API, с")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="доля вызовов Sheets с ошибкой 429")
+    parser.add_argument("--double-tap", type=float, default=0.0, help="доля отправок с двойным нажатием")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
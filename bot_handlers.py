@@ -1,12 +1,15 @@
 # bot_handlers.py
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
-from handlers import start, write_off, expense, project, status_change, ferma_write_off, delivery, instrument, new_instrument, web_write_off, purchase
-from handlers.report_issue import start_report_issue, save_issue, back_to_menu  # Добавлен импорт для report_issue
 import logging
 
 logger = logging.getLogger(__name__)
 
 def register_handlers(application: Application):
+    # Модули обработчиков импортируются только при регистрации: импорт bot_handlers
+    # (скрипты, замеры) не тянет за собой все диалоги
+    from handlers import start, write_off, expense, project, status_change, ferma_write_off, delivery, instrument, new_instrument, web_write_off, purchase
+    from handlers.report_issue import start_report_issue, save_issue, back_to_menu  # Добавлен импорт для report_issue
+
     auth_conv = ConversationHandler(
         entry_points=[CommandHandler("start", start.start)],
         states={
@@ -29,9 +32,11 @@ def register_handlers(application: Application):
             ],
             write_off.SELECT_CATEGORY: [
                 CallbackQueryHandler(write_off.select_category),
+                MessageHandler(filters.Document.ALL, write_off.import_write_off_file),
             ],
             write_off.SELECT_MATERIAL: [
                 CallbackQueryHandler(write_off.select_material),
+                MessageHandler(filters.Document.ALL, write_off.import_write_off_file),
                 CallbackQueryHandler(write_off.manual_material, pattern="manual_material"),
                 CallbackQueryHandler(write_off.submit_materials, pattern="submit"),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, write_off.manual_material_entry),
@@ -85,7 +90,8 @@ def register_handlers(application: Application):
         entry_points=[CallbackQueryHandler(ferma_write_off.start_ferma_write_off, pattern="ferma_write_off")],
         states={
             ferma_write_off.FERMA_PROJECT: [
-                CallbackQueryHandler(ferma_write_off.select_ferma_project)
+                CallbackQueryHandler(ferma_write_off.select_ferma_project),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, ferma_write_off.quick_ferma_write_off)
             ],
             ferma_write_off.FERMA_TYPE: [
                 CallbackQueryHandler(ferma_write_off.select_ferma_type)
@@ -96,6 +102,9 @@ def register_handlers(application: Application):
             ferma_write_off.FERMA_MATERIAL: [
                 CallbackQueryHandler(ferma_write_off.select_ferma_material),
                 CallbackQueryHandler(ferma_write_off.submit_ferma, pattern="submit"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, ferma_write_off.search_ferma_material)
+            ],
+            ferma_write_off.FERMA_MATERIAL_QUANTITY: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, ferma_write_off.enter_ferma_material_quantity)
             ],
             ferma_write_off.FERMA_CAT: [
@@ -141,7 +150,8 @@ def register_handlers(application: Application):
             instrument.RECIPIENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument.recipient)],
             instrument.SELECT_INSTRUMENT: [
                 CallbackQueryHandler(instrument.select_instrument),  # pattern убран!
-                CallbackQueryHandler(instrument.submit_instrument, pattern="submit")
+                CallbackQueryHandler(instrument.submit_instrument, pattern="submit"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, instrument.search_instrument)
             ],
             instrument.ENTER_QUANTITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument.enter_quantity)],
             instrument.SUBMIT: [CallbackQueryHandler(instrument.submit_instrument, pattern="submit")]
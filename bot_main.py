@@ -1,15 +1,17 @@
 #bot_main.py
+import datetime
 import logging
 import os
-import json
 from telegram.ext import Application
-from config import BOT_TOKEN
-from sheets import load_caches, caches
+from config import BOT_TOKEN, WARM_START, WARM_START_RETRY_DELAYS, CACHE_SNAPSHOT_FILE, CACHE_REFRESH_TIMES
+from sheets import (
+    aload_caches, caches, drain_ledgers, restore_caches_snapshot, save_caches_snapshot, start_ledgers
+)
+from scheduler import parse_schedule, run_schedule
+from snapshot import SnapshotError
 from bot_handlers import register_handlers
 import asyncio
 
-CACHE_FILE = 'cach.json'
-
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -17,45 +19,76 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 def load_cache_from_file():
-    if os.path.exists(CACHE_FILE):
+    if os.path.exists(CACHE_SNAPSHOT_FILE):
         try:
-            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                loaded_cache = json.load(f)
-                caches.update(loaded_cache)
-            logger.info("Кэш успешно загружен из файла.")
+            restore_caches_snapshot()
+            logger.info(f"Кэш успешно загружен из снимка, возраст снимка: {format_cache_age()}.")
             return True
-        except json.JSONDecodeError:
-            logger.warning("Файл кэша повреждён, будет загружен из Google Sheets.")
+        except SnapshotError as e:
+            logger.warning(f"Снимок кэша не прочитан ({e}), будет загружен из Google Sheets.")
             return False
-    logger.info("Файл кэша отсутствует, загрузка из Google Sheets.")
+    logger.info("Снимка кэша нет, загрузка из Google Sheets.")
     return False
 
+def format_cache_age():
+    last_updated = caches.get("last_updated")
+    if not isinstance(last_updated, datetime.datetime):
+        return "неизвестен"
+    return str(datetime.datetime.now() - last_updated).split(".")[0]
+
 def save_cache_to_file():
-    import datetime
-    def convert_datetime(obj):
-        if isinstance(obj, (datetime.datetime, datetime.date)):
-            return obj.isoformat()
-        return obj
-    try:
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(caches, f, ensure_ascii=False, indent=4, default=convert_datetime)
-        logger.info("Кэш успешно сохранён в файл.")
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении кэша: {e}")
+    # Снимок пишется атомарно (временный файл + rename), повреждённым он не останется
+    return save_caches_snapshot()
 
 async def shutdown(application):
     if application:
-        save_cache_to_file()
+        # Дописываем в таблицу всё, что ещё стоит в очереди; остальное дождётся следующего запуска в журнале.
+        # Ожидание очередей и запись снимка блокируют — выполняем их в потоке, цикл событий не стоит
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, drain_ledgers, 30):
+            logger.warning("Очереди записи не опустели за 30 секунд, недописанное останется в журнале.")
+        await loop.run_in_executor(None, save_cache_to_file)
         await application.stop()
         await application.updater.stop()
         logger.info("Бот завершил работу.")
 
+async def refresh_cache_in_background():
+    """Обновляет кэш из Google Sheets, пока бот уже обслуживает пользователей по снимку"""
+    delays = list(WARM_START_RETRY_DELAYS)
+    while True:
+        snapshot_age = format_cache_age()
+        try:
+            await aload_caches(force=True)
+            logger.info(f"Кэш обновлён из Google Sheets в фоне (снимок был возрастом {snapshot_age}).")
+            return
+        except Exception as e:
+            delay = delays.pop(0) if len(delays) > 1 else delays[0]
+            logger.warning(f"Фоновое обновление кэша не удалось: {e}. Работаем по снимку возрастом {snapshot_age}, повтор через {delay} с.")
+            await asyncio.sleep(delay)
+
 async def main():
     application = None
+    refresh_task = None
+    schedule_task = None
     try:
-        load_cache_from_file()
-        load_caches(force=True)
-        save_cache_to_file()
+        schedule = parse_schedule(CACHE_REFRESH_TIMES)
+        # Снимок читается всегда: если первая загрузка из таблицы не удастся, бот работает по нему.
+        # WARM_START решает только, ждать ли эту загрузку до начала работы
+        restored = load_cache_from_file()
+        warm = WARM_START and restored
+        if not warm:
+            try:
+                await aload_caches(force=True)  # снимок сохраняется внутри load_caches
+            except Exception as e:
+                if not restored:
+                    raise
+                logger.warning(f"Загрузка кэша из Google Sheets не удалась: {e}. Работаем по снимку возрастом {format_cache_age()}, обновление повторится в фоне.")
+                warm = True
+
+        # Отправки, не дошедшие до таблицы в прошлый раз, уходят в фоне
+        recovered = start_ledgers()
+        if recovered:
+            logger.info(f"Из журнала поставлено на повторную отправку: {recovered}")
 
         application = Application.builder().token(BOT_TOKEN).build()
         register_handlers(application)
@@ -67,6 +100,14 @@ async def main():
             timeout=10,
             drop_pending_updates=True
         )
+        if warm:
+            # Не через application.create_task: при остановке PTB дожидается таких задач
+            refresh_task = asyncio.create_task(refresh_cache_in_background(), name="warm_start_refresh")
+        if schedule:
+            # Плановые и ручные обновления не пересекаются: aload_caches ждёт уже идущее
+            schedule_task = asyncio.create_task(
+                run_schedule(schedule, lambda: aload_caches(force=True)), name="cache_schedule"
+            )
 
         loop = asyncio.get_running_loop()
         stop_event = asyncio.Event()
@@ -79,6 +120,9 @@ async def main():
         logger.error(f"Ошибка при запуске бота: {e}")
         raise
     finally:
+        for task in (refresh_task, schedule_task):
+            if task and not task.done():
+                task.cancel()
         await shutdown(application)
 
 if __name__ == '__main__':
@@ -0,0 +1,224 @@
+# bulk_import.py
+# Списание материалов файлом: CSV (стандартный csv) или XLSX (openpyxl, если установлен).
+# Файл читается построчно и не загружается в память целиком. В памяти остаются суммы по материалам
+# каталога (не больше размера каталога), а сводки приблизительных и непонятных названий и кэш
+# сопоставлений ограничены константами ниже — не длиной файла. Запись в "Данные" — одна отправка,
+# как у обычной корзины.
+import codecs
+import csv
+from collections import Counter
+from config import IMPORT_MAX_ROWS
+from search import normalize
+from sheets import get_material, get_material_by_name, match_catalog
+
+SUPPORTED_EXTENSIONS = {".csv": "csv", ".txt": "csv", ".xlsx": "xlsx", ".xlsm": "xlsx"}
+
+# Заголовки колонок (первая строка файла); без заголовка: наименование, количество
+NAME_HEADERS = ("наименование", "материал", "название", "номенклатура")
+QUANTITY_HEADERS = ("кол", "qty", "quantity")
+ID_HEADERS = ("id", "код", "артикул")
+
+CSV_SAMPLE_SIZE = 64 * 1024     # по этому началу файла определяются кодировка и разделитель
+UNKNOWN_LIMIT = 1000            # сколько разных непонятных названий помним для сводки
+FUZZY_LIMIT = 1000              # сколько приблизительных сопоставлений помним для сводки
+RESOLVED_LIMIT = 5000           # сколько разных названий помним сопоставленными; дальше — сопоставление каждой строки
+INVALID_LINES_LIMIT = 20        # сколько номеров строк без количества показываем
+
+
+class ImportFileError(Exception):
+    """Файл нельзя разобрать: неизвестный формат, нет openpyxl, слишком много строк"""
+
+
+def file_kind(filename):
+    name = str(filename or "").lower()
+    for extension, kind in SUPPORTED_EXTENSIONS.items():
+        if name.endswith(extension):
+            return kind
+    return None
+
+
+def csv_dialect(path):
+    """Кодировка и разделитель по началу файла: UTF-8 (в том числе с BOM) или cp1251 из Excel"""
+    with open(path, "rb") as f:
+        sample = f.read(CSV_SAMPLE_SIZE)
+    try:
+        # Инкрементальный декодер не спотыкается о символ, обрезанный границей образца
+        text = codecs.getincrementaldecoder("utf-8-sig")().decode(sample, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        text, encoding = sample.decode("cp1251", errors="replace"), "cp1251"
+    if len(sample) == CSV_SAMPLE_SIZE:
+        text = text[:text.rfind("\n") + 1] or text
+    try:
+        delimiter = csv.Sniffer().sniff(text, delimiters=";,\t").delimiter
+    except csv.Error:
+        delimiter = ";"
+    return encoding, delimiter
+
+
+def iter_csv(path):
+    encoding, delimiter = csv_dialect(path)
+    try:
+        with open(path, encoding=encoding, newline="") as f:
+            yield from csv.reader(f, delimiter=delimiter)
+    except UnicodeDecodeError:
+        raise ImportFileError("Не удалось определить кодировку файла. Сохраните его как CSV UTF-8.")
+
+
+def iter_xlsx(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError(
+            "Файлы Excel не поддерживаются: на сервере не установлен openpyxl. "
+            "Сохраните таблицу как CSV (Файл → Сохранить как → CSV) и отправьте снова."
+        )
+    try:
+        # read_only: строки читаются по мере обхода, лист не строится в памяти целиком
+        workbook = load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFileError(f"Не удалось открыть файл Excel: {e}")
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if cell is None else cell for cell in row]
+    finally:
+        workbook.close()
+
+
+def iter_rows(path, kind):
+    return iter_xlsx(path) if kind == "xlsx" else iter_csv(path)
+
+
+def parse_quantity(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace("\xa0", "").replace(" ", "").replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def find_columns(row):
+    """Номера колонок (наименование, количество, ID) по строке заголовка или None, если это не заголовок"""
+    columns = {}
+    for i, cell in enumerate(row):
+        title = str(cell).strip().lower()
+        if not title:
+            continue
+        if "name" not in columns and title.startswith(NAME_HEADERS):
+            columns["name"] = i
+        elif "quantity" not in columns and title.startswith(QUANTITY_HEADERS):
+            columns["quantity"] = i
+        elif "id" not in columns and title.startswith(ID_HEADERS):
+            columns["id"] = i
+    if "quantity" not in columns or not ({"name", "id"} & columns.keys()):
+        return None
+    return columns
+
+
+def cell(row, index):
+    return row[index] if index is not None and index < len(row) else ""
+
+
+def resolve_material(material_id, name):
+    """(материал, точно ли) по ID или названию; приблизительно — только уверенное совпадение"""
+    if str(material_id).strip():
+        material = get_material(str(material_id).strip())
+        if material:
+            return material, True
+    material = get_material_by_name(name)
+    if material:
+        return material, True
+    found = match_catalog(name) if normalize(name) else None
+    if found and found[2]:
+        return found[1], False
+    return None, False
+
+
+def read_write_offs(path, kind):
+    """Разбирает файл списания. Возвращает словарь:
+    quantities — {ID материала: суммарное количество} в порядке первого появления;
+    fuzzy — {введённое название: название из каталога} для приблизительных совпадений
+            (не больше FUZZY_LIMIT), fuzzy_rows — их строк;
+    unknown — Counter непонятных названий (не больше UNKNOWN_LIMIT разных), unknown_rows — их строк;
+    invalid_lines — номера строк без количества (первые INVALID_LINES_LIMIT), invalid_rows — их число;
+    rows — строк с данными"""
+    quantities, resolved = {}, {}
+    fuzzy, fuzzy_rows = {}, 0
+    unknown, unknown_rows = Counter(), 0
+    invalid_lines, invalid_rows = [], 0
+    columns, rows = None, 0
+    for line, row in enumerate(iter_rows(path, kind), start=1):
+        if not any(str(value).strip() for value in row):
+            continue
+        if columns is None:
+            columns = find_columns(row)
+            if columns is not None:
+                continue
+            columns = {"name": 0, "quantity": 1}
+        rows += 1
+        if rows > IMPORT_MAX_ROWS:
+            raise ImportFileError(f"В файле больше {IMPORT_MAX_ROWS} строк. Разделите его на части.")
+        material_id = str(cell(row, columns.get("id"))).strip()
+        name = str(cell(row, columns.get("name"))).strip()
+        quantity = parse_quantity(cell(row, columns["quantity"]))
+        if quantity is None or quantity <= 0:
+            invalid_rows += 1
+            if len(invalid_lines) < INVALID_LINES_LIMIT:
+                invalid_lines.append(line)
+            continue
+        # Одинаковые названия в файле повторяются — сопоставляем каждое один раз
+        key = (material_id, name)
+        found = resolved.get(key)
+        if found is None:
+            found = resolve_material(material_id, name)
+            if len(resolved) < RESOLVED_LIMIT:
+                resolved[key] = found
+        material, exact = found
+        if material is None:
+            unknown_rows += 1
+            label = name or material_id
+            if label in unknown or len(unknown) < UNKNOWN_LIMIT:
+                unknown[label] += 1
+            continue
+        if not exact:
+            fuzzy_rows += 1
+            if name in fuzzy or len(fuzzy) < FUZZY_LIMIT:
+                fuzzy.setdefault(name, material.get("Наименование", name))
+        mat_id = str(material.get("ID"))
+        quantities[mat_id] = quantities.get(mat_id, 0) + quantity
+    return {
+        "quantities": quantities, "fuzzy": fuzzy, "fuzzy_rows": fuzzy_rows,
+        "unknown": unknown, "unknown_rows": unknown_rows,
+        "invalid_lines": invalid_lines, "invalid_rows": invalid_rows, "rows": rows
+    }
+
+
+def format_import_summary(result, limit=15):
+    """Сводка для подтверждения: сколько распознано, что сопоставлено приблизительно и что не найдено"""
+    lines = [
+        f"Строк в файле: {result['rows']}",
+        f"Распознано материалов: {len(result['quantities'])} "
+        f"(строк: {result['rows'] - result['unknown_rows'] - result['invalid_rows']})"
+    ]
+    if result["fuzzy"]:
+        lines.append("")
+        lines.append(f"Сопоставлено по похожему названию (строк: {result['fuzzy_rows']}), проверьте:")
+        lines.extend(f"≈ {typed} → {name}" for typed, name in list(result["fuzzy"].items())[:limit])
+        if len(result["fuzzy"]) > limit:
+            lines.append(f"… и ещё {len(result['fuzzy']) - limit}")
+    if result["unknown_rows"]:
+        lines.append("")
+        lines.append(f"Нет в каталоге, не будут списаны (строк: {result['unknown_rows']}):")
+        lines.extend(f"• {name} ×{count}" for name, count in result["unknown"].most_common(limit))
+        if len(result["unknown"]) > limit:
+            lines.append(f"… и ещё {len(result['unknown']) - limit} названий")
+    if result["invalid_rows"]:
+        lines.append("")
+        shown = ", ".join(map(str, result["invalid_lines"]))
+        more = "…" if result["invalid_rows"] > len(result["invalid_lines"]) else ""
+        lines.append(f"Без количества, не будут списаны (строк: {result['invalid_rows']}): {shown}{more}")
+    return "\n".join(lines)
@@ -1,15 +1,64 @@
 # config.py
 from decouple import config
-import gspread
-from google.oauth2.service_account import Credentials
 
 BOT_TOKEN = config("BOT_TOKEN", default="7572773238:AAHRqTdV3uutzW1t1ugt8fZ8Bo3X-agsslA")
 SPREADSHEET_ID = config("SPREADSHEET_ID", default="1qqvqutnkSradMpgji3Yhq3sxpnKg4109i9_bCpr-1VE")
 SERVICE_ACCOUNT_FILE = config("SERVICE_ACCOUNT_FILE", default="service_account.json")
 
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=scope)
-client = gspread.authorize(creds)
+# Очередь записи в лист "Данные": размер пачки (строк) и максимальная задержка (сек)
+LEDGER_BATCH_SIZE = config("LEDGER_BATCH_SIZE", default=200, cast=int)
+LEDGER_FLUSH_DELAY = config("LEDGER_FLUSH_DELAY", default=0.5, cast=float)
+# Локальный журнал отправок: запись подтверждается после fsync, в таблицу уходит в фоне
+LEDGER_JOURNAL_FILE = config("LEDGER_JOURNAL_FILE", default="ledger.journal")
+LEDGER_RETRY_DELAY = config("LEDGER_RETRY_DELAY", default=5.0, cast=float)  # первая пауза перед повтором (сек)
+# Сколько помним отправленные корзины: повторное нажатие "Отправить" в этот срок не пишет строки ещё раз
+SUBMIT_DEDUPE_TTL = config("SUBMIT_DEDUPE_TTL", default=600, cast=float)
+
+# Загрузка списаний файлом CSV/XLSX: предельный размер файла (байт) и число строк
+IMPORT_MAX_FILE_SIZE = config("IMPORT_MAX_FILE_SIZE", default=10 * 1024 * 1024, cast=int)
+IMPORT_MAX_ROWS = config("IMPORT_MAX_ROWS", default=20000, cast=int)
+
+# Асинхронный доступ к таблице: размер пула потоков и таймауты вызовов (сек)
+SHEETS_MAX_WORKERS = config("SHEETS_MAX_WORKERS", default=4, cast=int)
+SHEETS_CALL_TIMEOUT = config("SHEETS_CALL_TIMEOUT", default=30, cast=float)
+SHEETS_LOAD_TIMEOUT = config("SHEETS_LOAD_TIMEOUT", default=120, cast=float)
+
+# Тёплый старт: начинаем работу со снимка кэша, обновление из Google Sheets идёт в фоне.
+# Без него бот ждёт загрузки из таблицы; снимок читается в обоих случаях и выручает, если она не удалась
+WARM_START = config("WARM_START", default=True, cast=bool)
+CACHE_SNAPSHOT_FILE = config("CACHE_SNAPSHOT_FILE", default="cach.snapshot")
+
+# Инкрементальная загрузка листов, которые только дописываются: полная перезагрузка раз в N обновлений
+SYNC_FULL_RELOAD_EVERY = config("SYNC_FULL_RELOAD_EVERY", default=24, cast=int)
+# Обновления, пропущенные из-за неизменного времени изменения таблицы (Drive сдвигает его с задержкой):
+# после стольких пропусков подряд листы загружаются и сверяются по контрольным суммам
+SOURCE_SKIP_LIMIT = config("SOURCE_SKIP_LIMIT", default=6, cast=int)
+WARM_START_RETRY_DELAYS = [30, 60, 120, 300]  # паузы между повторами фонового обновления (сек)
+# Обновление кэша по расписанию: время "ЧЧ:ММ" через запятую, перед ним можно указать дни недели,
+# записи разделяются ";" ("пн-пт 08:00,20:00; сб,вс 12:00"). Пустая строка — только вручную
+CACHE_REFRESH_TIMES = config("CACHE_REFRESH_TIMES", default="08:00,20:00")
+
+# Хранилище таблиц: "gspread" (Google Sheets) или "fake" (в памяти, заполняется из cach.json)
+SHEETS_BACKEND = config("SHEETS_BACKEND", default="gspread")
+FAKE_SEED_FILE = config("FAKE_SEED_FILE", default="cach.json")
+FAKE_LATENCY = config("FAKE_LATENCY", default=0.0, cast=float)                    # задержка каждого вызова (сек)
+FAKE_QUOTA_ERROR_RATE = config("FAKE_QUOTA_ERROR_RATE", default=0.0, cast=float)  # доля вызовов с ошибкой 429
+
+# Квота Sheets API (запросов в минуту на пользователя) и запас на всплеск
+SHEETS_READS_PER_MINUTE = config("SHEETS_READS_PER_MINUTE", default=60, cast=int)
+SHEETS_WRITES_PER_MINUTE = config("SHEETS_WRITES_PER_MINUTE", default=60, cast=int)
+SHEETS_RATE_BURST = config("SHEETS_RATE_BURST", default=10, cast=int)
+# Повторы на 429/5xx: число попыток, базовая и максимальная задержка (сек)
+SHEETS_RETRY_ATTEMPTS = config("SHEETS_RETRY_ATTEMPTS", default=4, cast=int)
+SHEETS_RETRY_BASE_DELAY = config("SHEETS_RETRY_BASE_DELAY", default=1.0, cast=float)
+SHEETS_RETRY_MAX_DELAY = config("SHEETS_RETRY_MAX_DELAY", default=16.0, cast=float)
+# Предохранитель: после N подряд неудачных вызовов отклоняем всё на cooldown секунд
+SHEETS_BREAKER_THRESHOLD = config("SHEETS_BREAKER_THRESHOLD", default=5, cast=int)
+SHEETS_BREAKER_COOLDOWN = config("SHEETS_BREAKER_COOLDOWN", default=60, cast=float)
+# Общий пул keep-alive соединений к Google для всех потоков (пул потоков, очереди журналов, обновление кэша)
+SHEETS_HTTP_POOL_SIZE = config("SHEETS_HTTP_POOL_SIZE", default=16, cast=int)
+# OAuth-токен обновляется в фоне за столько секунд до истечения, а не на пути запроса
+SHEETS_TOKEN_REFRESH_MARGIN = config("SHEETS_TOKEN_REFRESH_MARGIN", default=300, cast=float)
 
 ALLOWED_STATUSES = [
     "В работе", "Продукция готова", "Приостановлен", "Проект готов", "Строительство"
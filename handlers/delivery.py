@@ -3,11 +3,10 @@ import logging
 import datetime
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
-from sheets import get_projects_list, record_delivery, caches
-from utils import build_project_keyboard
+from sheets import get_projects_list, arecord_delivery, get_project, get_employee_fullname
+from utils import build_project_keyboard, new_cart_id
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)  # Подробные логи
 
 SELECT_PROJECT, SELECT_DEPARTMENT, ENTER_AMOUNT, ENTER_NOTE, SUBMIT_DELIVERY = range(1, 6)
 
@@ -23,7 +22,8 @@ async def start_delivery(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.callback_query.message.reply_text("Нет доступных проектов для доставки.")
         logger.warning(f"User {user_id}: Проекты не найдены")
         return ConversationHandler.END
-    reply_markup = build_project_keyboard(projects)
+    context.user_data["cart_id"] = new_cart_id()
+    reply_markup = build_project_keyboard(projects, cache_key=role)
     keyboard = list(reply_markup.inline_keyboard)
     keyboard.append([InlineKeyboardButton("Накладные", callback_data="proj_Накладные")])
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -127,15 +127,13 @@ async def submit_delivery(update: Update, context: ContextTypes.DEFAULT_TYPE, is
     department = context.user_data.get("delivery_department", "Строительство")
     note = context.user_data.get("delivery_note", "")
     login = str(context.user_data.get("login", "unknown"))
-    employee_data = next((emp for emp in caches["employees"] if str(emp["Логин"]) == login), None)
-    user = employee_data["Ф.И.О"] if employee_data else login
+    user = get_employee_fullname(login)
     date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     # --- Исправление: вытаскиваем "Номер договора" ---
     project_num = project
     if project != "Накладные" and project != "unknown":
-        all_projects = caches.get("projects", [])
-        found = next((p for p in all_projects if str(p.get("ID проекта")) == str(project)), None)
+        found = get_project(project_id=project)
         if found:
             project_num = found.get("Номер договора", project)
 
@@ -146,7 +144,7 @@ async def submit_delivery(update: Update, context: ContextTypes.DEFAULT_TYPE, is
         )
         return ConversationHandler.END
     record = [date, "Расход", user, "", department, "Доставка", 1, "", "", amount, project_num, note]
-    if record_delivery([record]):
+    if await arecord_delivery([record], context.user_data.get("cart_id")):
         text = f"Доставка на сумму {amount} для '{project_num}' ({department}) успешно записана!"
         if note:
             text += f"\nПримечание: {note}"
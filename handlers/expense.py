@@ -2,8 +2,11 @@ import logging
 import datetime
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
-from sheets import get_projects_list, record_expense, get_project_direction, get_role_permissions, caches
-from utils import build_project_keyboard
+from sheets import (
+    get_projects_list, arecord_expense, get_project_direction, get_role_permissions,
+    get_project, get_employee_fullname
+)
+from utils import build_project_keyboard, new_cart_id
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +19,7 @@ async def start_add_expense(update: Update, context: ContextTypes.DEFAULT_TYPE)
     logger.info(f"User {user_id}: Начало добавления расхода, роль={role}")
     projects = get_projects_list(role)
     logger.info(f"User {user_id}: Найдено {len(projects)} проектов для добавления расхода")
+    context.user_data["cart_id"] = new_cart_id()
     keyboard = [
         [InlineKeyboardButton(f"{p['Номер договора']} ({p['Ф.И.О заказчика']})", callback_data=f"proj_{p['Номер договора']}")]
         for p in projects if p.get('Номер договора')
@@ -40,7 +44,7 @@ async def select_project(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data["expense_project"] = "Накладные"
     else:
         # Проверяем есть ли такой проект по номеру договора!
-        project = next((p for p in get_projects_list(role) if str(p["Номер договора"]) == str(project_tag)), None)
+        project = get_project(number=project_tag, role=role)
         if not project:
             logger.warning(f"User {user_id}: Проект '{project_tag}' не найден")
             await query.edit_message_text(
@@ -102,8 +106,7 @@ async def submit_expense(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     project = context.user_data.get("expense_project", "unknown")
     details = context.user_data.get("expense_details", {})
     login = str(context.user_data.get("login", "unknown"))
-    employee_data = next((emp for emp in caches["employees"] if str(emp["Логин"]) == login), None)
-    user = employee_data["Ф.И.О"] if employee_data else login
+    user = get_employee_fullname(login)
     date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     total_price = details["quantity"] * details["amount"]
     direction = "Накладные" if project == "Накладные" else context.user_data.get("department", "Строительство")
@@ -112,13 +115,12 @@ async def submit_expense(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     project_num = project
     if project not in ("Накладные", "unknown"):
         # Находим по номеру договора "правильный" вариант, если нужно (можно убрать этот шаг)
-        all_projects = caches.get("projects", [])
-        found = next((p for p in all_projects if str(p.get("Номер договора")) == str(project)), None)
+        found = get_project(number=project)
         if found:
             project_num = found.get("Номер договора", project)
 
     record = [date, "Расход", user, "Наличные", direction, details["name"], details["quantity"], details["unit"], "", details["amount"], project_num]
-    if record_expense([record]):
+    if await arecord_expense([record], context.user_data.get("cart_id")):
         text = f"Расход '{details['name']}' на сумму {total_price} для '{project_num}' (отдел: {direction}) успешно записан!"
         await query.edit_message_text(
             text,
@@ -3,25 +3,19 @@ import datetime
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 from sheets import (
-    get_projects_list, get_materials_by_category, record_ferma_write_off, caches,
-    parse_plate_categories_and_plates
+    get_projects_list, get_materials_by_category, arecord_ferma_write_off, caches,
+    get_project, get_material, get_plate, get_employee_fullname,
+    get_plate_categories, get_plates_by_category, get_cache_version, search_materials
 )
-from utils import build_project_keyboard
+from utils import build_project_keyboard, build_category_keyboard, catalog_rows, new_cart_id
+from quick_entry import QUICK_ENTRY_HINT, resolve_quick_entry, format_quick_entry
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
 FERMA_PROJECT, FERMA_TYPE, FERMA_MATERIAL_CAT, FERMA_MATERIAL, FERMA_CAT, FERMA_PLATE, FERMA_MATERIAL_QUANTITY, FERMA_PLATE_QUANTITY = range(8)
 
-def get_fullname_by_login(login):
-    employees = caches.get("employees", [])
-    for emp in employees:
-        if str(emp.get("Логин", "")) == str(login):
-            return emp.get("Ф.И.О", str(login))
-    return str(login)
-
 async def start_ferma_write_off(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    print("!!! КНОПКА СПИСАТЬ МАТЕРИАЛЫ НА ФЕРМЫ НАЖАТА !!!")
+    logger.debug(f"User {update.effective_user.id}: Нажата кнопка 'Списать материалы на фермы'")
     await update.callback_query.answer()
     role = context.user_data.get("role", "")
     projects = get_projects_list(role)
@@ -33,9 +27,10 @@ async def start_ferma_write_off(update: Update, context: ContextTypes.DEFAULT_TY
         return ConversationHandler.END
     context.user_data["ferma_items"] = {}        # Пластины
     context.user_data["ferma_mat_inputs"] = {}   # Материалы
-    reply_markup = build_project_keyboard(projects)
+    context.user_data["cart_id"] = new_cart_id()
+    reply_markup = build_project_keyboard(projects, cache_key=role)
     await update.callback_query.edit_message_text(
-        "Выберите проект для списания на фермы:", reply_markup=reply_markup
+        f"Выберите проект для списания на фермы:\n\n{QUICK_ENTRY_HINT}", reply_markup=reply_markup
     )
     return FERMA_PROJECT
 
@@ -44,7 +39,7 @@ async def select_ferma_project(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
     tag = query.data.replace("proj_", "")
     context.user_data["ferma_project_id"] = tag
-    project = next((p for p in get_projects_list(context.user_data.get("role", "")) if str(p["ID проекта"]) == tag), None)
+    project = get_project(project_id=tag, role=context.user_data.get("role", ""))
     if not project:
         await query.edit_message_text(
             f"Проект '{tag}' не найден.",
@@ -62,6 +57,33 @@ async def select_ferma_project(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     return FERMA_TYPE
 
+async def quick_ferma_write_off(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Списание на фермы одним сообщением: позиции ищутся и среди материалов, и среди пластин"""
+    result = resolve_quick_entry(update.message.text, context.user_data.get("role", ""), kinds=("materials", "plates"))
+    if result is None or not result["project"]:
+        text = format_quick_entry(result) if result else "Не удалось разобрать сообщение."
+        await update.message.reply_text(f"{text}\n\nПопробуйте снова.\n{QUICK_ENTRY_HINT}")
+        return FERMA_PROJECT
+    project = result["project"]
+    context.user_data["ferma_project_id"] = project["ID проекта"]
+    context.user_data["ferma_mat_inputs"] = {}
+    context.user_data["ferma_items"] = {}
+    for entry in result["items"].values():
+        target = "ferma_items" if entry["kind"] == "plates" else "ferma_mat_inputs"
+        context.user_data[target][str(entry["item"]["ID"])] = {"quantity": entry["quantity"]}
+    context.user_data["cart_id"] = new_cart_id()
+    logger.info(
+        f"User {update.effective_user.id}: Быстрое списание на фермы, проект '{project['Номер договора']}': "
+        f"позиций {len(result['items'])}, не найдено {len(result['unknown'])}, без количества {len(result['invalid'])}"
+    )
+    keyboard = []
+    if result["items"]:
+        keyboard.append([InlineKeyboardButton("Списать", callback_data="submit")])
+    keyboard.append([InlineKeyboardButton("Изменить по категориям", callback_data="back_to_cat_materials")])
+    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
+    await update.message.reply_text(format_quick_entry(result), reply_markup=InlineKeyboardMarkup(keyboard))
+    return FERMA_MATERIAL
+
 async def select_ferma_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
@@ -71,18 +93,12 @@ async def select_ferma_type(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ConversationHandler.END
     context.user_data["ferma_type"] = query.data
     if query.data == "type_materials":
-        material_categories = caches.get("material_categories", [])
-        keyboard = [[InlineKeyboardButton(cat, callback_data=f"matcat_{cat}")] for cat in material_categories]
-        keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-        await query.edit_message_text("Выберите категорию материалов:", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text("Выберите категорию материалов:", reply_markup=build_material_categories_keyboard())
         return FERMA_MATERIAL_CAT
     else:
-        categories, category_to_plates = parse_plate_categories_and_plates()
-        context.user_data["ferma_plate_categories_list"] = categories
-        context.user_data["ferma_category_to_plates"] = category_to_plates
-        keyboard = [[InlineKeyboardButton(cat, callback_data=f"cat_{cat}")] for cat in categories]
-        keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-        await query.edit_message_text("Выберите категорию пластин:", reply_markup=InlineKeyboardMarkup(keyboard))
+        # Каталог пластин берём из общего кэша; в сессии храним только его версию
+        context.user_data["ferma_plates_version"] = get_cache_version()
+        await query.edit_message_text("Выберите категорию пластин:", reply_markup=build_plate_categories_keyboard())
         return FERMA_CAT
 
 async def select_ferma_material_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -98,34 +114,50 @@ async def select_ferma_material_category(update: Update, context: ContextTypes.D
     cat = query.data.replace("matcat_", "")
     context.user_data["ferma_material_category"] = cat
     materials = get_materials_by_category(cat)
-    reply_markup = build_materials_keyboard_ferma(materials, context.user_data.get("ferma_mat_inputs", {}), show_submit=True)
-    await query.edit_message_text(f"Выберите материал из категории '{cat}':", reply_markup=reply_markup)
+    reply_markup = build_materials_keyboard_ferma(materials, context.user_data.get("ferma_mat_inputs", {}), show_submit=True, cache_key=cat)
+    await query.edit_message_text(
+        f"Выберите материал из категории '{cat}' или отправьте часть названия для поиска:", reply_markup=reply_markup
+    )
     return FERMA_MATERIAL
 
-def build_materials_keyboard_ferma(materials, selected, show_submit=False):
-    keyboard = []
-    for m in materials:
-        mat_id = str(m.get("ID") or m.get("id"))
-        name = m.get("Наименование") or m.get("name")
-        unit = m.get("Ед. измерения", m.get("unit", "шт"))
-        qty = selected.get(mat_id, {}).get("quantity", "")
-        label = f"{name} ({qty})" if qty else f"{name} ({unit})"
-        keyboard.append([InlineKeyboardButton(label, callback_data=f"mat_{mat_id}")])
+async def search_ferma_material(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    text = update.message.text.strip()
+    matches = search_materials(text, limit=10)
+    cat = context.user_data.get("ferma_material_category", "")
+    if not matches:
+        reply_markup = build_materials_keyboard_ferma(get_materials_by_category(cat), context.user_data.get("ferma_mat_inputs", {}), show_submit=True, cache_key=cat)
+        await update.message.reply_text(f"По запросу «{text}» материалы не найдены. Выберите из категории '{cat}':", reply_markup=reply_markup)
+        return FERMA_MATERIAL
+    reply_markup = build_materials_keyboard_ferma(matches, context.user_data.get("ferma_mat_inputs", {}), show_submit=True)
+    await update.message.reply_text(f"Найдено по запросу «{text}»:", reply_markup=reply_markup)
+    return FERMA_MATERIAL
+
+def build_material_categories_keyboard():
+    return build_category_keyboard(caches.get("material_categories") or [], "matcat_", "ferma_materials")
+
+def build_materials_keyboard_ferma(materials, selected, show_submit=False, cache_key=None):
+    # cache_key — категория: её кнопки собираются один раз на версию кэша (общие с write_off)
+    keyboard = catalog_rows("mat_", cache_key, materials, selected)
     if show_submit:
         keyboard.append([InlineKeyboardButton("Отправить отчёт", callback_data="submit")])
     keyboard.append([InlineKeyboardButton("Вернуться к категориям", callback_data="back_to_cat_materials")])
     keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
     return InlineKeyboardMarkup(keyboard)
 
-def build_plates_keyboard_ferma(plates, selected, show_submit=False):
-    keyboard = []
-    for plate in plates:
-        plate_id = str(plate.get("ID") or plate.get("id", ""))
-        plate_name = plate.get("Наименование") or plate.get("name")
-        unit = plate.get("Ед. измерения", plate.get("unit", "шт"))
-        qty = selected.get(plate_id, {}).get("quantity", "")
-        label = f"{plate_name} ({qty})" if qty else f"{plate_name} ({unit})"
-        keyboard.append([InlineKeyboardButton(label, callback_data=f"plate_{plate_id}")])
+def build_plate_categories_keyboard():
+    return build_category_keyboard(get_plate_categories(), "cat_", "plates")
+
+def plates_version_changed(context):
+    # Кэш обновился посреди сессии: дальше работаем с новой версией каталога
+    version = get_cache_version()
+    if context.user_data.get("ferma_plates_version") == version:
+        return False
+    logger.info(f"Каталог пластин обновился: версия {context.user_data.get('ferma_plates_version')} -> {version}")
+    context.user_data["ferma_plates_version"] = version
+    return True
+
+def build_plates_keyboard_ferma(plates, selected, show_submit=False, cache_key=None):
+    keyboard = catalog_rows("plate_", cache_key, plates, selected)
     if show_submit:
         keyboard.append([InlineKeyboardButton("Отправить отчёт", callback_data="submit")])
     keyboard.append([InlineKeyboardButton("Назад к категориям", callback_data="back_to_cat_plates")])
@@ -138,10 +170,7 @@ async def select_ferma_material(update: Update, context: ContextTypes.DEFAULT_TY
     if query.data == "submit":
         return await submit_ferma(update, context)
     if query.data == "back_to_cat_materials":
-        material_categories = caches.get("material_categories", [])
-        keyboard = [[InlineKeyboardButton(cat, callback_data=f"matcat_{cat}")] for cat in material_categories]
-        keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-        await query.edit_message_text("Выберите категорию материалов:", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text("Выберите категорию материалов:", reply_markup=build_material_categories_keyboard())
         return FERMA_MATERIAL_CAT
     if query.data == "main_menu":
         from handlers.start import back_to_menu
@@ -150,9 +179,7 @@ async def select_ferma_material(update: Update, context: ContextTypes.DEFAULT_TY
     if query.data.startswith("mat_"):
         mat_id = query.data.replace("mat_", "")
         context.user_data["ferma_current_material_id"] = mat_id
-        cat = context.user_data.get("ferma_material_category", "")
-        materials = get_materials_by_category(cat)
-        material = next((m for m in materials if str(m.get("ID") or m.get("id")) == mat_id), None)
+        material = get_material(mat_id)
         unit = material["Ед. измерения"] if material else "шт"
         name = material["Наименование"] if material else mat_id
         await query.edit_message_text(f"Введите количество для {name} ({unit}):")
@@ -172,7 +199,7 @@ async def enter_ferma_material_quantity(update: Update, context: ContextTypes.DE
     context.user_data.setdefault("ferma_mat_inputs", {})[str(item_id)] = {"quantity": quantity}
     cat = context.user_data.get("ferma_material_category", "")
     materials = get_materials_by_category(cat)
-    reply_markup = build_materials_keyboard_ferma(materials, context.user_data["ferma_mat_inputs"], show_submit=True)
+    reply_markup = build_materials_keyboard_ferma(materials, context.user_data["ferma_mat_inputs"], show_submit=True, cache_key=cat)
     await update.message.reply_text("Выберите следующий материал или отправьте:", reply_markup=reply_markup)
     return FERMA_MATERIAL
 
@@ -182,10 +209,12 @@ async def select_plate_category(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     cat = query.data.replace("cat_", "")
+    if plates_version_changed(context) and cat not in get_plate_categories():
+        await query.edit_message_text("Каталог пластин обновился. Выберите категорию пластин:", reply_markup=build_plate_categories_keyboard())
+        return FERMA_CAT
     context.user_data["ferma_plate_category"] = cat
-    category_to_plates = context.user_data.get("ferma_category_to_plates", {})
-    plates = category_to_plates.get(cat, [])
-    reply_markup = build_plates_keyboard_ferma(plates, context.user_data.get("ferma_items", {}), show_submit=True)
+    plates = get_plates_by_category(cat)
+    reply_markup = build_plates_keyboard_ferma(plates, context.user_data.get("ferma_items", {}), show_submit=True, cache_key=cat)
     await query.edit_message_text(f"Выберите пластину категории {cat}:", reply_markup=reply_markup)
     return FERMA_PLATE
 
@@ -195,10 +224,7 @@ async def select_ferma_plate(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if query.data == "submit":
         return await submit_ferma(update, context)
     if query.data == "back_to_cat_plates":
-        categories = context.user_data.get("ferma_plate_categories_list", [])
-        keyboard = [[InlineKeyboardButton(cat, callback_data=f"cat_{cat}")] for cat in categories]
-        keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-        await query.edit_message_text("Выберите категорию пластин:", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text("Выберите категорию пластин:", reply_markup=build_plate_categories_keyboard())
         return FERMA_CAT
     if query.data == "main_menu":
         from handlers.start import back_to_menu
@@ -207,10 +233,7 @@ async def select_ferma_plate(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if query.data.startswith("plate_"):
         plate_id = query.data.replace("plate_", "")
         context.user_data["ferma_current_plate_id"] = plate_id
-        cat = context.user_data.get("ferma_plate_category", "")
-        category_to_plates = context.user_data.get("ferma_category_to_plates", {})
-        plates = category_to_plates.get(cat, [])
-        plate = next((p for p in plates if str(p.get("ID") or p.get("id")) == plate_id), None)
+        plate = get_plate(plate_id)
         unit = plate.get("Ед. измерения", plate.get("unit", "шт")) if plate else "шт"
         name = plate.get("Наименование", plate.get("name", plate_id)) if plate else plate_id
         await query.edit_message_text(f"Введите количество для {name} ({unit}):")
@@ -229,9 +252,8 @@ async def enter_ferma_plate_quantity(update: Update, context: ContextTypes.DEFAU
     item_id = context.user_data.get("ferma_current_plate_id", "")
     context.user_data.setdefault("ferma_items", {})[str(item_id)] = {"quantity": quantity}
     cat = context.user_data.get("ferma_plate_category", "")
-    category_to_plates = context.user_data.get("ferma_category_to_plates", {})
-    plates = category_to_plates.get(cat, [])
-    reply_markup = build_plates_keyboard_ferma(plates, context.user_data["ferma_items"], show_submit=True)
+    plates = get_plates_by_category(cat)
+    reply_markup = build_plates_keyboard_ferma(plates, context.user_data["ferma_items"], show_submit=True, cache_key=cat)
     await update.message.reply_text("Выберите следующую пластину или отправьте:", reply_markup=reply_markup)
     return FERMA_PLATE
 
@@ -242,22 +264,16 @@ async def submit_ferma(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     ferma_items = context.user_data.get("ferma_items", {})
     ferma_mat_inputs = context.user_data.get("ferma_mat_inputs", {})
     project_id = context.user_data.get("ferma_project_id", "")
-    project = next((p for p in get_projects_list(context.user_data.get("role", "")) if str(p["ID проекта"]) == project_id), {})
+    project = get_project(project_id=project_id, role=context.user_data.get("role", "")) or {}
     project_num = project.get("Номер договора", project_id)
     direction = "Фермы"
-    fullname = get_fullname_by_login(context.user_data.get("login", ""))
+    fullname = get_employee_fullname(context.user_data.get("login", ""))
     records = []
 
     # Материалы:
     for item_id, v in ferma_mat_inputs.items():
-        cat = None
-        for mat_cat in caches.get("material_categories", []):
-            mats = get_materials_by_category(mat_cat)
-            material = next((m for m in mats if str(m.get("ID") or m.get("id")) == item_id), None)
-            if material:
-                cat = material
-                break
-        name = cat.get("Наименование") if cat else item_id
+        material = get_material(item_id)
+        name = material.get("Наименование") if material else item_id
         records.append([
             datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "Расход", fullname, "", direction,
             name, v["quantity"], "", "", "", project_num
@@ -265,15 +281,9 @@ async def submit_ferma(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
     # Пластины:
     if ferma_items:
-        category_to_plates = context.user_data.get("ferma_category_to_plates", {})
-        id_to_name = {}
-        for cat_list in category_to_plates.values():
-            for plate in cat_list:
-                pid = str(plate.get("ID") or plate.get("id"))
-                pname = plate.get("Наименование") or plate.get("name")
-                id_to_name[pid] = pname
         for item_id, v in ferma_items.items():
-            name = id_to_name.get(str(item_id), str(item_id))
+            plate = get_plate(item_id)
+            name = plate.get("Наименование") if plate else str(item_id)
             records.append([
                 datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "Расход", fullname, "", direction,
                 name, v["quantity"], "", "", "", project_num
@@ -282,7 +292,7 @@ async def submit_ferma(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         await query.edit_message_text("Не выбрано ни одного материала для списания.")
         return ConversationHandler.END
 
-    if record_ferma_write_off(records):
+    if await arecord_ferma_write_off(records, context.user_data.get("cart_id")):
         text = f"Материалы списаны для проекта {project_num} (отдел: {direction}):\n"
         for r in records:
             text += f"{r[5]}: {r[6]}\n"
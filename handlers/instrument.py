@@ -3,8 +3,11 @@ import logging
 import datetime
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
-from sheets import get_projects_list, get_instruments, record_instrument_transaction, caches
-from utils import build_project_keyboard, build_instrument_keyboard
+from sheets import (
+    get_projects_list, get_instrument, get_instrument_page, arecord_instrument_transaction,
+    get_project, get_employee_by_login
+)
+from utils import build_project_keyboard, build_instrument_keyboard, new_cart_id
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +22,8 @@ async def start_instrument(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     if not projects:
         await update.callback_query.edit_message_text("Нет доступных проектов.")
         return ConversationHandler.END
-    reply_markup = build_project_keyboard(projects)
+    context.user_data["cart_id"] = new_cart_id()
+    reply_markup = build_project_keyboard(projects, cache_key=role)
     await update.callback_query.edit_message_text("Выберите проект:", reply_markup=reply_markup)
     return SELECT_PROJECT
 
@@ -28,8 +32,7 @@ async def select_project(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
     if query.data.startswith("proj_"):
         project_id = query.data.replace("proj_", "")
-        projects = get_projects_list(context.user_data.get("role", ""))
-        project = next((p for p in projects if str(p.get("ID проекта")) == project_id), None)
+        project = get_project(project_id=project_id, role=context.user_data.get("role", ""))
         if not project:
             await query.edit_message_text("Проект не найден.")
             return ConversationHandler.END
@@ -59,26 +62,63 @@ async def transaction_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     await query.edit_message_text("Введите кому выдан инструмент (ФИО):")
     return RECIPIENT
 
+INSTRUMENT_PROMPT = "Выберите инструмент или отправьте часть названия для поиска:"
+
+def instrument_page_markup(context):
+    # Клавиатура строится только по текущей странице: 10–20 инструментов вместо всего склада
+    query = context.user_data.get("instrument_query", "")
+    items, page, pages = get_instrument_page(query, context.user_data.get("instrument_page", 0))
+    context.user_data["instrument_page"] = page
+    return build_instrument_keyboard(items, context.user_data.setdefault("instruments_input", {}), page=page, pages=pages, query=query)
+
 async def recipient(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["recipient"] = update.message.text.strip()
-    instruments = get_instruments()
     context.user_data["instruments_input"] = {}
-    reply_markup = build_instrument_keyboard(instruments, context.user_data["instruments_input"])
-    await update.message.reply_text("Выберите инструмент:", reply_markup=reply_markup)
+    context.user_data["instrument_query"] = ""
+    context.user_data["instrument_page"] = 0
+    await update.message.reply_text(INSTRUMENT_PROMPT, reply_markup=instrument_page_markup(context))
     return SELECT_INSTRUMENT
 
 async def select_instrument(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    await query.answer()
     if query.data == "submit":
         return await submit_instrument(update, context)
-    instrument = query.data.replace("inst_", "")
-    context.user_data["current_instrument"] = instrument
-    instruments = get_instruments()
-    unit = next((i["unit"] for i in instruments if i["name"] == instrument), "шт")
-    await query.edit_message_text(f"Введите количество для {instrument} ({unit}):")
+    await query.answer()
+    if query.data == "main_menu":
+        from handlers.start import back_to_menu
+        await back_to_menu(update, context)
+        return ConversationHandler.END
+    if query.data.startswith("instpage_"):
+        action = query.data.replace("instpage_", "")
+        if action == "noop":
+            return SELECT_INSTRUMENT
+        if action == "all":
+            context.user_data["instrument_query"] = ""
+            context.user_data["instrument_page"] = 0
+        else:
+            context.user_data["instrument_page"] = int(action)
+        await query.edit_message_reply_markup(reply_markup=instrument_page_markup(context))
+        return SELECT_INSTRUMENT
+    instrument_id = query.data.replace("inst_", "")
+    instrument = get_instrument(instrument_id)
+    if not instrument:
+        await query.edit_message_text("Инструмент не найден. Выберите другой:", reply_markup=instrument_page_markup(context))
+        return SELECT_INSTRUMENT
+    context.user_data["current_instrument"] = instrument_id
+    await query.edit_message_text(f"Введите количество для {instrument['name']} ({instrument['unit'] or 'шт'}):")
     return ENTER_QUANTITY
 
+async def search_instrument(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    text = update.message.text.strip()
+    items, _, _ = get_instrument_page(text)
+    if not items:
+        await update.message.reply_text(f"По запросу «{text}» ничего не найдено. " + INSTRUMENT_PROMPT, reply_markup=instrument_page_markup(context))
+        return SELECT_INSTRUMENT
+    context.user_data["instrument_query"] = text
+    context.user_data["instrument_page"] = 0
+    await update.message.reply_text(f"Найдено по запросу «{text}». " + INSTRUMENT_PROMPT, reply_markup=instrument_page_markup(context))
+    return SELECT_INSTRUMENT
+
 async def enter_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     try:
@@ -91,11 +131,13 @@ async def enter_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ENTER_QUANTITY
     instrument = context.user_data.get("current_instrument", "")
     context.user_data.setdefault("instruments_input", {})[instrument] = quantity
-    instruments = get_instruments()
-    reply_markup = build_instrument_keyboard(instruments, context.user_data["instruments_input"])
-    await update.message.reply_text("Выберите следующий инструмент или подтвердите:", reply_markup=reply_markup)
+    await update.message.reply_text("Выберите следующий инструмент или подтвердите:", reply_markup=instrument_page_markup(context))
     return SELECT_INSTRUMENT
 
+def instrument_name(instrument_id):
+    instrument = get_instrument(instrument_id)
+    return instrument["name"] if instrument else instrument_id
+
 async def submit_instrument(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
@@ -109,17 +151,18 @@ async def submit_instrument(update: Update, context: ContextTypes.DEFAULT_TYPE)
     transaction_type = context.user_data.get("transaction_type", "Приход")
     recipient = context.user_data.get("recipient", "unknown")
     login = str(context.user_data.get("login", "unknown"))  # Приводим к строке
-    employee_data = next((emp for emp in caches["employees"] if str(emp["Логин"]) == login), None)
+    employee_data = get_employee_by_login(login)
     user = employee_data["Ф.И.О"] if employee_data else login  # ФИО или логин
     logger.debug(f"User {user_id}: Login={login}, Employee_data={employee_data}, User={user}")  # Отладка
     date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # В корзине — ID инструментов, в таблицу пишем названия
     records = [
-        [date, transaction_type, user, project, recipient, instrument, qty]
+        [date, transaction_type, user, project, recipient, instrument_name(instrument), qty]
         for instrument, qty in instruments_input.items()
     ]
-    if record_instrument_transaction(records):
+    if await arecord_instrument_transaction(records, context.user_data.get("cart_id")):
         text = f"Инструменты успешно {'приняты' if transaction_type == 'Приход' else 'выданы'} для проекта {project}:\n" + "\n".join(
-            f"{instrument}: {qty}" for instrument, qty in instruments_input.items()
+            f"{instrument_name(instrument)}: {qty}" for instrument, qty in instruments_input.items()
         )
         await query.edit_message_text(
             text,
@@ -2,7 +2,7 @@ import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 
-from sheets import add_new_instrument
+from sheets import aadd_new_instrument
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +32,7 @@ async def enter_details(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     except ValueError:
         await update.message.reply_text("Введите корректное число для количества:")
         return ENTER_DETAILS
-    if add_new_instrument(name, unit, quantity):
+    if await aadd_new_instrument(name, unit, quantity):
         await update.message.reply_text(
             f"Инструмент '{name}' ({quantity} {unit}) успешно добавлен!",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")]])
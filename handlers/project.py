@@ -3,7 +3,7 @@ import logging
 import datetime
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
-from sheets import create_project_record
+from sheets import acreate_project_record
 
 logger = logging.getLogger(__name__)
 
@@ -44,7 +44,7 @@ async def project_direction(update: Update, context: ContextTypes.DEFAULT_TYPE)
     direction = query.data
     customer = context.user_data.get("customer", "")
     tag = context.user_data.get("tag", "")
-    if create_project_record(customer, tag, direction):
+    if await acreate_project_record(customer, tag, direction):
         await query.edit_message_text(
             f"Проект с номером договора '{tag}' успешно создан с направлением '{direction}'.",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")]])
@@ -3,7 +3,7 @@ import logging
 import datetime
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
-from sheets import record_expense  # Используем record_expense вместо append_row_to_sheet
+from sheets import arecord_expense, get_employee_fullname  # Пишем через общую очередь листа "Данные"
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +21,10 @@ async def save_issue(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     login = str(context.user_data.get("login", "unknown"))
     # Получаем ФИО сотрудника, как в других модулях
-    employee_data = next((emp for emp in caches["employees"] if str(emp["Логин"]) == login), None)
-    user = employee_data["Ф.И.О"] if employee_data else login
-    # Формат записи совместим с record_expense (как в expense.py)
+    user = get_employee_fullname(login)
+    # Формат записи совместим с arecord_expense (как в expense.py)
     record = [date, "Ошибка", user, "", "", issue_text, "", "", "", "", str(user_id)]
-    record_expense([record])
+    await arecord_expense([record])
     logger.info(f"User {user_id}: Проблема сохранена: {issue_text}")
     reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")]])
     await update.message.reply_text("Проблема записана!", reply_markup=reply_markup)
@@ -1,14 +1,19 @@
 # handlers/start.py
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
-from sheets import get_employee_data, get_role_permissions
+from sheets import get_employee_data, get_role_permissions, get_cache_counts, get_cache_version, is_refreshing, start_refresh
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
 LOGIN, PASSWORD = range(2)
 
+# Как часто переписывать сообщение с ходом обновления кэша (сек): чаще Telegram начнёт отвечать 429
+REFRESH_PROGRESS_INTERVAL = 2.0
+# Фоновые отчёты об обновлении кэша; ссылка нужна, чтобы задачу не собрал сборщик мусора
+_refresh_reports = set()
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     context.user_data.clear()
@@ -110,12 +115,68 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     return ConversationHandler.END
 
 async def refresh_cache(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.callback_query.answer()
-    from sheets import load_caches
-    load_caches(force=True)
-    logger.info(f"User {update.effective_user.id}: Кэш обновлён")
-    await update.callback_query.edit_message_text(
-        "Кэш успешно обновлён!",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")]])
-    )
-    return ConversationHandler.END
\ No newline at end of file
+    """Обновление кэша по кнопке. Идёт в фоне: обработчик сразу возвращается, а ход
+    обновления и итог пишутся в это же сообщение. Повторные нажатия (в том числе других
+    администраторов) присоединяются к уже идущему обновлению"""
+    query = update.callback_query
+    await query.answer()
+    user_id = update.effective_user.id
+    joined = is_refreshing()
+    # Подмена кэша происходит в конце обновления, поэтому счётчики "до" верны и при присоединении
+    before = get_cache_counts()
+    task, progress = start_refresh(force=True)
+    logger.info(f"User {user_id}: {'Присоединился к идущему обновлению кэша' if joined else 'Запущено обновление кэша'}")
+    await edit_refresh_message(query, "Обновление кэша уже идёт, показываю его ход…" if joined else "Обновление кэша запущено…")
+    report = asyncio.create_task(report_cache_refresh(query, user_id, task, progress, before))
+    _refresh_reports.add(report)
+    report.add_done_callback(_refresh_reports.discard)
+    return ConversationHandler.END
+
+async def report_cache_refresh(query, user_id, task, progress, before):
+    text = None
+    while not task.done():
+        await asyncio.wait({task}, timeout=REFRESH_PROGRESS_INTERVAL)
+        if task.done():
+            break
+        new_text = format_refresh_progress(progress)
+        if new_text != text:
+            text = new_text
+            await edit_refresh_message(query, text)
+    try:
+        changed = task.result()
+    except Exception as e:
+        logger.error(f"User {user_id}: Ошибка обновления кэша: {e}")
+        await edit_refresh_message(query, "Ошибка при обновлении кэша.", menu=True)
+        return
+    logger.info(f"User {user_id}: Кэш обновлён")
+    await edit_refresh_message(query, format_refresh_result(progress, changed, before, get_cache_counts()), menu=True)
+
+def format_refresh_progress(progress):
+    steps, current, elapsed = progress.snapshot()
+    lines = [f"Обновление кэша: {elapsed:.0f} с"]
+    lines += [f"✓ {name} — {seconds:.1f} с" for name, seconds in steps]
+    if current:
+        lines.append(f"… {current}")
+    return "\n".join(lines)
+
+def format_refresh_result(progress, changed, before, after):
+    steps, _, elapsed = progress.snapshot()
+    lines = [f"Кэш успешно обновлён за {elapsed:.1f} с (версия {get_cache_version()})."]
+    lines += [f"{name} — {seconds:.1f} с" for name, seconds in steps]
+    diff = [(name, after[name] - before.get(name, 0)) for name in after if after[name] != before.get(name, 0)]
+    if not changed:
+        lines.append("Данные в таблице не изменились.")
+    elif diff:
+        lines.append("Изменения (строк):")
+        lines += [f"{name}: {delta:+d} (всего {after[name]})" for name, delta in diff]
+    else:
+        lines.append("Число строк не изменилось, обновлены значения.")
+    return "\n".join(lines)
+
+async def edit_refresh_message(query, text, menu=False):
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")]]) if menu else None
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        # Сообщение могли удалить, или Telegram ограничил частоту правок — обновление это не прерывает
+        logger.warning(f"Не удалось обновить сообщение о ходе обновления кэша: {e}")
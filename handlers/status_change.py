@@ -2,7 +2,7 @@
 import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
-from sheets import get_projects_list, update_project_status
+from sheets import get_projects_list, aupdate_project_status, get_project
 from utils import decode_callback_data
 
 logger = logging.getLogger(__name__)
@@ -38,7 +38,7 @@ async def status_tag(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await back_to_menu(update, context)
         return ConversationHandler.END
     # Добавляем str() для корректного сравнения строки и числа
-    project = next((p for p in get_projects_list(context.user_data.get("role", "")) if str(p["Номер договора"]) == str(tag)), None)
+    project = get_project(number=tag, role=context.user_data.get("role", ""))
     if not project:
         logger.warning(f"User {user_id}: Проект '{tag}' не найден")
         await query.edit_message_text(
@@ -71,7 +71,7 @@ async def status_change(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return ConversationHandler.END
     new_status = query.data
     tag = context.user_data.get("status_tag", "")
-    if update_project_status(tag, new_status):
+    if await aupdate_project_status(tag, new_status):
         await query.edit_message_text(
             f"Статус номера договора '{tag}' изменён на '{new_status}'.",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")]])
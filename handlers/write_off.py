@@ -1,23 +1,35 @@
 import logging
 import datetime
+import os
+import tempfile
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler
 from sheets import (
-    get_projects_list, get_project_direction, get_materials_by_category, record_write_off, caches
+    get_projects_list, get_project_direction, get_materials_by_category, arecord_write_off, caches,
+    get_project, get_material, get_employee_fullname, search_projects, search_materials, run_blocking
 )
-from utils import build_project_keyboard, build_material_keyboard
+from config import IMPORT_MAX_FILE_SIZE, SHEETS_LOAD_TIMEOUT
+from bulk_import import ImportFileError, file_kind, read_write_offs, format_import_summary
+from utils import build_project_keyboard, build_material_keyboard, build_category_keyboard, new_cart_id
+from quick_entry import QUICK_ENTRY_HINT, looks_like_quick_entry, resolve_quick_entry, format_quick_entry
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
 SELECT_PROJECT, SELECT_CATEGORY, SELECT_MATERIAL, ENTER_QUANTITY, SUBMIT = range(1, 6)
 
-def get_fullname_by_login(login):
-    employees = caches.get("employees", [])
-    for emp in employees:
-        if str(emp.get("Логин", "")) == str(login):
-            return emp.get("Ф.И.О", str(login))
-    return str(login)
+IMPORT_HINT = "Или пришлите файл CSV/XLSX: колонки «Наименование» и «Количество»."
+# Сколько позиций перечислять в ответе после записи (лимит сообщения Telegram — 4096 символов)
+SUBMIT_REPORT_LIMIT = 50
+
+def category_keyboard():
+    return build_category_keyboard(caches.get("material_categories") or [], "cat_", "materials")
+
+def materials_keyboard(cat, mat_inputs):
+    # Кнопки категории берутся из кэша клавиатур, пересобираются только выбранные материалы
+    return build_material_keyboard(
+        get_materials_by_category(cat), mat_inputs, show_submit=True, cache_key=cat,
+        extra_rows=[[InlineKeyboardButton("Вернуться к категориям", callback_data="back_to_categories")]]
+    )
 
 async def start_write_off(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.callback_query.answer()
@@ -29,10 +41,11 @@ async def start_write_off(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.callback_query.message.reply_text("Нет доступных проектов для списания.")
         logger.warning(f"User {user_id}: Проекты не найдены")
         return ConversationHandler.END
-    reply_markup = build_project_keyboard(projects, include_manual=True)
+    reply_markup = build_project_keyboard(projects, include_manual=True, cache_key=role)
     # Сброс только при старте!
     context.user_data["mat_inputs"] = {}
-    await update.callback_query.edit_message_text("Выберите проект для списания:", reply_markup=reply_markup)
+    context.user_data["cart_id"] = new_cart_id()
+    await update.callback_query.edit_message_text(f"Выберите проект для списания:\n\n{QUICK_ENTRY_HINT}", reply_markup=reply_markup)
     return SELECT_PROJECT
 
 async def select_project(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -47,7 +60,7 @@ async def select_project(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
     tag = query.data.replace("proj_", "")
     role = context.user_data.get("role", "")
-    project = next((p for p in get_projects_list(role) if str(p["ID проекта"]) == tag), None)
+    project = get_project(project_id=tag, role=role)
     if not project:
         logger.warning(f"Проект '{tag}' не найден")
         await query.edit_message_text(f"Проект '{tag}' не найден.")
@@ -55,10 +68,7 @@ async def select_project(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     context.user_data["project_id"] = tag
     context.user_data["project_num"] = project["Номер договора"]  # <--- для записи названия!
     logger.info(f"Выбран проект '{project['Номер договора']}' (ID: {tag}) со статусом '{project['Статус']}'")
-    material_categories = caches.get("material_categories", [])
-    keyboard = [[InlineKeyboardButton(cat, callback_data=f"cat_{cat}")] for cat in material_categories]
-    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-    await query.edit_message_text("Выберите категорию материалов:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await query.edit_message_text(f"Выберите категорию материалов:\n\n{IMPORT_HINT}", reply_markup=category_keyboard())
     return SELECT_CATEGORY
 
 async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -80,13 +90,8 @@ async def select_category(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not materials:
         await query.edit_message_text("Нет материалов в выбранной категории.")
         return ConversationHandler.END
-    reply_markup = build_material_keyboard(materials, context.user_data.get("mat_inputs", {}), show_submit=True)
-    # !!! Только одна кнопка "Вернуться в меню" !!!
-    keyboard = list(reply_markup.inline_keyboard) if reply_markup else []
-    keyboard.append([InlineKeyboardButton("Вернуться к категориям", callback_data="back_to_categories")])
-    # НЕ добавлять вторую "Вернуться в меню", если она уже есть (build_material_keyboard её не добавляет!)
-    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-    await query.edit_message_text(f"Выберите материалы из категории '{cat}':", reply_markup=InlineKeyboardMarkup(keyboard))
+    reply_markup = materials_keyboard(cat, context.user_data.get("mat_inputs", {}))
+    await query.edit_message_text(f"Выберите материалы из категории '{cat}':", reply_markup=reply_markup)
     return SELECT_MATERIAL
 
 async def select_material(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -97,22 +102,22 @@ async def select_material(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if query.data == "manual_material":
         await query.edit_message_text("Введите название материала вручную:")
         return SELECT_MATERIAL
+    if query.data == "manual_keep":
+        material = context.user_data.pop("manual_material_text", "")
+        context.user_data["current_material_id"] = material
+        await query.edit_message_text(f"Введите количество для {material} (шт):")
+        return ENTER_QUANTITY
     if query.data == "main_menu":
         from handlers.start import back_to_menu
         await back_to_menu(update, context)
         return ConversationHandler.END
     if query.data == "back_to_categories":
-        material_categories = caches.get("material_categories", [])
-        keyboard = [[InlineKeyboardButton(cat, callback_data=f"cat_{cat}")] for cat in material_categories]
-        keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-        await query.edit_message_text("Выберите категорию материалов:", reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text("Выберите категорию материалов:", reply_markup=category_keyboard())
         return SELECT_CATEGORY
     if query.data.startswith("mat_"):
         mat_id = query.data.replace("mat_", "")
         context.user_data["current_material_id"] = mat_id
-        cat = context.user_data.get("material_category", "")
-        materials = get_materials_by_category(cat)
-        material = next((m for m in materials if str(m.get("ID") or m.get("id")) == mat_id), None)
+        material = get_material(mat_id)
         unit = material["Ед. измерения"] if material else "шт"
         name = material["Наименование"] if material else mat_id
         await query.edit_message_text(f"Введите количество для {name} ({unit}):")
@@ -130,12 +135,8 @@ async def enter_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     mat_id = context.user_data.get("current_material_id", "")
     context.user_data.setdefault("mat_inputs", {})[mat_id] = {"quantity": quantity}
     cat = context.user_data.get("material_category", "")
-    materials = get_materials_by_category(cat)
-    reply_markup = build_material_keyboard(materials, context.user_data["mat_inputs"], show_submit=True)
-    keyboard = list(reply_markup.inline_keyboard) if reply_markup else []
-    keyboard.append([InlineKeyboardButton("Вернуться к категориям", callback_data="back_to_categories")])
-    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-    await update.message.reply_text("Выберите следующий материал или подтвердите:", reply_markup=InlineKeyboardMarkup(keyboard))
+    reply_markup = materials_keyboard(cat, context.user_data["mat_inputs"])
+    await update.message.reply_text("Выберите следующий материал или подтвердите:", reply_markup=reply_markup)
     return SELECT_MATERIAL
 
 async def manual_project(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -146,9 +147,20 @@ async def manual_project(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def manual_project_tag(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     tag = update.message.text.strip()
+    if looks_like_quick_entry(tag):
+        return await quick_write_off(update, context)
     role = context.user_data.get("role", "")
-    project = next((p for p in get_projects_list(role) if str(p["Номер договора"]) == tag), None)
+    project = get_project(number=tag, role=role)
     if not project:
+        # Точного совпадения нет — предлагаем похожие по номеру договора или заказчику
+        matches = search_projects(tag, role=role, limit=8)
+        if matches:
+            logger.info(f"User {user_id}: Проект '{tag}' не найден точно, похожих: {len(matches)}")
+            await update.message.reply_text(
+                f"Проект '{tag}' не найден. Возможно, вы имели в виду:",
+                reply_markup=build_project_keyboard(matches, include_manual=True)
+            )
+            return SELECT_PROJECT
         logger.warning(f"Проект '{tag}' не найден при ручном вводе")
         await update.message.reply_text("Проект не найден. Попробуйте снова:")
         return SELECT_PROJECT
@@ -157,12 +169,38 @@ async def manual_project_tag(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data["project_id"] = project_id
     context.user_data["project_num"] = project_num
     logger.info(f"Вручную выбран проект '{tag}' (ID: {project_id}) со статусом '{project['Статус']}'")
-    material_categories = caches.get("material_categories", [])
-    keyboard = [[InlineKeyboardButton(cat, callback_data=f"cat_{cat}")] for cat in material_categories]
-    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-    await update.message.reply_text("Выберите категорию материалов:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await update.message.reply_text(f"Выберите категорию материалов:\n\n{IMPORT_HINT}", reply_markup=category_keyboard())
     return SELECT_CATEGORY
 
+async def quick_write_off(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Списание одним сообщением: корзина заполняется разобранными позициями,
+    подтверждение — та же кнопка "submit", что и у списания по категориям"""
+    user_id = update.effective_user.id
+    result = resolve_quick_entry(update.message.text, context.user_data.get("role", ""))
+    if result is None or not result["project"]:
+        text = format_quick_entry(result) if result else "Не удалось разобрать сообщение."
+        await update.message.reply_text(f"{text}\n\nПопробуйте снова.\n{QUICK_ENTRY_HINT}")
+        return SELECT_PROJECT
+    project = result["project"]
+    context.user_data["project_id"] = project["ID проекта"]
+    context.user_data["project_num"] = project["Номер договора"]
+    context.user_data["mat_inputs"] = {
+        str(entry["item"]["ID"]): {"quantity": entry["quantity"]} for entry in result["items"].values()
+    }
+    # Каждое подтверждение — отдельная корзина; повторное нажатие "Списать" не задвоит запись
+    context.user_data["cart_id"] = new_cart_id()
+    logger.info(
+        f"User {user_id}: Быстрое списание на проект '{project['Номер договора']}': "
+        f"позиций {len(result['items'])}, не найдено {len(result['unknown'])}, без количества {len(result['invalid'])}"
+    )
+    keyboard = []
+    if result["items"]:
+        keyboard.append([InlineKeyboardButton("Списать", callback_data="submit")])
+    keyboard.append([InlineKeyboardButton("Изменить по категориям", callback_data="back_to_categories")])
+    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
+    await update.message.reply_text(format_quick_entry(result), reply_markup=InlineKeyboardMarkup(keyboard))
+    return SELECT_MATERIAL
+
 async def manual_material(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.callback_query.answer()
     await update.callback_query.edit_message_text("Введите название материала вручную:")
@@ -170,10 +208,71 @@ async def manual_material(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def manual_material_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     material = update.message.text.strip()
+    matches = search_materials(material, limit=8)
+    if matches:
+        # Сначала предлагаем материалы из каталога; записать как введено — отдельной кнопкой
+        context.user_data["manual_material_text"] = material
+        keyboard = [
+            [InlineKeyboardButton(f"{m['Наименование']} ({m.get('Ед. измерения') or 'шт'})", callback_data=f"mat_{m['ID']}")]
+            for m in matches
+        ]
+        keyboard.append([InlineKeyboardButton(f"Записать «{material[:40]}» как есть", callback_data="manual_keep")])
+        keyboard.append([InlineKeyboardButton("Вернуться к категориям", callback_data="back_to_categories")])
+        keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
+        await update.message.reply_text("Найдены материалы из каталога:", reply_markup=InlineKeyboardMarkup(keyboard))
+        return SELECT_MATERIAL
     context.user_data["current_material_id"] = material
     await update.message.reply_text(f"Введите количество для {material} (шт):")
     return ENTER_QUANTITY
 
+async def import_write_off_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Списание файлом: файл разбирается в пуле потоков, распознанные материалы попадают в корзину,
+    подтверждение — та же кнопка "submit", что и у списания по категориям"""
+    user_id = update.effective_user.id
+    document = update.message.document
+    kind = file_kind(document.file_name)
+    # При ошибке возвращаем None: диалог остаётся в том шаге, где был прислан файл
+    state = None
+    if kind is None:
+        await update.message.reply_text("Поддерживаются файлы CSV и XLSX.")
+        return state
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await update.message.reply_text(f"Файл больше {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ. Разделите его на части.")
+        return state
+    status = await update.message.reply_text("Обрабатываю файл…")
+    fd, path = tempfile.mkstemp(suffix=f".{kind}")
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        result = await run_blocking(read_write_offs, path, kind, timeout=SHEETS_LOAD_TIMEOUT)
+    except ImportFileError as e:
+        await status.edit_text(str(e))
+        return state
+    except Exception as e:
+        logger.error(f"User {user_id}: Ошибка разбора файла '{document.file_name}': {e}")
+        await status.edit_text("Не удалось обработать файл.")
+        return state
+    finally:
+        os.remove(path)
+    logger.info(
+        f"User {user_id}: Файл '{document.file_name}': строк {result['rows']}, материалов {len(result['quantities'])}, "
+        f"не найдено строк {result['unknown_rows']}, без количества {result['invalid_rows']}"
+    )
+    # Файл заменяет корзину целиком; каждый файл — отдельная отправка
+    context.user_data["mat_inputs"] = {mat_id: {"quantity": quantity} for mat_id, quantity in result["quantities"].items()}
+    context.user_data["cart_id"] = new_cart_id()
+    keyboard = []
+    if result["quantities"]:
+        keyboard.append([InlineKeyboardButton(f"Списать ({len(result['quantities'])} поз.)", callback_data="submit")])
+    keyboard.append([InlineKeyboardButton("Изменить по категориям", callback_data="back_to_categories")])
+    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
+    project_num = context.user_data.get("project_num", "")
+    await status.edit_text(
+        f"Проект: {project_num}\n{format_import_summary(result)}", reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    return SELECT_MATERIAL
+
 async def submit_materials(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
@@ -181,27 +280,26 @@ async def submit_materials(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     project_id = context.user_data.get("project_id", "unknown")
     project_num = context.user_data.get("project_num", project_id)  # <--- Берём название!
     department = context.user_data.get("department", "Строительство")
-    # Собираем материалы всех категорий!
-    all_materials = {}
-    material_categories = caches.get("material_categories", [])
-    for cat in material_categories:
-        for m in get_materials_by_category(cat):
-            all_materials[str(m.get("ID") or m.get("id"))] = m.get("Наименование", m.get("name"))
-    id_to_name = all_materials
+    # Названия материалов всех категорий — через индекс по ID
+    def material_name(mat_id):
+        material = get_material(mat_id)
+        return material.get("Наименование", str(mat_id)) if material else str(mat_id)
     if not mat_inputs:
         await query.edit_message_text("Не выбраны материалы для списания.")
         return ConversationHandler.END
     date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     login = str(context.user_data.get("login", "unknown"))
-    fullname = get_fullname_by_login(login)
+    fullname = get_employee_fullname(login)
     records = []
     for mat_id, info in mat_inputs.items():
-        mat_name = id_to_name.get(str(mat_id), str(mat_id))
+        mat_name = material_name(mat_id)
         records.append([date, "Расход", fullname, "", department, mat_name, info["quantity"], "", "", "", project_num])
-    if record_write_off(records):
+    if await arecord_write_off(records, context.user_data.get("cart_id")):
         text = f"Материалы списаны для проекта {project_num} (отдел: {department}):\n" + "\n".join(
-            f"{id_to_name.get(str(mat_id), str(mat_id))}: {info['quantity']}" for mat_id, info in mat_inputs.items()
+            f"{record[5]}: {record[6]}" for record in records[:SUBMIT_REPORT_LIMIT]
         )
+        if len(records) > SUBMIT_REPORT_LIMIT:
+            text += f"\n… и ещё {len(records) - SUBMIT_REPORT_LIMIT}"
         await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")]])
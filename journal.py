@@ -0,0 +1,148 @@
+# journal.py
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """Локальный журнал упреждающей записи (JSON Lines, только дозапись).
+
+    Каждая отправка сначала попадает сюда строкой {"op": "put", ...} с fsync,
+    после записи в таблицу — строкой {"op": "done", "key": ...}. При запуске
+    всё, что записано без "done", отдаётся на повторную отправку. Когда
+    незавершённых записей не остаётся, файл обнуляется.
+
+    Отправки, которые таблица не примет никогда (лист удалён, запрос отклонён),
+    переносятся в отложенные строкой {"op": "dead", ...} с самими строками и
+    текстом ошибки. Они не отправляются повторно и остаются в файле до разбора
+    вручную.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = None        # key -> запись "put", порядок вставки сохраняется
+        self._dead = None           # key -> запись "dead" (отложенные отправки)
+        self._loaded = False
+
+    @staticmethod
+    def new_key():
+        return uuid.uuid4().hex
+
+    def _load(self):
+        if self._loaded:
+            return
+        pending, dead = {}, {}
+        broken = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка после аварийной остановки
+                        broken += 1
+                        continue
+                    if entry.get("op") == "put":
+                        pending[entry["key"]] = entry
+                    elif entry.get("op") == "done":
+                        pending.pop(entry.get("key"), None)
+                    elif entry.get("op") == "dead":
+                        pending.pop(entry.get("key"), None)
+                        dead[entry["key"]] = entry
+        except FileNotFoundError:
+            pass
+        if broken:
+            logger.warning(f"Журнал {self.path}: пропущено повреждённых строк: {broken}")
+        self._pending = pending
+        self._dead = dead
+        self._loaded = True
+        if pending:
+            logger.info(f"Журнал {self.path}: незавершённых записей: {len(pending)}")
+        if dead:
+            logger.error(f"Журнал {self.path}: отложенных отправок (отклонены таблицей): {len(dead)}")
+        # Переписываем файл только незавершёнными записями: выбрасываем "done" и битые строки
+        self._rewrite()
+
+    def _rewrite(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in list(self._pending.values()) + list(self._dead.values()):
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _write(self, entries):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def put(self, sheet, rows, key=None):
+        """Надёжно сохраняет отправку; возвращает её запись (с ключом).
+        Если отправка с таким ключом уже ждёт записи, возвращает None"""
+        entry = {"op": "put", "key": key or self.new_key(), "sheet": sheet, "rows": rows, "ts": time.time()}
+        with self._lock:
+            self._load()
+            if entry["key"] in self._pending:
+                return None
+            self._write([entry])
+            self._pending[entry["key"]] = entry
+        return entry
+
+    def done(self, keys):
+        with self._lock:
+            self._load()
+            keys = [key for key in keys if key in self._pending]
+            if not keys:
+                return
+            for key in keys:
+                del self._pending[key]
+            if self._pending:
+                self._write([{"op": "done", "key": key} for key in keys])
+            else:
+                self._rewrite()
+
+    def dead(self, keys, error):
+        """Переносит незавершённые отправки в отложенные. Возвращает перенесённые записи"""
+        with self._lock:
+            self._load()
+            entries = [
+                dict(self._pending[key], op="dead", error=str(error), failed_at=time.time())
+                for key in keys if key in self._pending
+            ]
+            if entries:
+                self._write(entries)
+                for entry in entries:
+                    del self._pending[entry["key"]]
+                    self._dead[entry["key"]] = entry
+            return entries
+
+    def dead_letters(self, sheet=None):
+        """Отложенные отправки: таблица их отклонила, повторно они не уходят"""
+        with self._lock:
+            self._load()
+            return [entry for entry in self._dead.values() if sheet is None or entry["sheet"] == sheet]
+
+    def pending(self, sheet=None):
+        """Незавершённые записи (для повторной отправки после перезапуска)"""
+        with self._lock:
+            self._load()
+            return [entry for entry in self._pending.values() if sheet is None or entry["sheet"] == sheet]
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
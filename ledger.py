@@ -0,0 +1,319 @@
+# ledger.py
+import concurrent.futures
+import logging
+import re
+import threading
+import time
+from backend import get_worksheet
+from throttle import is_permanent_error
+
+logger = logging.getLogger(__name__)
+
+UPDATED_RANGE_ROW = re.compile(r"![A-Z]+(\d+)")
+
+# Пауза перед повтором неудачной пачки растёт до этого предела (сек)
+MAX_RETRY_DELAY = 60
+
+# Итог записи пачки: записана; временная ошибка (429, 5xx, сеть) — повторить;
+# таблица отклонила запрос (4xx, лист удалён) — повтор не поможет
+WRITTEN, RETRY, REJECTED = "written", "retry", "rejected"
+
+
+class SubmissionStore:
+    """Отправки по ID корзины за последние ttl секунд: повторная отправка той же корзины
+    (двойное нажатие "Отправить") получает Future первой, строки второй раз не пишутся"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._futures = {}          # cart_id -> (истекает, Future)
+        self._lock = threading.Lock()
+
+    def submit_once(self, cart_id, submit):
+        now = time.monotonic()
+        with self._lock:
+            for expired in [key for key, (expires, _) in self._futures.items() if expires <= now]:
+                del self._futures[expired]
+            known = self._futures.get(cart_id)
+            if known and not self.failed(known[1]):
+                logger.info(f"Корзина {cart_id} уже отправлена, возвращаем прежний результат")
+                return known[1]
+            future = submit()
+            self._futures[cart_id] = (now + self.ttl, future)
+            return future
+
+    @staticmethod
+    def failed(future):
+        """Прошлая попытка не удалась или отменена — корзину можно отправить заново"""
+        if not future.done():
+            return False
+        return future.cancelled() or future.exception() is not None or not future.result()
+
+
+class LedgerWriter:
+    """Очередь дозаписи строк в лист-журнал ("Данные", "Где инструмент").
+
+    Строки от всех обработчиков копятся в памяти и уходят в таблицу одним
+    append-запросом: как только набралось batch_size строк или прошло
+    flush_delay секунд с первой строки в очереди.
+
+    С журналом (journal.Journal) отправка сначала надёжно пишется на диск,
+    и её Future завершается True сразу после этого. Неудачные пачки не
+    теряются: они остаются в очереди и в журнале и уходят повторно, в том
+    числе после перезапуска (recover). В колонке после данных каждая строка
+    несёт ключ "<ключ отправки>:<номер строки>": перед повтором по нему
+    отсеиваются строки, которые уже попали в таблицу.
+
+    Повторяются только временные ошибки (429, 5xx, сеть). Если таблица
+    отклонила пачку из нескольких отправок, они уходят заново по одной, а
+    отклонённая отправка переносится в отложенные журнала (Journal.dead) и
+    больше не задерживает очередь.
+
+    Без журнала Future завершается True/False по результату записи пачки.
+    """
+
+    def __init__(self, sheet_name, width, journal=None, batch_size=200, flush_delay=0.5, retry_delay=5.0, on_written=None):
+        self.sheet_name = sheet_name
+        self.width = width                  # колонок данных после "№ строки"
+        self.key_col = width + 2            # колонка ключа идемпотентности
+        self.journal = journal
+        self.batch_size = batch_size
+        self.flush_delay = flush_delay
+        self.retry_delay = retry_delay
+        self.on_written = on_written        # вызывается с пронумерованными строками после записи
+        self._pending = []                  # [(entry, future), ...], entry = {"key", "rows"}
+        self._in_flight = 0
+        self._next_row = None               # ожидаемый номер строки для следующей пачки
+        self._verify = False                # перед записью сверить ключи с таблицей
+        self._grid_checked = False          # сетка листа вмещает колонку ключа
+        self._failures = 0
+        self._isolate = 0                   # столько следующих пачек — по одной отправке
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, rows, key=None):
+        """Ставит строки (без номера строки) в очередь; возвращает concurrent.futures.Future"""
+        future = concurrent.futures.Future()
+        if not rows:
+            future.set_result(True)
+            return future
+        rows = [self.fit(row) for row in rows]
+        entry = {"key": key, "rows": rows}
+        if self.journal is not None:
+            try:
+                entry = self.journal.put(self.sheet_name, rows, key)
+                future.set_result(True)
+                if entry is None:
+                    # Та же отправка уже в журнале (например, поставлена туда до перезапуска)
+                    logger.warning(f"'{self.sheet_name}': отправка {key} уже в журнале, повторно не ставим")
+                    return future
+            except OSError as e:
+                # Диск недоступен: работаем как без журнала, ответ — по результату записи в таблицу
+                logger.error(f"Журнал недоступен, '{self.sheet_name}' пишется без него: {e}")
+        self._enqueue([(entry, future)])
+        return future
+
+    def recover(self):
+        """Ставит в очередь незавершённые записи журнала (после перезапуска). Возвращает их число"""
+        if self.journal is None:
+            return 0
+        entries = self.journal.pending(self.sheet_name)
+        if entries:
+            logger.info(f"'{self.sheet_name}': повторная отправка {len(entries)} записей из журнала")
+            acknowledged = concurrent.futures.Future()
+            acknowledged.set_result(True)
+            with self._cond:
+                # Часть строк могла попасть в таблицу до остановки — сверяем ключи
+                self._verify = True
+            self._enqueue([(entry, acknowledged) for entry in entries], front=True)
+        return len(entries)
+
+    def drain(self, timeout=None):
+        """Ждёт, пока очередь опустеет (например, при остановке бота)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def dead_letters(self):
+        """Отправки этого листа, которые таблица отклонила (из журнала)"""
+        return self.journal.dead_letters(self.sheet_name) if self.journal is not None else []
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    def fit(self, row):
+        row = list(row[:self.width])
+        row.extend([""] * (self.width - len(row)))
+        return row
+
+    def _enqueue(self, items, front=False):
+        with self._cond:
+            if front:
+                self._pending[:0] = items
+            else:
+                self._pending.extend(items)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"ledger-{self.sheet_name}", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _pending_rows(self):
+        return sum(len(entry["rows"]) for entry, _ in self._pending)
+
+    def _take_batch(self):
+        # Отправку целиком кладём в одну пачку, даже если она больше batch_size.
+        # После отказа таблицы отправки идут по одной, чтобы найти отклонённую
+        single = self._isolate > 0
+        if single:
+            self._isolate -= 1
+        batch, size = [], 0
+        while self._pending and (not batch or (not single and size + len(self._pending[0][0]["rows"]) <= self.batch_size)):
+            entry, future = self._pending.pop(0)
+            if future.cancelled():
+                # Отправка не в журнале, и отправитель уже получил отказ: запись задвоила бы его повтор
+                logger.warning(f"'{self.sheet_name}': отправка {entry.get('key')} отменена, не пишем")
+                continue
+            batch.append((entry, future))
+            size += len(entry["rows"])
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.flush_delay
+                while self._pending_rows() < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+                self._in_flight += 1
+            outcome, error = RETRY, None
+            try:
+                outcome, error = self._flush(batch)
+            finally:
+                try:
+                    requeue = self._settle(batch, outcome, error)
+                except Exception as e:
+                    # Журнал недоступен: незавершённые записи в нём останутся и уйдут после перезапуска
+                    logger.error(f"Ошибка журнала после записи в '{self.sheet_name}': {e}")
+                    requeue = []
+                with self._cond:
+                    self._in_flight -= 1
+                    self._pending[:0] = requeue
+                    if outcome == REJECTED and len(batch) > 1:
+                        self._isolate = len(batch)
+                    self._cond.notify_all()
+            if outcome == RETRY and requeue:
+                time.sleep(min(MAX_RETRY_DELAY, self.retry_delay * 2 ** (self._failures - 1)))
+
+    def _flush(self, batch):
+        """Пишет пачку в таблицу. Возвращает (итог, ошибка)"""
+        rows = [self.keyed_row(entry, i, row) for entry, _ in batch for i, row in enumerate(entry["rows"])]
+        try:
+            start_row, written = self._append(rows)
+        except Exception as e:
+            self._next_row = None
+            self._grid_checked = False
+            if is_permanent_error(e):
+                # Запрос отклонён целиком — в таблицу ничего не попало, сверять ключи не нужно
+                logger.error(f"Таблица отклонила запись в '{self.sheet_name}' ({len(batch)} отправок): {e}")
+                return REJECTED, e
+            self._failures += 1
+            logger.error(f"Ошибка пакетной записи в '{self.sheet_name}': {e}")
+            # Запрос мог дойти до таблицы, а ответ — нет: перед повтором сверяем ключи
+            self._verify = True
+            return RETRY, e
+        logger.info(f"Записано в '{self.sheet_name}': {len(written)} строк ({len(batch)} отправок), начиная со строки {start_row}")
+        self._failures = 0
+        if written and self.on_written:
+            try:
+                self.on_written(written)
+            except Exception as e:
+                logger.error(f"Ошибка обработки записанных строк '{self.sheet_name}': {e}")
+        return WRITTEN, None
+
+    def _settle(self, batch, outcome, error):
+        """Завершает Future отправок пачки. Возвращает отправки, которые надо поставить в очередь заново"""
+        if outcome == WRITTEN:
+            if self.journal is not None:
+                self.journal.done([entry["key"] for entry, _ in batch if entry.get("key")])
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(True)
+            return []
+        if outcome == REJECTED and len(batch) > 1:
+            # Какая из отправок виновата, неизвестно — повторяем каждую отдельно
+            return list(batch)
+        if outcome == REJECTED:
+            entry = batch[0][0]
+            if self.journal is not None and entry.get("key"):
+                self.journal.dead([entry["key"]], error)
+            logger.error(
+                f"'{self.sheet_name}': отправка {entry.get('key')} ({len(entry['rows'])} строк) отклонена таблицей "
+                f"и перенесена в отложенные журнала, очередь продолжает запись: {error}"
+            )
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(False)
+            return []
+        # Уже подтверждённые пользователю (через журнал) отправки при ошибке не теряем;
+        # отменённые не повторяем — отправитель считает их неудавшимися
+        durable = [(entry, future) for entry, future in batch if future.done() and not future.cancelled()]
+        for _, future in batch:
+            if not future.done():
+                future.set_result(False)
+        return durable
+
+    @staticmethod
+    def keyed_row(entry, index, row):
+        key = f"{entry['key']}:{index}" if entry.get("key") else ""
+        return list(row) + [key]
+
+    def _ensure_key_column(self, worksheet):
+        """Колонка ключа стоит сразу за данными; если сетка листа уже, добавляем колонки —
+        иначе append отклоняется как запись за пределы листа"""
+        col_count = worksheet.col_count
+        if col_count < self.key_col:
+            logger.warning(f"Лист '{self.sheet_name}': {col_count} колонок, добавляем до {self.key_col} для ключей записи")
+            worksheet.add_cols(self.key_col - col_count)
+        self._grid_checked = True
+
+    def _append(self, rows):
+        worksheet = get_worksheet(self.sheet_name)
+        if not self._grid_checked:
+            self._ensure_key_column(worksheet)
+        if self._verify:
+            present = set(worksheet.col_values(self.key_col))
+            fresh = [row for row in rows if not (row[-1] and row[-1] in present)]
+            if len(fresh) != len(rows):
+                logger.warning(f"'{self.sheet_name}': {len(rows) - len(fresh)} строк уже в таблице, повторно не пишем")
+            rows = fresh
+            self._verify = False
+        if not rows:
+            return None, []
+        if self._next_row is None:
+            values = worksheet.col_values(1)
+            self._next_row = (len(values) if values else 1) + 1
+        expected_row = self._next_row
+        numbered = [[expected_row + i] + row for i, row in enumerate(rows)]
+        response = worksheet.append_rows(numbered, value_input_option="RAW", table_range="A1")
+        updated_range = response.get("updates", {}).get("updatedRange", "")
+        match = UPDATED_RANGE_ROW.search(updated_range)
+        start_row = int(match.group(1)) if match else expected_row
+        if start_row != expected_row:
+            # Кто-то дописал строки в обход бота: исправляем только колонку "№ строки"
+            logger.warning(f"Лист '{self.sheet_name}': ожидалась строка {expected_row}, запись легла с {start_row}")
+            end_row = start_row + len(rows) - 1
+            worksheet.update([[start_row + i] for i in range(len(rows))], f"A{start_row}:A{end_row}")
+            numbered = [[start_row + i] + row for i, row in enumerate(rows)]
+        self._next_row = start_row + len(rows)
+        # Наружу — без колонки ключа
+        return start_row, [row[:-1] for row in numbered]
@@ -0,0 +1,114 @@
+# quick_entry.py
+# Быстрое списание одним сообщением: "212-12/КК: Саморез 4.2x25 500, Брус 150x150 6".
+# До двоеточия — номер договора, после — позиции "название количество" через запятую,
+# точку с запятой или с новой строки. Проект и материалы ищутся по индексам кэша
+# (с учётом опечаток и раскладки), запись идёт обычным путём списания — одной пачкой.
+import re
+from sheets import get_project, search_projects, match_catalog
+
+QUICK_ENTRY_HINT = "Или отправьте списание одним сообщением:\n212-12/КК: Саморез 4.2x25 500, Брус 150x150 6"
+
+# Запятая-разделитель позиций; "4,2х25" и "2,5" — десятичная запятая, не разделитель
+ITEM_SEPARATOR = re.compile(r";|\n|,(?!\d)")
+# Количество — последнее число позиции, отделённое пробелом или знаком ("- 6", "x6", "=6"),
+# за ним может идти единица измерения ("500 шт", "6м")
+ITEM = re.compile(
+    r"^(?P<name>.*?\S)(?:\s*[-–—=:×*]\s*|\s+[xх]\s*|\s+)(?P<qty>\d+(?:[.,]\d+)?)\s*(?P<unit>[^\W\d_]{1,5}\.?)?$"
+)
+
+
+def looks_like_quick_entry(text):
+    """Похоже ли сообщение на быстрое списание, а не на номер договора"""
+    project, _, items = str(text).partition(":")
+    return bool(project.strip() and items.strip())
+
+
+def parse_quick_entry(text):
+    """Разбирает сообщение: (текст проекта, [(название, количество)], [нераспознанные фрагменты]).
+    Без двоеточия — (None, [], [])"""
+    project, sep, rest = str(text).partition(":")
+    if not sep:
+        return None, [], []
+    items, invalid = [], []
+    for fragment in ITEM_SEPARATOR.split(rest):
+        fragment = fragment.strip(" \t.")
+        if not fragment:
+            continue
+        match = ITEM.match(fragment)
+        quantity = float(match["qty"].replace(",", ".")) if match else 0
+        if quantity <= 0:
+            invalid.append(fragment)
+            continue
+        items.append((match["name"].strip(), quantity))
+    return project.strip(), items, invalid
+
+
+def resolve_project(text, role):
+    """Проект по номеру договора; если точного нет — самый похожий из видимых роли.
+    (проект, точно ли) или (None, False)"""
+    project = get_project(number=text, role=role)
+    if project:
+        return project, True
+    matches = search_projects(text, role=role, limit=1)
+    return (matches[0], False) if matches else (None, False)
+
+
+def resolve_quick_entry(text, role, kinds=("materials",)):
+    """Разбор и сопоставление с кэшем. Возвращает словарь:
+    project, project_exact — найденный проект;
+    items — {(вид, ID): {"kind", "item", "name", "unit", "quantity", "exact", "typed"}},
+            повторы одной позиции суммируются;
+    unknown — названия, которых нет в каталоге; invalid — позиции без количества.
+    None, если сообщение не в формате быстрого списания"""
+    project_text, parsed, invalid = parse_quick_entry(text)
+    if not project_text or not (parsed or invalid):
+        return None
+    project, project_exact = resolve_project(project_text, role)
+    items, unknown = {}, []
+    for name, quantity in parsed:
+        found = match_catalog(name, kinds)
+        if not found:
+            unknown.append(name)
+            continue
+        kind, item, exact = found
+        entry = items.setdefault((kind, str(item.get("ID"))), {
+            "kind": kind, "item": item, "name": item.get("Наименование", name),
+            "unit": item.get("Ед. измерения") or "шт", "quantity": 0, "exact": True, "typed": []
+        })
+        entry["quantity"] += quantity
+        entry["exact"] = entry["exact"] and exact
+        entry["typed"].append(name)
+    return {
+        "project_text": project_text, "project": project, "project_exact": project_exact,
+        "items": items, "unknown": unknown, "invalid": invalid
+    }
+
+
+def format_quantity(quantity):
+    return f"{quantity:g}"
+
+
+def format_quick_entry(result):
+    """Текст подтверждения: что будет списано и что не распознано. Неточные совпадения помечены «≈»"""
+    project = result["project"]
+    mark = "" if result["project_exact"] else "≈ "
+    lines = [f"Проект: {mark}{project['Номер договора']}" if project else f"Проект «{result['project_text']}» не найден"]
+    if result["items"]:
+        lines.append("")
+        lines.append("Будет списано:")
+        for entry in result["items"].values():
+            mark = "" if entry["exact"] else "≈ "
+            typed = "" if entry["exact"] else f" (введено: {', '.join(entry['typed'])})"
+            lines.append(f"{mark}{entry['name']}: {format_quantity(entry['quantity'])} {entry['unit']}{typed}")
+    if result["unknown"]:
+        lines.append("")
+        lines.append("Нет в каталоге (не будут списаны):")
+        lines.extend(f"• {name}" for name in result["unknown"])
+    if result["invalid"]:
+        lines.append("")
+        lines.append("Не указано количество (не будут списаны):")
+        lines.extend(f"• {fragment}" for fragment in result["invalid"])
+    if any(not entry["exact"] for entry in result["items"].values()) or (project and not result["project_exact"]):
+        lines.append("")
+        lines.append("≈ — найдено по похожему названию, проверьте перед списанием.")
+    return "\n".join(lines)
@@ -0,0 +1,77 @@
+# scheduler.py
+# Обновление кэша по расписанию в цикле событий бота. Запускается из bot_main.main(),
+# при импорте модулей ничего не стартует.
+import asyncio
+import datetime
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = {
+    "пн": 0, "вт": 1, "ср": 2, "чт": 3, "пт": 4, "сб": 5, "вс": 6,
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+}
+ENTRY = re.compile(r"^(?:(?P<days>[^\d]+?)\s+)?(?P<times>\d[\d:,\s]*)$")
+TIME = re.compile(r"^(\d{1,2}):(\d{2})$")
+# Длинное ожидание режем на части: переход на летнее время или перевод часов не сдвинет запуск
+MAX_SLEEP = 300
+
+
+def parse_days(spec):
+    days = set()
+    for part in spec.lower().replace(" ", "").split(","):
+        first, _, last = part.partition("-")
+        if first not in WEEKDAYS or (last and last not in WEEKDAYS):
+            raise ValueError(f"Неизвестный день недели '{part}'")
+        day, end = WEEKDAYS[first], WEEKDAYS[last or first]
+        days.add(day)
+        while day != end:
+            day = (day + 1) % 7
+            days.add(day)
+    return days
+
+
+def parse_schedule(spec):
+    """'пн-пт 08:00,20:00; сб 12:00' -> [(дни недели, время), ...]. Без дней — каждый день"""
+    windows = []
+    for entry in filter(None, (part.strip() for part in (spec or "").split(";"))):
+        match = ENTRY.match(entry)
+        if not match:
+            raise ValueError(f"Не разобрана запись расписания '{entry}'")
+        days = parse_days(match["days"]) if match["days"] else set(range(7))
+        for value in filter(None, (t.strip() for t in match["times"].split(","))):
+            time_match = TIME.match(value)
+            if not time_match or int(time_match[1]) > 23 or int(time_match[2]) > 59:
+                raise ValueError(f"Неверное время '{value}' в расписании '{entry}'")
+            windows.append((frozenset(days), datetime.time(int(time_match[1]), int(time_match[2]))))
+    return windows
+
+
+def next_run(windows, now):
+    """Ближайший момент запуска строго после now или None, если расписание пустое"""
+    candidates = [
+        datetime.datetime.combine(now.date() + datetime.timedelta(days=offset), at)
+        for offset in range(8)
+        for days, at in windows
+        if (now.date() + datetime.timedelta(days=offset)).weekday() in days
+    ]
+    return min((moment for moment in candidates if moment > now), default=None)
+
+
+async def run_schedule(windows, refresh, name="обновление кэша"):
+    """Ждёт ближайшее окно расписания и вызывает корутину refresh(); ошибки не прерывают цикл"""
+    while True:
+        at = next_run(windows, datetime.datetime.now())
+        if at is None:
+            return
+        logger.info(f"Следующее {name} по расписанию: {at:%d.%m.%Y %H:%M}")
+        remaining = (at - datetime.datetime.now()).total_seconds()
+        while remaining > 0:
+            await asyncio.sleep(min(remaining, MAX_SLEEP))
+            remaining = (at - datetime.datetime.now()).total_seconds()
+        try:
+            await refresh()
+            logger.info(f"Плановое {name} выполнено.")
+        except Exception as e:
+            logger.error(f"Ошибка: плановое {name} не выполнено: {e}")
@@ -0,0 +1,112 @@
+# search.py
+# Нечёткий поиск по каталогам кэша (проекты, материалы, инструменты). Слова нормализуются,
+# индекс хранит их триграммы: опечатка портит две-три триграммы из десятка, и совпадение
+# находится. Индексы строит sheets.build_indexes вместе с остальными, один раз на версию кэша.
+import re
+import threading
+from collections import defaultdict
+
+# Буквы, которые набирают то кириллицей, то латиницей ("4.2х25" и "4.2x25")
+HOMOGLYPHS = str.maketrans("ёаеорхсукмтнв", "eaeopxcykmthb")
+WORD = re.compile(r"[0-9a-zа-я]+")
+
+# Доля триграмм запроса, которая должна найтись в названии
+MIN_COVERAGE = 0.5
+
+
+def normalize(text):
+    """Слова текста без регистра, пунктуации и разницы раскладок: '212-12/КК' -> ['212', '12', 'kk']"""
+    return WORD.findall(str(text).lower().translate(HOMOGLYPHS))
+
+
+def trigrams(words):
+    grams = set()
+    for word in words:
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndex:
+    """Триграммный индекс: ключ -> (объект, нормализованный текст).
+
+    Результаты ранжируются по доле триграмм запроса, найденных в тексте,
+    затем по коэффициенту Дайса (короткие точные совпадения выше длинных),
+    затем по порядку добавления. Запрос, целиком входящий в текст, всегда
+    выше нечётких совпадений.
+
+    add() можно вызывать из пула потоков, пока обработчики ищут: изменения
+    и поиск идут под одной блокировкой.
+    """
+
+    def __init__(self, source=None):
+        self.source = source                # список кэша, из которого построен индекс
+        self._docs = {}                     # ключ -> (объект, текст, триграммы, порядковый номер)
+        self._postings = defaultdict(set)   # триграмма -> ключи
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, items, key, text, source=None, previous=None):
+        """Индекс по items; key(item) и text(item) дают ключ и текст для поиска.
+        Триграммы неизменившихся текстов берутся из previous, а не считаются заново"""
+        index = cls(source)
+        known = previous.grams_by_text() if previous else {}
+        for item in items:
+            # previous хранит триграммы по нормализованному тексту
+            item_text = " ".join(normalize(text(item)))
+            index.add(key(item), item_text, item, grams=known.get(item_text))
+        return index
+
+    def __len__(self):
+        return len(self._docs)
+
+    def grams_by_text(self):
+        with self._lock:
+            return {text: grams for _, text, grams, _ in self._docs.values()}
+
+    def add(self, key, text, item, grams=None):
+        """Добавляет объект; при дубле ключа остаётся первый, как в остальных индексах кэша"""
+        key = str(key).strip()
+        text = " ".join(normalize(text))
+        if not key or not text:
+            return
+        grams = grams if grams is not None else trigrams(text.split())
+        with self._lock:
+            if key in self._docs:
+                return
+            self._docs[key] = (item, text, grams, len(self._docs))
+            for gram in grams:
+                self._postings[gram].add(key)
+
+    def search(self, query, limit=10, accept=None):
+        """Лучшие совпадения для query (не больше limit); accept(item) отсеивает лишние"""
+        return [item for _, item in self.scored(query, limit, accept)]
+
+    def scored(self, query, limit=10, accept=None):
+        """Как search, но с оценкой: [((точное совпадение, доля триграмм, Дайс), объект)]"""
+        words = normalize(query)
+        if not words:
+            return []
+        phrase = " ".join(words)
+        grams = trigrams(words)
+        with self._lock:
+            hits = defaultdict(int)
+            for gram in grams:
+                for key in self._postings.get(gram, ()):
+                    hits[key] += 1
+            ranked = []
+            for key, common in hits.items():
+                coverage = common / len(grams)
+                if coverage < MIN_COVERAGE:
+                    continue
+                item, text, doc_grams, order = self._docs[key]
+                score = (phrase in text, coverage, 2 * common / (len(grams) + len(doc_grams)))
+                ranked.append((score, order, item))
+        ranked.sort(key=lambda hit: (tuple(-value for value in hit[0]), hit[1]))
+        found = []
+        for score, _, item in ranked:
+            if accept is None or accept(item):
+                found.append((score, item))
+                if len(found) >= limit:
+                    break
+        return found
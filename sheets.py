@@ -1,9 +1,25 @@
 # sheets.py
+import asyncio
 import datetime
+import functools
 import logging
 import threading
 import time
-from config import client, SPREADSHEET_ID
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from gspread.exceptions import GSpreadException
+from gspread.utils import a1_to_rowcol, absolute_range_name, numericise_all, rowcol_to_a1, to_records
+from backend import get_client, get_spreadsheet, get_worksheet
+from config import (
+    SPREADSHEET_ID, LEDGER_BATCH_SIZE, LEDGER_FLUSH_DELAY, LEDGER_JOURNAL_FILE, LEDGER_RETRY_DELAY,
+    SUBMIT_DEDUPE_TTL, SHEETS_MAX_WORKERS, SHEETS_CALL_TIMEOUT, SHEETS_LOAD_TIMEOUT, CACHE_SNAPSHOT_FILE,
+    SYNC_FULL_RELOAD_EVERY, SOURCE_SKIP_LIMIT
+)
+from journal import Journal
+from ledger import UPDATED_RANGE_ROW, LedgerWriter, SubmissionStore
+from search import SearchIndex, normalize
+from snapshot import save_snapshot, load_snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -13,10 +29,19 @@ __all__ = [
     "get_employee_data", "get_role_permissions", "can_write_off_at_status", "record_expense",
     "record_instrument_transaction", "add_new_instrument", "record_delivery", "record_ferma_write_off",
     "get_plates_by_type", "get_plate_stock", "get_web_form_url", "get_instruments",
-    "get_materials_by_category", "get_material_categories", "get_plate_categories", "get_plates_by_category"
+    "get_materials_by_category", "get_material_categories", "get_plate_categories", "get_plates_by_category", "get_cache_version",
+    "get_project", "get_employee_by_login", "get_employee_fullname", "get_material", "get_material_by_name", "get_plate", "rebuild_indexes",
+    "get_instrument", "search_instruments", "get_instrument_page", "instrument_query_key", "search_projects", "search_materials", "match_catalog",
+    "submit_write_off", "submit_expense", "submit_delivery", "submit_ferma_write_off", "data_ledger",
+    "instrument_ledger", "ledger_journal", "start_ledgers", "drain_ledgers", "submit_instrument_transaction",
+    "aload_caches", "arecord_write_off", "arecord_expense", "arecord_delivery", "arecord_ferma_write_off",
+    "arecord_instrument_transaction", "aadd_new_instrument", "aupdate_project_status",
+    "aupdate_project_report_link", "acreate_project_record", "update_project_statuses", "aupdate_project_statuses",
+    "start_refresh", "is_refreshing", "get_cache_counts", "RefreshProgress"
 ]
 
 HEADERS = ["ID проекта", "Ф.И.О заказчика", "Номер договора", "Тип сделки", "Статус", "Дата создания", "Примечание", "Ссылка на отчёт"]
+PROJECT_TAG_COL = HEADERS.index("Номер договора") + 1
 EMPLOYEE_HEADERS = ["ID", "Ф.И.О", "Логин", "Пароль", "Роль", "Отдел", "Доступ"]
 MATERIAL_HEADERS = ["ID", "Наименование", "Ед. измерения", "Тип сделки"]
 URL_HEADERS = ["Действие", "URL"]
@@ -24,8 +49,19 @@ DATA_HEADERS = ["№ строки", "Дата", "Тип операции", "Кт
 INSTRUMENT_HEADERS = ["ID инструмента", "Инструмент", "Ед. измерения", "Кол-во на складе"]
 WHERE_INSTRUMENT_HEADERS = ["№ строки", "Дата", "Тип операции", "Кто", "Номер договора", "Кому выдан инструмент", "Инструмент", "кол-во"]
 
+# Листы, которые load_caches забирает одним запросом values:batchGet
+CACHE_SHEETS = [
+    "Проекты", "Сотрудники", "Действия и разрешения", "Материалы", "Пластины МЗП",
+    "URL действия", "Инструмент", "Где инструмент"
+]
+
+# Листы, которые только дописываются: после первой полной загрузки забираем лишь новый хвост.
+# "Данные" в кэш не загружается вовсе — очередь data_ledger читает его колонку A один раз за процесс.
+APPEND_ONLY_SHEETS = {"Где инструмент": "H"}
+
 caches = {
     "projects": None,
+    "project_rows": None,                # нормализованный Номер договора -> строка на листе "Проекты"
     "employees": None,
     "permissions": None,
     "materials": None,
@@ -38,9 +74,131 @@ caches = {
     "material_categories": None,         # Категории материалов
     "materials_by_category": None,       # Материалы по категориям
     "plate_categories": None,            # Категории пластин
-    "plates_by_category": None           # Пластины по категориям
+    "plates_by_category": None,          # Пластины по категориям
+    # --- Индексы для поиска за O(1); строятся из списков выше, в файл не сохраняются ---
+    "projects_by_id": None,              # str(ID проекта) -> проект
+    "projects_by_number": None,          # нормализованный Номер договора -> проект
+    "employees_by_login": None,          # Логин -> сотрудник
+    "roles": None,                       # роль (нижний регистр) -> разобранные права
+    "materials_by_id": None,             # ID материала -> материал
+    "materials_by_name": None,           # нормализованное название материала -> материал
+    "plates_by_id": None,                # ID пластины -> пластина
+    "instruments_by_id": None,           # str(ID инструмента) -> инструмент
+    "instrument_list": None,             # инструменты с названием в виде для клавиатур
+    "instrument_pages": None,            # поисковый запрос -> страницы клавиатуры инструментов (LRU)
+    "search_projects": None,             # нечёткий поиск по номеру договора и заказчику
+    "search_materials": None,            # нечёткий поиск по названию материала
+    "search_instruments": None,          # нечёткий поиск по названию инструмента
+    "search_plates": None,               # нечёткий поиск по названию пластины
+    "role_views": None,                  # роль -> готовый список видимых ей проектов
+    "version": 0,                        # номер версии кэша, растёт при каждой перезагрузке
+    "sync_state": None,                  # водяные знаки инкрементальной загрузки по листам
+    "source_modified": None,             # modifiedTime таблицы в Drive на момент последней загрузки
+    "fingerprints": None                 # контрольные суммы значений листов на момент последнего разбора
 }
 
+# Ключи результата сборки, с которыми снимок на диске нужно обновить
+SNAPSHOT_STATE_KEYS = ("version", "sync_state", "fingerprints", "source_modified")
+
+# Сборки кэша (фоновые, по расписанию, по кнопке) идут строго по одной
+_load_lock = threading.Lock()
+# Сколько обновлений подряд пропущено по времени изменения таблицы (под _load_lock)
+_source_skips = 0
+# Текущее обновление кэша в цикле событий бота: одновременные вызовы ждут его, а не запускают второе
+_refresh_task = None
+_refresh_progress = None
+# Правки кэша после записи ботом (новый проект, статус, инструмент), сделанные во время сборки:
+# сборка могла прочитать лист до записи, поэтому apply_caches повторяет их поверх новых значений
+_local_edits = []
+_local_edits_lock = threading.Lock()
+# Сборки в пуле потоков, результат которых цикл событий ещё не применил
+_builds_running = 0
+# Цикл событий бота: в нём применяются и строки, записанные потоком очереди
+_loop = None
+
+def cache_written_instruments(rows):
+    # Строки попадают в кэш, когда уже легли в таблицу и получили номер. Вызывается потоком
+    # очереди записи, а кэш правится в цикле событий — как и после остальных записей
+    records = [dict(zip(WHERE_INSTRUMENT_HEADERS, row)) for row in rows]
+    edit = functools.partial(apply_local_edit, lambda: cache_where_instruments(records))
+    if _loop is not None and not _loop.is_closed():
+        _loop.call_soon_threadsafe(edit)
+    else:
+        edit()
+
+def cache_where_instruments(records):
+    where = caches["where_instruments"]
+    if where is None or not records:
+        return
+    # Строки могли уже прийти с хвостом листа: номера строк растут, сверяем только конец списка
+    first = min(record["№ строки"] for record in records)
+    known = set()
+    for record in reversed(where):
+        number = record.get("№ строки")
+        if isinstance(number, (int, float)) and number < first:
+            break
+        known.add(number)
+    where.extend(record for record in records if record["№ строки"] not in known)
+
+# Общие очереди дозаписи для всех обработчиков. Отправки сначала пишутся в локальный журнал,
+# ключ идемпотентности каждой строки — в колонке сразу за данными (N в "Данные", I в "Где инструмент")
+ledger_journal = Journal(LEDGER_JOURNAL_FILE)
+data_ledger = LedgerWriter(
+    "Данные", 12, journal=ledger_journal, batch_size=LEDGER_BATCH_SIZE,
+    flush_delay=LEDGER_FLUSH_DELAY, retry_delay=LEDGER_RETRY_DELAY
+)
+instrument_ledger = LedgerWriter(
+    "Где инструмент", 7, journal=ledger_journal, batch_size=LEDGER_BATCH_SIZE,
+    flush_delay=LEDGER_FLUSH_DELAY, retry_delay=LEDGER_RETRY_DELAY, on_written=cache_written_instruments
+)
+LEDGERS = [data_ledger, instrument_ledger]
+# Отправленные корзины: ID корзины служит и ключом отправки в журнале
+submitted_carts = SubmissionStore(SUBMIT_DEDUPE_TTL)
+
+def start_ledgers():
+    """Отправляет в таблицу то, что осталось в журнале с прошлого запуска.
+    Вызывается из цикла событий бота: в нём же кэш получает записанные очередью строки"""
+    global _loop
+    try:
+        _loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _loop = None
+    for ledger in LEDGERS:
+        dead = ledger.dead_letters()
+        if dead:
+            logger.error(
+                f"'{ledger.sheet_name}': {len(dead)} отправок отклонены таблицей и ждут разбора "
+                f"в журнале {LEDGER_JOURNAL_FILE} (записи \"op\": \"dead\")"
+            )
+    return sum(ledger.recover() for ledger in LEDGERS)
+
+def drain_ledgers(timeout):
+    deadline = time.monotonic() + timeout
+    drained = all([ledger.drain(max(0, deadline - time.monotonic())) for ledger in LEDGERS])
+    ledger_journal.close()
+    return drained
+
+INDEX_KEYS = [
+    "projects_by_id", "projects_by_number", "employees_by_login", "roles",
+    "materials_by_id", "materials_by_name", "plates_by_id", "instruments_by_id", "role_views",
+    "instrument_list", "instrument_pages", "search_projects", "search_materials", "search_instruments",
+    "search_plates"
+]
+
+# Инструментов на одной странице клавиатуры и найденных по запросу (не больше 4 страниц)
+INSTRUMENT_PAGE_SIZE = 15
+INSTRUMENT_SEARCH_LIMIT = 60
+# Запросов, страницы которых помним (давно не запрошенные вытесняются)
+INSTRUMENT_PAGES_LIMIT = 1024
+
+POSSIBLE_ACTIONS = [
+    "Смена статуса проекта", "Создать проект", "Списать материалы",
+    "Списание материалов (веб-форма)", "Списать материалы на фермы",
+    "Добавить расход", "Доставка", "Инструмент", "Новый инструмент",
+    "Закупка материалов", "Внести объемы материалов", "Обновление КЭШ-а",
+    "Сообщить о проблеме"
+]
+
 def find_header_row(all_values, required_headers):
     for i, row in enumerate(all_values):
         if all(any(h.lower() in cell.lower() for cell in row) for h in required_headers):
@@ -51,123 +209,619 @@ def find_last_row(worksheet, column="A"):
     values = worksheet.col_values(1)
     return len(values) if values else 1
 
-def load_caches(force=False):
-    global caches
-    now = datetime.datetime.now()
-    if caches["last_updated"] and not force and (now - caches["last_updated"]).total_seconds() < 3600:
-        logger.info("Используется кэшированная версия данных.")
-        return
+def fetch_sheets_values(sheet_names, ranges=None):
+    """Загружает значения нескольких листов одним запросом values:batchGet.
+    ranges позволяет запросить у отдельных листов только диапазон (например, хвост)"""
+    ranges = ranges or {}
+    spreadsheet = get_spreadsheet()
+    response = spreadsheet.values_batch_get([ranges.get(name) or absolute_range_name(name) for name in sheet_names])
+    value_ranges = response.get("valueRanges", [])
+    return {name: pad_values(value_range.get("values", [])) for name, value_range in zip(sheet_names, value_ranges)}
+
+def pad_values(all_values):
+    # API обрезает пустые ячейки в конце строк; выравниваем, как это делает get_all_values()
+    width = max((len(row) for row in all_values), default=0)
+    return [row + [""] * (width - len(row)) for row in all_values]
+
+def records_from_values(all_values, head, expected_headers=None):
+    """Аналог worksheet.get_all_records() для уже загруженных значений листа"""
+    if not all_values:
+        return []
+    padded = pad_values(all_values)
+    keys = padded[head - 1]
+    if expected_headers and not all(header in keys for header in expected_headers):
+        raise GSpreadException(f"the given 'expected_headers' contains unknown headers: {set(expected_headers) - set(keys)}")
+    return to_records(keys, [numericise_all(row) for row in padded[head:]])
+
+def row_checksum(row):
+    cells = [str(cell) for cell in row]
+    while cells and cells[-1] == "":
+        cells.pop()
+    return zlib.crc32("\x1f".join(cells).encode("utf-8"))
+
+def tail_width(sheet_name):
+    return a1_to_rowcol(f"{APPEND_ONLY_SHEETS[sheet_name]}1")[1]
+
+def data_columns(values):
+    """Отрезает у листов, которые только дописываются, колонки правее данных — в них
+    очередь записи хранит ключи идемпотентности, в записи кэша они не попадают"""
+    for name in APPEND_ONLY_SHEETS.keys() & values.keys():
+        width = tail_width(name)
+        values[name] = [row[:width] for row in values[name]]
+    return values
+
+def tail_range(sheet_name, state):
+    # Начинаем с последней уже загруженной строки, чтобы сверить её контрольную сумму
+    return f"{absolute_range_name(sheet_name)}!A{state['rows']}:{APPEND_ONLY_SHEETS[sheet_name]}"
+
+def full_sync_state(sheet_name, all_values, records):
+    header_row = find_header_row(all_values, ["№ строки", "Дата"])
+    return {
+        "rows": len(all_values),
+        # Хвост запрашивается только до последней колонки данных — так же считаем и сумму
+        "tail_crc": row_checksum(all_values[-1][:tail_width(sheet_name)]) if all_values else 0,
+        "headers": pad_values(all_values)[header_row - 1] if header_row else [],
+        "records": len(records),
+        "syncs": 0
+    }
+
+def apply_tail(tail, state, old_records):
+    """Дописывает к записям строки из хвоста листа. None — если лист менялся выше водяного знака"""
+    keys = state.get("headers") or []
+    if not tail or not keys or row_checksum(tail[0]) != state["tail_crc"] or len(old_records or []) < state["records"]:
+        return None
+    new_rows = tail[1:]
+    if any(len(row) > len(keys) for row in new_rows):
+        return None
+    new_records = to_records(keys, [numericise_all(row + [""] * (len(keys) - len(row))) for row in new_rows])
+    new_state = dict(
+        state,
+        rows=state["rows"] + len(new_rows),
+        tail_crc=row_checksum(tail[-1]),
+        records=state["records"] + len(new_records),
+        syncs=state["syncs"] + 1
+    )
+    # Берём только синхронизированную часть: строки, дописанные ботом локально, придут с хвостом
+    return old_records[:state["records"]] + new_records, new_state
+
+def parse_table(all_values, sheet_name, required_headers, expected_headers):
+    header_row = find_header_row(all_values, required_headers)
+    if header_row is None:
+        logger.error(f"Заголовки таблицы не найдены в листе '{sheet_name}'.")
+        return None
+    logger.info(f"Заголовки листа '{sheet_name}' найдены на строке {header_row}: {all_values[header_row - 1]}")
+    return records_from_values(all_values, header_row, expected_headers)
+
+# --- РАЗБОР ЛИСТОВ ДЛЯ КЭША ---
+def parse_projects_sheet(values):
+    projects_data = parse_table(values, "Проекты", ["ID проекта", "Номер договора"], HEADERS)
+    projects = sorted(projects_data or [], key=lambda x: x.get("Дата создания", ""), reverse=True)
+    header_row = find_header_row(values, ["ID проекта", "Номер договора"]) or 0
+    column = [row[PROJECT_TAG_COL - 1] if len(row) >= PROJECT_TAG_COL else "" for row in values]
+    logger.info(f"Проекты загружены, записей: {len(projects)}")
+    return {"projects": projects, "project_rows": project_rows_from_column(column, header_row + 1)}
+
+def project_rows_from_column(column, first_row=1):
+    """Номер договора (нормализованный) -> номер строки листа. При дублях — первая строка, как в индексах"""
+    rows = {}
+    for row, tag in enumerate(column[first_row - 1:], start=first_row):
+        if str(tag).strip():
+            rows.setdefault(normalize_tag(tag), row)
+    return rows
+
+def parse_employees_sheet(values):
+    employees = parse_table(values, "Сотрудники", ["ID", "Ф.И.О"], EMPLOYEE_HEADERS) or []
+    logger.info(f"Сотрудники загружены, записей: {len(employees)}")
+    return {"employees": employees}
+
+def parse_permissions_sheet(values):
+    logger.info(f"Действия и разрешения загружены, строк: {len(values)}")
+    return {"permissions": values}
+
+def parse_materials_sheet(values):
+    # Основные материалы: только через парсер категорий (вертикально, одна вкладка)
+    cats, mats = parse_materials_and_categories(values)
+    logger.info(f"Категорий материалов: {len(cats)}. Пример: {cats[:5]}")
+    return {"material_categories": cats, "materials_by_category": mats}
+
+def parse_plates_sheet(values):
+    result = {
+        "plate_types": [row[1] for row in values[1:6] if row and row[1] and row[1] != "Тип пластин"],
+        "plates": values[6:]
+    }
+    logger.info(f"Типы пластин: {len(result['plate_types'])}, пластины: {len(result['plates'])}")
+    # Категории пластин (ГОРИЗОНТАЛЬНО)
     try:
-        spreadsheet = client.open_by_key(SPREADSHEET_ID)
-        sheet_names = [sheet.title for sheet in spreadsheet.worksheets()]
-        logger.info(f"Доступные листы в таблице: {sheet_names}")
-
-        # --- Проекты ---
-        projects_sheet = spreadsheet.worksheet("Проекты")
-        projects_all_values = projects_sheet.get_all_values()
-        projects_header_row = find_header_row(projects_all_values, ["ID проекта", "Номер договора"])
-        if projects_header_row is None:
-            logger.error("Заголовки таблицы проектов не найдены в листе 'Проекты'.")
-            caches["projects"] = []
-        else:
-            logger.info(f"Заголовки листа 'Проекты' найдены на строке {projects_header_row}: {projects_all_values[projects_header_row - 1]}")
-            projects_data = projects_sheet.get_all_records(expected_headers=HEADERS, head=projects_header_row)
-            caches["projects"] = sorted(projects_data, key=lambda x: x.get("Дата создания", ""), reverse=True)
-            logger.info(f"Проекты загружены, записей: {len(caches['projects'])}")
-
-        # --- Сотрудники ---
-        employees_sheet = spreadsheet.worksheet("Сотрудники")
-        employees_all_values = employees_sheet.get_all_values()
-        employees_header_row = find_header_row(employees_all_values, ["ID", "Ф.И.О"])
-        if employees_header_row is None:
-            logger.error("Заголовки таблицы сотрудников не найдены в листе 'Сотрудники'.")
-            caches["employees"] = []
-        else:
-            logger.info(f"Заголовки листа 'Сотрудники' найдены на строке {employees_header_row}: {employees_all_values[employees_header_row - 1]}")
-            employees_data = employees_sheet.get_all_records(expected_headers=EMPLOYEE_HEADERS, head=employees_header_row)
-            caches["employees"] = employees_data
-            logger.info(f"Сотрудники загружены, записей: {len(caches['employees'])}")
+        cats, plates = parse_plate_categories_and_plates(values)
+        result["plate_categories"] = cats
+        result["plates_by_category"] = plates
+        logger.info(f"Категорий пластин: {len(cats)}. Пример: {cats[:5]}")
+    except Exception as e:
+        logger.error(f"Ошибка разбора категорий пластин: {e}")
+    return result
+
+def parse_urls_sheet(values):
+    urls_data = parse_table(values, "URL действия", ["Действие", "URL"], URL_HEADERS)
+    urls = {row["Действие"]: row["URL"] for row in urls_data or [] if row.get("URL", "")}
+    logger.info(f"URL действия загружены, записей: {len(urls)}")
+    return {"urls": urls}
+
+def parse_instruments_sheet(values):
+    instruments = parse_table(values, "Инструмент", ["ID инструмента", "Инструмент"], INSTRUMENT_HEADERS) or []
+    logger.info(f"Инструменты загружены, записей: {len(instruments)}")
+    return {"instruments": instruments}
+
+def parse_where_instruments_sheet(values):
+    where_instruments = parse_table(values, "Где инструмент", ["№ строки", "Дата"], WHERE_INSTRUMENT_HEADERS) or []
+    logger.info(f"Где инструмент загружено, записей: {len(where_instruments)}")
+    return {"where_instruments": where_instruments}
+
+# Лист -> (разборщик, ключи кэша, которые он заполняет)
+SHEET_PARSERS = {
+    "Проекты": (parse_projects_sheet, ["projects", "project_rows"]),
+    "Сотрудники": (parse_employees_sheet, ["employees"]),
+    "Действия и разрешения": (parse_permissions_sheet, ["permissions"]),
+    "Материалы": (parse_materials_sheet, ["material_categories", "materials_by_category"]),
+    "Пластины МЗП": (parse_plates_sheet, ["plate_types", "plates", "plate_categories", "plates_by_category"]),
+    "URL действия": (parse_urls_sheet, ["urls"]),
+    "Инструмент": (parse_instruments_sheet, ["instruments"]),
+    "Где инструмент": (parse_where_instruments_sheet, ["where_instruments"])
+}
+
+def values_fingerprint(all_values):
+    crc = 0
+    for row in all_values:
+        crc = zlib.crc32(row_checksum(row).to_bytes(4, "big"), crc)
+    return crc
+
+def get_source_modified_time():
+    """modifiedTime таблицы из Drive API: один лёгкий запрос вместо загрузки всех листов"""
+    try:
+        return get_client().http_client.get_file_drive_metadata(SPREADSHEET_ID).get("modifiedTime")
+    except Exception as e:
+        logger.warning(f"Не удалось получить время изменения таблицы: {e}")
+        return None
+
+def load_caches(force=False, full=False):
+    """Загрузка кэша для синхронного кода (скрипты, замеры). Бот обновляет кэш через aload_caches"""
+    try:
+        fresh, changed = build_caches(force, full)
+    except Exception:
+        take_local_edits()
+        raise
+    apply_caches(fresh, changed)
+    if needs_snapshot(fresh):
+        save_caches_snapshot()
+
+class RefreshProgress:
+    """Ход обновления кэша по этапам с длительностью (для сообщения администратору).
+    Этапы отмечает поток пула, читает цикл событий"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.steps = []                 # [(этап, секунды)]
+        self.current = None
+        self.finished = False
+        self._step_started = self.started
+        self._lock = threading.Lock()
 
-        # --- Права ---
-        perms_data = spreadsheet.worksheet("Действия и разрешения").get_all_values()
-        caches["permissions"] = perms_data
-        logger.info(f"Действия и разрешения загружены, строк: {len(caches['permissions'])}")
+    def step(self, name):
+        with self._lock:
+            now = time.monotonic()
+            if self.current:
+                self.steps.append((self.current, now - self._step_started))
+            self.current, self._step_started = name, now
 
-            # --- Основные материалы: теперь только через парсер категорий (вертикально, одна вкладка) ---
+    def finish(self):
+        self.step(None)
+        self.finished = True
+
+    def snapshot(self):
+        """(завершённые этапы, текущий этап, секунд с начала)"""
+        with self._lock:
+            return list(self.steps), self.current, time.monotonic() - self.started
+
+def build_caches(force=False, full=False, progress=None):
+    """Собирает новые значения ключей кэша из Google Sheets, сам кэш не меняет.
+    Возвращает (новые значения или None, если кэш ещё свежий; изменённые листы).
+    Сборки не пересекаются: вторая ждёт окончания первой"""
+    global _source_skips
+    step = progress.step if progress else lambda name: None
+    with _load_lock:
+        now = datetime.datetime.now()
+        if caches["last_updated"] and not force and (now - caches["last_updated"]).total_seconds() < 3600:
+            logger.info("Используется кэшированная версия данных.")
+            return None, []
         try:
-            cats, mats = parse_materials_and_categories()
-            caches["material_categories"] = cats
-            caches["materials_by_category"] = mats
-            logger.info(f"Категорий материалов: {len(cats)}. Пример: {cats[:5]}")
+            # Дешёвая проверка: если таблицу никто не трогал, листы не скачиваем. Записи бота тоже
+            # сдвигают время изменения — тогда листы загружаются, а неизменённые отсеиваются по
+            # контрольным суммам. Drive обновляет время с задержкой, поэтому раз в SOURCE_SKIP_LIMIT
+            # пропусков листы всё равно сверяются
+            step("Проверка изменений таблицы")
+            modified = get_source_modified_time()
+            if (not full and modified and caches["last_updated"] and modified == caches.get("source_modified")
+                    and _source_skips < SOURCE_SKIP_LIMIT):
+                _source_skips += 1
+                logger.info(f"Таблица не менялась с {modified}, перезагрузка кэша пропущена.")
+                return {"last_updated": now}, []
+            _source_skips = 0
+
+            # Все листы одним запросом, дальше разбор только из полученных значений.
+            # У листов, которые только дописываются, запрашиваем лишь хвост после водяного знака.
+            sync_state = dict(caches.get("sync_state") or {})
+            tails = {
+                name: tail_range(name, state) for name, state in sync_state.items()
+                if name in APPEND_ONLY_SHEETS and not full and state.get("rows") and state.get("syncs", 0) < SYNC_FULL_RELOAD_EVERY
+            }
+            step(f"Загрузка листов ({len(CACHE_SHEETS)})")
+            values = data_columns(fetch_sheets_values(CACHE_SHEETS, tails))
+
+            # --- Где инструмент: сначала пробуем дописать хвост ---
+            synced = None
+            if "Где инструмент" in tails:
+                synced = apply_tail(values["Где инструмент"], sync_state["Где инструмент"], caches.get("where_instruments"))
+                if synced is None:
+                    logger.warning("Лист 'Где инструмент' изменён выше водяного знака, загружаем целиком.")
+                    values.update(data_columns(fetch_sheets_values(["Где инструмент"])))
+
+            # Листы, значения которых не изменились, повторно не разбираем
+            old_fingerprints = {} if full else (caches.get("fingerprints") or {})
+            fingerprints, fresh, changed = {}, {}, []
+            for name in CACHE_SHEETS:
+                parser, keys = SHEET_PARSERS[name]
+                step(f"Разбор: {name}")
+                if name == "Где инструмент" and synced is not None:
+                    added = synced[1]["records"] - sync_state[name]["records"]
+                    fresh["where_instruments"], sync_state[name] = synced
+                    logger.info(f"Где инструмент: догружено строк {added}, всего записей: {len(fresh['where_instruments'])}")
+                    if added:
+                        changed.append(name)
+                    continue
+                fingerprint = values_fingerprint(values[name])
+                # Листы с хвостовой догрузкой всегда разбираем заново, чтобы сбросить водяной знак
+                if name not in APPEND_ONLY_SHEETS and fingerprint == old_fingerprints.get(name) and all(caches.get(key) is not None for key in keys):
+                    fingerprints[name] = fingerprint
+                    continue
+                try:
+                    fresh.update(parser(values[name]))
+                    fingerprints[name] = fingerprint
+                    changed.append(name)
+                except Exception as e:
+                    logger.error(f"Ошибка разбора листа '{name}': {e}")
+                if name == "Где инструмент":
+                    sync_state[name] = full_sync_state(name, values[name], fresh.get("where_instruments", []))
+
+            fresh["sync_state"] = sync_state
+            fresh["fingerprints"] = fingerprints
+            fresh["source_modified"] = modified
+            fresh["last_updated"] = now
+            if not changed and caches.get("version"):
+                # Изменилось что-то вне кэшируемых листов: версию и индексы не трогаем
+                logger.info("Кэшируемые листы не изменились, разбор пропущен.")
+                return fresh, changed
+            fresh["version"] = (caches.get("version") or 0) + 1
+            step("Индексы")
+            fresh.update(build_indexes(dict(caches, **fresh), caches))
+            return fresh, changed
         except Exception as e:
-            logger.error(f"Ошибка разбора категорий материалов: {e}")
+            logger.error(f"Ошибка при загрузке кэшей: {str(e)}", exc_info=True)
+            raise
 
-        # --- Пластины ---
-        plates_data = spreadsheet.worksheet("Пластины МЗП").get_all_values()
-        caches["plate_types"] = [row[1] for row in plates_data[1:6] if row and row[1] and row[1] != "Тип пластин"]
-        caches["plates"] = plates_data[6:]
-        logger.info(f"Типы пластин: {len(caches['plate_types'])}, пластины: {len(caches['plates'])}")
+def apply_caches(fresh, changed):
+    """Подменяет значения кэша одним caches.update и повторяет поверх них правки, сделанные
+    во время сборки (apply_local_edit). В боте и подмена, и все правки кэша идут в потоке цикла
+    событий, поэтому обработчик видит кэш целиком старым или целиком новым. True — данные изменились"""
+    if fresh is None:
+        take_local_edits()
+        return False
+    with _local_edits_lock:
+        caches.update(fresh)
+        replay_local_edits(_local_edits)
+        _local_edits.clear()
+    if "version" not in fresh:
+        return False
+    logger.info(f"Данные из Google Sheets загружены в кэш (версия {fresh['version']}). Изменённые листы: {', '.join(changed) or 'нет'}")
+    return True
 
-        # --- Категории пластин (ГОРИЗОНТАЛЬНО) ---
+def needs_snapshot(fresh):
+    """Снимок сохраняется и тогда, когда данные не изменились, но сменились водяные знаки,
+    контрольные суммы листов или время изменения таблицы: иначе после перезапуска снимок
+    с прежними отметками заставит загрузить листы заново"""
+    return fresh is not None and any(key in fresh for key in SNAPSHOT_STATE_KEYS)
+
+def apply_local_edit(edit, replay=None):
+    """Применяет правку кэша после записи в таблицу. Если идёт сборка кэша, правка (или replay —
+    её вариант для повтора) запоминается и повторяется после подмены кэша. Правки идемпотентны:
+    запись могла попасть и в новые значения"""
+    with _local_edits_lock:
+        edit()
+        if _load_lock.locked() or _builds_running:
+            _local_edits.append(replay or edit)
+
+def take_local_edits():
+    """Забывает запомненные правки (сборка не удалась или не понадобилась)"""
+    with _local_edits_lock:
+        edits = list(_local_edits)
+        _local_edits.clear()
+    return edits
+
+def replay_local_edits(edits):
+    for edit in edits:
         try:
-            cats, plates = parse_plate_categories_and_plates()
-            caches["plate_categories"] = cats
-            caches["plates_by_category"] = plates
-            logger.info(f"Категорий пластин: {len(cats)}. Пример: {cats[:5]}")
+            edit()
         except Exception as e:
-            logger.error(f"Ошибка разбора категорий пластин: {e}")
-
-        # --- URL действия ---
-        urls_sheet = spreadsheet.worksheet("URL действия")
-        urls_all_values = urls_sheet.get_all_values()
-        urls_header_row = find_header_row(urls_all_values, ["Действие", "URL"])
-        if urls_header_row is None:
-            logger.error("Заголовки таблицы URL не найдены в листе 'URL действия'. Используем пустой словарь.")
-            caches["urls"] = {}
-        else:
-            logger.info(f"Заголовки листа 'URL действия' найдены на строке {urls_header_row}: {urls_all_values[urls_header_row - 1]}")
-            urls_data = urls_sheet.get_all_records(expected_headers=URL_HEADERS, head=urls_header_row)
-            caches["urls"] = {row["Действие"]: row["URL"] for row in urls_data if row.get("URL", "")}
-            logger.info(f"URL действия загружены, записей: {len(caches['urls'])}")
-
-        # --- Инструменты ---
-        instruments_sheet = spreadsheet.worksheet("Инструмент")
-        instruments_all_values = instruments_sheet.get_all_values()
-        instruments_header_row = find_header_row(instruments_all_values, ["ID инструмента", "Инструмент"])
-        if instruments_header_row is None:
-            logger.error("Заголовки таблицы инструментов не найдены в листе 'Инструмент'.")
-            caches["instruments"] = []
-        else:
-            logger.info(f"Заголовки листа 'Инструмент' найдены на строке {instruments_header_row}: {instruments_all_values[instruments_header_row - 1]}")
-            instruments_data = instruments_sheet.get_all_records(expected_headers=INSTRUMENT_HEADERS, head=instruments_header_row)
-            caches["instruments"] = instruments_data
-            logger.info(f"Инструменты загружены, записей: {len(caches['instruments'])}")
-
-        # --- Где инструмент ---
-        where_instruments_sheet = spreadsheet.worksheet("Где инструмент")
-        where_instruments_all_values = where_instruments_sheet.get_all_values()
-        where_instruments_header_row = find_header_row(where_instruments_all_values, ["№ строки", "Дата"])
-        if where_instruments_header_row is None:
-            logger.error("Заголовки таблицы 'Где инструмент' не найдены.")
-            caches["where_instruments"] = []
+            logger.error(f"Ошибка повтора правки кэша после обновления: {e}")
+
+def get_cache_counts():
+    """Число записей в кэше по листам — для отчёта о том, что принесло обновление"""
+    def total(groups):
+        return sum(len(items) for items in (groups or {}).values())
+    return {
+        "Проекты": len(caches.get("projects") or []),
+        "Сотрудники": len(caches.get("employees") or []),
+        "Действия и разрешения": len(caches.get("permissions") or []),
+        "Материалы": total(caches.get("materials_by_category")),
+        "Пластины МЗП": total(caches.get("plates_by_category")),
+        "URL действия": len(caches.get("urls") or {}),
+        "Инструмент": len(caches.get("instruments") or []),
+        "Где инструмент": len(caches.get("where_instruments") or [])
+    }
+
+# --- ИНДЕКСЫ ---
+def normalize_tag(tag):
+    return str(tag).strip().lower()
+
+def parse_role_statuses(raw):
+    # Статусы в таблице записаны через пробел; "В работе" и "Продукция готова" склеиваем обратно
+    words = raw.split() if raw else []
+    statuses = []
+    i = 0
+    while i < len(words):
+        if i + 1 < len(words) and words[i] in ["В", "Продукция"]:
+            statuses.append(f"{words[i]} {words[i+1]}")
+            i += 2
         else:
-            logger.info(f"Заголовки листа 'Где инструмент' найдены на строке {where_instruments_header_row}: {where_instruments_all_values[where_instruments_header_row - 1]}")
-            where_instruments_data = where_instruments_sheet.get_all_records(expected_headers=WHERE_INSTRUMENT_HEADERS, head=where_instruments_header_row)
-            caches["where_instruments"] = where_instruments_data
-            logger.info(f"Где инструмент загружено, записей: {len(caches['where_instruments'])}")
+            statuses.append(words[i])
+            i += 1
+    return statuses
+
+def build_indexes(data, previous=None):
+    """Строит словари поиска по спискам кэша. При дублях выигрывает первая запись, как при линейном поиске.
+    previous — индексы прошлой версии: из них берутся поисковые индексы неизменившихся листов"""
+    indexes = {key: {} for key in INDEX_KEYS}
+    indexes["instrument_list"] = []
+    indexes["instrument_pages"] = OrderedDict()
+    for project in data.get("projects") or []:
+        index_project(project, indexes)
+    for emp in data.get("employees") or []:
+        indexes["employees_by_login"].setdefault(str(emp.get("Логин", "")).strip(), emp)
+    for row in data.get("permissions") or []:
+        if row and row[0] and row[0].lower() not in indexes["roles"]:
+            indexes["roles"][row[0].lower()] = compile_role(row)
+    for mats in (data.get("materials_by_category") or {}).values():
+        for mat in mats:
+            indexes["materials_by_id"].setdefault(str(mat.get("ID")), mat)
+            name = " ".join(normalize(mat.get("Наименование", "")))
+            if name:
+                indexes["materials_by_name"].setdefault(name, mat)
+    for plates in (data.get("plates_by_category") or {}).values():
+        for plate in plates:
+            indexes["plates_by_id"].setdefault(str(plate.get("ID")), plate)
+    for instr in data.get("instruments") or []:
+        index_instrument(instr, indexes)
+    build_search_indexes(data, indexes, previous or {})
+    return indexes
+
+def project_search_text(project):
+    return f"{project.get('Номер договора', '')} {project.get('Ф.И.О заказчика', '')}"
+
+def build_search_indexes(data, indexes, previous):
+    """Нечёткий поиск. Индекс листа, который не менялся (тот же список в кэше), переходит в новую
+    версию как есть; у изменённого листа триграммы считаются заново только для новых названий"""
+    def reuse_or_build(name, source, items, key, text):
+        old = previous.get(name)
+        if old is not None and source is not None and old.source is source:
+            return old
+        return SearchIndex.build(items, key, text, source=source, previous=old)
+
+    projects = data.get("projects")
+    indexes["search_projects"] = reuse_or_build(
+        "search_projects", projects, projects or [], lambda p: p.get("ID проекта"), project_search_text
+    )
+    materials = data.get("materials_by_category")
+    indexes["search_materials"] = reuse_or_build(
+        "search_materials", materials, [mat for mats in (materials or {}).values() for mat in mats],
+        lambda m: m.get("ID"), lambda m: m.get("Наименование", "")
+    )
+    indexes["search_instruments"] = reuse_or_build(
+        "search_instruments", data.get("instruments"), indexes["instrument_list"], lambda i: i["id"], lambda i: i["name"]
+    )
+    plates = data.get("plates_by_category")
+    indexes["search_plates"] = reuse_or_build(
+        "search_plates", plates, [plate for cat in (plates or {}).values() for plate in cat],
+        lambda p: p.get("ID"), lambda p: p.get("Наименование", "")
+    )
+
+def normalize_status(status):
+    return str(status).lower().replace(" ", "")
+
+def compile_role(row):
+    """Разбирает строку листа 'Действия и разрешения' один раз на версию кэша"""
+    statuses = parse_role_statuses(row[1] if len(row) > 1 else "")
+    actions = row[2] if len(row) > 2 else ""
+    actions_str = actions.strip().replace("  ", " ")
+    return {
+        "statuses": statuses,
+        "status_set": frozenset(normalize_status(s) for s in statuses),
+        "actions": actions,
+        "permissions": {action: action in actions_str for action in POSSIBLE_ACTIONS},
+        "row": row
+    }
+
+def get_compiled_role(role):
+    return (caches.get("roles") or {}).get(str(role).lower()) if role else None
+
+def invalidate_project_views():
+    # Готовые списки проектов по ролям зависят от статусов — сбрасываем при любом изменении проектов
+    caches["role_views"] = {}
+
+def index_project(project, indexes=None):
+    indexes = indexes or caches
+    if project.get("ID проекта") not in (None, ""):
+        indexes["projects_by_id"].setdefault(str(project["ID проекта"]), project)
+    if project.get("Номер договора") not in (None, ""):
+        indexes["projects_by_number"].setdefault(normalize_tag(project["Номер договора"]), project)
+
+def instrument_entry(instr):
+    """Инструмент в виде для клавиатур; остаток разбирается один раз на версию кэша"""
+    try:
+        stock = float(instr.get("Кол-во на складе") or 0)
+    except (ValueError, TypeError):
+        stock = 0
+    return {"id": instr.get("ID инструмента"), "name": instr["Инструмент"], "unit": instr.get("Ед. измерения"), "stock": stock}
+
+def index_instrument(instr, indexes=None):
+    indexes = indexes or caches
+    indexes["instruments_by_id"].setdefault(str(instr.get("ID инструмента")), instr)
+    if str(instr.get("Инструмент") or "").strip():
+        indexes["instrument_list"].append(instrument_entry(instr))
+
+def add_to_search(name, key, text, item):
+    # Локально добавленные проекты и инструменты сразу находятся поиском
+    index = caches.get(name)
+    if index is not None:
+        index.add(key, text, item)
+
+def rebuild_indexes():
+    """Пересобирает индексы после подмены списков кэша (например, загрузки из файла)"""
+    caches.update(build_indexes(caches, caches))
+
+def get_project(project_id=None, number=None, role=None):
+    """Проект по ID или номеру договора; если указана роль — только видимый этой роли"""
+    if project_id is not None:
+        project = (caches.get("projects_by_id") or {}).get(str(project_id).strip())
+    else:
+        project = (caches.get("projects_by_number") or {}).get(normalize_tag(number))
+    if project is None or (role and not is_project_visible(project, role)):
+        return None
+    return project
+
+def is_project_visible(project, role):
+    perms = get_compiled_role(role)
+    return bool(perms) and normalize_status(project.get("Статус", "")) in perms["status_set"]
+
+def get_employee_by_login(login):
+    return (caches.get("employees_by_login") or {}).get(str(login).strip())
+
+def get_employee_fullname(login):
+    emp = get_employee_by_login(login)
+    return emp.get("Ф.И.О", str(login)) if emp else str(login)
+
+def get_material(mat_id):
+    return (caches.get("materials_by_id") or {}).get(str(mat_id))
+
+def get_material_by_name(name):
+    """Материал с точно таким названием (без учёта регистра, пунктуации и раскладки) или None"""
+    return (caches.get("materials_by_name") or {}).get(" ".join(normalize(name)))
+
+def get_plate(plate_id):
+    return (caches.get("plates_by_id") or {}).get(str(plate_id))
+
+def get_instrument(instr_id):
+    """Инструмент по ID в виде для клавиатур (id, name, unit, stock) или None"""
+    instr = (caches.get("instruments_by_id") or {}).get(str(instr_id).strip())
+    return instrument_entry(instr) if instr and str(instr.get("Инструмент") or "").strip() else None
+
+def search_instruments(query="", limit=INSTRUMENT_SEARCH_LIMIT):
+    """Инструменты по названию с учётом опечаток, лучшие совпадения первыми; пустой запрос — все"""
+    if not normalize(query):
+        return list(caches.get("instrument_list") or [])
+    index = caches.get("search_instruments")
+    return index.search(query, limit) if index else []
+
+def search_projects(query, role=None, limit=10):
+    """Проекты по номеру договора или заказчику с учётом опечаток; с ролью — только видимые ей"""
+    index = caches.get("search_projects")
+    if not index:
+        return []
+    return index.search(query, limit, accept=(lambda p: is_project_visible(p, role)) if role else None)
+
+def search_materials(query, limit=10):
+    """Материалы по названию с учётом опечаток и раскладки ("4.2х25" = "4.2x25")"""
+    index = caches.get("search_materials")
+    return index.search(query, limit) if index else []
+
+def match_catalog(query, kinds=("materials",)):
+    """Лучшее совпадение query среди каталогов kinds ("materials", "plates"):
+    (вид, объект, уверенно ли) или None. Уверенно — запрос целиком входит в название
+    или все его триграммы нашлись"""
+    best = None
+    for kind in kinds:
+        index = caches.get(f"search_{kind}")
+        for score, item in (index.scored(query, limit=1) if index else []):
+            if best is None or score > best[0]:
+                best = (score, kind, item)
+    if best is None:
+        return None
+    (exact, coverage, _), kind, item = best
+    return kind, item, exact or coverage == 1
+
+def instrument_query_key(query):
+    """Запрос поиска инструментов в нормализованном виде: "Дрель  Bosch" и "дрель bosch" — одна страница"""
+    return " ".join(normalize(query))
+
+def get_instrument_page(query="", page=0):
+    """Страница результатов поиска инструментов: (инструменты, номер страницы, число страниц).
+    Страницы нарезаются один раз на запрос и версию кэша; помним последние INSTRUMENT_PAGES_LIMIT запросов"""
+    pages_by_query = caches.get("instrument_pages")
+    if pages_by_query is None:
+        pages_by_query = caches["instrument_pages"] = OrderedDict()
+    key = instrument_query_key(query)
+    pages = pages_by_query.get(key)
+    if pages is None:
+        found = search_instruments(key)
+        pages = [found[i:i + INSTRUMENT_PAGE_SIZE] for i in range(0, len(found), INSTRUMENT_PAGE_SIZE)]
+        pages_by_query[key] = pages
+        if len(pages_by_query) > INSTRUMENT_PAGES_LIMIT:
+            pages_by_query.popitem(last=False)
+    else:
+        pages_by_query.move_to_end(key)
+    if not pages:
+        return [], 0, 0
+    page = min(max(page, 0), len(pages) - 1)
+    return pages[page], page, len(pages)
 
-        caches["last_updated"] = now
-        logger.info("Данные из Google Sheets загружены в кэш.")
+# --- СНИМОК КЭША НА ДИСКЕ ---
+def save_caches_snapshot(path=CACHE_SNAPSHOT_FILE):
+    """Сохраняет исходные данные кэша (без индексов) в снимок; вызывается после каждого обновления"""
+    try:
+        started = time.perf_counter()
+        size = save_snapshot({key: value for key, value in caches.items() if key not in INDEX_KEYS}, path)
+        logger.info(f"Снимок кэша сохранён в {path}: {size / 1024:.1f} КБ за {(time.perf_counter() - started) * 1000:.0f} мс")
+        return True
     except Exception as e:
-        logger.error(f"Ошибка при загрузке кэшей: {str(e)}", exc_info=True)
-        raise
+        logger.error(f"Ошибка при сохранении снимка кэша: {e}")
+        return False
+
+def restore_caches(data):
+    """Подменяет кэш загруженными данными (снимок) и строит индексы"""
+    data = {key: value for key, value in data.items() if key not in INDEX_KEYS}
+    if isinstance(data.get("last_updated"), str):
+        data["last_updated"] = datetime.datetime.fromisoformat(data["last_updated"])
+    data.update(build_indexes(data))
+    caches.update(data)
+
+def restore_caches_snapshot(path=CACHE_SNAPSHOT_FILE):
+    # SnapshotError пробрасывается вызывающему: он решает, откуда грузить кэш дальше
+    started = time.perf_counter()
+    restore_caches(load_snapshot(path))
+    logger.info(f"Кэш восстановлен из снимка {path} за {(time.perf_counter() - started) * 1000:.0f} мс")
 
 # --- КАТЕГОРИИ МАТЕРИАЛОВ ---
-def parse_materials_and_categories():
+def parse_materials_and_categories(all_values=None):
     """Парсит материалы и их категории из вертикальной таблицы (лист 'Материалы')"""
-    spreadsheet = client.open_by_key(SPREADSHEET_ID)
-    sheet = spreadsheet.worksheet("Материалы")
-    all_values = sheet.get_all_values()
+    if all_values is None:
+        all_values = fetch_sheets_values(["Материалы"])["Материалы"]
 
     # Находим строку с заголовками
     header_row = None
@@ -235,6 +889,7 @@ def get_material_categories():
         cats, mats = parse_materials_and_categories()
         caches["material_categories"] = cats
         caches["materials_by_category"] = mats
+        rebuild_indexes()
     return caches["material_categories"]
 
 def get_materials_by_category(cat):
@@ -243,10 +898,9 @@ def get_materials_by_category(cat):
     return caches["materials_by_category"].get(cat, [])
 
 # --- КАТЕГОРИИ ПЛАСТИН ---
-def parse_plate_categories_and_plates():
-    spreadsheet = client.open_by_key(SPREADSHEET_ID)
-    sheet = spreadsheet.worksheet("Пластины МЗП")
-    all_values = sheet.get_all_values()
+def parse_plate_categories_and_plates(all_values=None):
+    if all_values is None:
+        all_values = fetch_sheets_values(["Пластины МЗП"])["Пластины МЗП"]
 
     # Найдём строку заголовков (ищем слово "категория" по колонкам)
     header_row = 0
@@ -280,122 +934,112 @@ def parse_plate_categories_and_plates():
 
 
 def get_plate_categories():
+    """Категории пластин из общего кэша (без обращения к Google Sheets)"""
     if not caches.get("plate_categories") or not caches.get("plates_by_category"):
-        cats, plates = parse_plate_categories_and_plates()
-        caches["plate_categories"] = cats
-        caches["plates_by_category"] = plates
+        logger.warning("Каталог пластин отсутствует в кэше. Требуется обновление кэша.")
+        return []
     return caches["plate_categories"]
 
 def get_plates_by_category(cat):
-    if not caches.get("plate_categories") or not caches.get("plates_by_category"):
-        get_plate_categories()
-    return caches["plates_by_category"].get(cat, [])
+    return (caches.get("plates_by_category") or {}).get(cat, [])
 
-# ОСТАЛЬНЫЕ ФУНКЦИИ НЕ МЕНЯЛ!
-def record_write_off(data_list):
+def get_cache_version():
+    return caches.get("version") or 0
+
+# --- ЗАПИСЬ В ЛИСТЫ "Данные" И "Где инструмент" (через журнал и очереди) ---
+def fit_row(data, width):
+    row = list(data[:width])
+    row.extend([""] * (width - len(row)))
+    return row
+
+def submit_ledger_rows(data_list, width, description, ledger=None, cart_id=None):
+    """Ставит строки в очередь записи (по умолчанию лист 'Данные').
+    Future завершается True, как только отправка сохранена в журнале.
+    Корзина с cart_id пишется не более одного раза, повтор получает тот же Future"""
+    if cart_id:
+        return submitted_carts.submit_once(cart_id, lambda: enqueue_ledger_rows(data_list, width, description, ledger, cart_id))
+    return enqueue_ledger_rows(data_list, width, description, ledger)
+
+def enqueue_ledger_rows(data_list, width, description, ledger=None, key=None):
+    rows = [fit_row(data, width) for data in data_list]
+    future = (ledger or data_ledger).submit(rows, key)
+
+    def log_result(done):
+        if done.result():
+            logger.info(f"Принято {description}: {len(rows)} строк")
+        else:
+            logger.error(f"Ошибка записи {description}: {len(rows)} строк не записаны")
+
+    future.add_done_callback(log_result)
+    return future
+
+def wait_ledger(future):
     try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Данные")
-        last_row = find_last_row(worksheet)
-        start_row = last_row + 1
-        for i, data in enumerate(data_list):
-            row_num = start_row + i
-            row = [row_num] + data[:11]
-            if len(row) < 12:
-                row.extend([""] * (12 - len(row)))
-            worksheet.update(f"A{row_num}:L{row_num}", [row])
-        logger.info(f"Записано списание: {len(data_list)} строк в диапазоне A:L")
-        return True
+        return future.result()
     except Exception as e:
-        logger.error(f"Ошибка записи списания: {e}")
+        logger.error(f"Ошибка ожидания записи в журнал: {e}")
         return False
 
+def submit_write_off(data_list, cart_id=None):
+    return submit_ledger_rows(data_list, 11, "списание", cart_id=cart_id)
+
+def submit_expense(data_list, cart_id=None):
+    return submit_ledger_rows(data_list, 11, "расход", cart_id=cart_id)
+
+def submit_delivery(data_list, cart_id=None):
+    return submit_ledger_rows(data_list, 12, "доставка", cart_id=cart_id)
+
+def submit_ferma_write_off(data_list, cart_id=None):
+    return submit_ledger_rows(data_list, 11, "списание на фермы", cart_id=cart_id)
+
+def submit_instrument_transaction(data_list, cart_id=None):
+    return submit_ledger_rows(data_list, 7, "транзакция инструмента", instrument_ledger, cart_id=cart_id)
+
+def record_write_off(data_list):
+    return wait_ledger(submit_write_off(data_list))
+
 def record_expense(data_list):
-    try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Данные")
-        last_row = find_last_row(worksheet)
-        start_row = last_row + 1
-        for i, data in enumerate(data_list):
-            row_num = start_row + i
-            row = [row_num] + data[:11]
-            if len(row) < 12:
-                row.extend([""] * (12 - len(row)))
-            worksheet.update(f"A{row_num}:L{row_num}", [row])
-        logger.info(f"Записан расход: {len(data_list)} строк в диапазоне A:L")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка записи расхода: {e}")
-        return False
+    return wait_ledger(submit_expense(data_list))
 
 def record_instrument_transaction(data_list):
-    try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Где инструмент")
-        last_row = find_last_row(worksheet)
-        start_row = last_row + 1
-        for i, data in enumerate(data_list):
-            row_num = start_row + i
-            row = [row_num] + data
-            if len(row) < 8:
-                row.extend([""] * (8 - len(row)))
-            elif len(row) > 8:
-                row = row[:8]
-            worksheet.update(f"A{row_num}:H{row_num}", [row])
-        logger.info(f"Записана транзакция инструмента: {len(data_list)} строк в диапазоне A:H")
-        caches["where_instruments"].extend([dict(zip(WHERE_INSTRUMENT_HEADERS, row)) for row in data_list])
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка записи инструмента: {e}")
-        return False
+    return wait_ledger(submit_instrument_transaction(data_list))
+
+def write_instrument(name, unit, quantity=0):
+    """Дописывает инструмент на лист 'Инструмент', кэш только читает. Возвращает запись инструмента"""
+    worksheet = get_worksheet("Инструмент")
+    last_row = find_last_row(worksheet)
+    last_id = max([int(row["ID инструмента"] or 0) for row in caches["instruments"]], default=0)
+    new_id = last_id + 1
+    new_row = [new_id, name, unit, quantity]
+    worksheet.update(f"A{last_row + 1}:D{last_row + 1}", [new_row])
+    return {"ID инструмента": new_id, "Инструмент": name, "Ед. измерения": unit, "Кол-во на складе": quantity}
+
+def cache_instrument(instrument):
+    # Инструмент мог уже прийти с листа при обновлении кэша
+    if caches["instruments"] is None or str(instrument["ID инструмента"]) in (caches.get("instruments_by_id") or {}):
+        return
+    caches["instruments"].append(instrument)
+    index_instrument(instrument)
+    add_to_search("search_instruments", instrument["ID инструмента"], instrument["Инструмент"], caches["instrument_list"][-1])
+    caches["instrument_pages"] = OrderedDict()
+
+def apply_instrument(instrument):
+    apply_local_edit(lambda: cache_instrument(instrument))
+    logger.info(f"Добавлен инструмент: {instrument['Инструмент']}, {instrument['Кол-во на складе']} {instrument['Ед. измерения']}")
+    return True
 
 def add_new_instrument(name, unit, quantity=0):
     try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Инструмент")
-        last_row = find_last_row(worksheet)
-        last_id = max([int(row["ID инструмента"] or 0) for row in caches["instruments"]], default=0)
-        new_id = last_id + 1
-        new_row = [new_id, name, unit, quantity]
-        worksheet.update(f"A{last_row + 1}:D{last_row + 1}", [new_row])
-        caches["instruments"].append({"ID инструмента": new_id, "Инструмент": name, "Ед. измерения": unit, "Кол-во на складе": quantity})
-        logger.info(f"Добавлен инструмент: {name}, {quantity} {unit}")
-        return True
+        return apply_instrument(write_instrument(name, unit, quantity))
     except Exception as e:
         logger.error(f"Ошибка добавления инструмента: {e}")
         return False
 
 def record_delivery(data_list):
-    try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Данные")
-        last_row = find_last_row(worksheet)
-        start_row = last_row + 1
-        for i, data in enumerate(data_list):
-            row_num = start_row + i
-            row = [row_num] + data
-            if len(row) < 13:
-                row.extend([""] * (13 - len(row)))
-            elif len(row) > 13:
-                row = row[:13]
-            worksheet.update(f"A{row_num}:M{row_num}", [row])
-        logger.info(f"Записана доставка: {len(data_list)} строк в диапазоне A:M")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка записи доставки: {e}")
-        return False
+    return wait_ledger(submit_delivery(data_list))
 
 def record_ferma_write_off(data_list):
-    try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Данные")
-        last_row = find_last_row(worksheet)
-        start_row = last_row + 1
-        for i, data in enumerate(data_list):
-            row_num = start_row + i
-            row = [row_num] + data[:11]
-            if len(row) < 12:
-                row.extend([""] * (12 - len(row)))
-            worksheet.update(f"A{row_num}:L{row_num}", [row])
-        logger.info(f"Записано списание на фермы: {len(data_list)} строк в диапазоне A:L")
-        return True
-    except Exception as e:
-        logger.error(f"Ошибка записи списания на фермы: {e}")
-        return False
+    return wait_ledger(submit_ferma_write_off(data_list))
 
 def get_plates_by_type(plate_type):
     try:
@@ -426,94 +1070,156 @@ def get_plate_stock(plate_name):
 
 def get_project_direction(tag):
     try:
-        for record in caches["projects"] or []:
-            if str(record["Номер договора"]).strip().lower() == str(tag).strip().lower():
-                return record.get("Тип сделки", "")
-        return None
+        project = get_project(number=tag)
+        return project.get("Тип сделки", "") if project else None
     except Exception as e:
         logger.error(f"Ошибка получения направления проекта: {e}")
         return None
 
+def locate_project_rows(worksheet, tags):
+    """Строки проектов по карте из кэша. Перед записью сверяем только ячейки номеров договоров
+    в этих строках (один batch_get). Если строки сдвинули вручную или проекта нет в карте,
+    карта перестраивается по колонке номеров договоров — запись не попадёт в чужой проект.
+    Возвращает (номер договора -> строка, перестроенная карта или None); кэш не меняет"""
+    project_rows = caches.get("project_rows") or {}
+    keys = {tag: normalize_tag(tag) for tag in tags}
+    rows = {tag: project_rows[key] for tag, key in keys.items() if key in project_rows}
+    if rows and len(rows) == len(keys):
+        cells = worksheet.batch_get([rowcol_to_a1(row, PROJECT_TAG_COL) for row in rows.values()])
+        found = [normalize_tag(values[0][0]) if values and values[0] else "" for values in cells]
+        if found == [keys[tag] for tag in rows]:
+            return rows, None
+    logger.warning("Карта строк листа 'Проекты' устарела, перестраиваем по колонке номеров договоров.")
+    rebuilt = project_rows_from_column(worksheet.col_values(PROJECT_TAG_COL))
+    return {tag: rebuilt[key] for tag, key in keys.items() if key in rebuilt}, rebuilt
+
+def write_project_fields(changes):
+    """Меняет поля проектов на листе одним batch_update, кэш не меняет. changes: {номер договора: {заголовок: значение}}.
+    Возвращает (записанные номера договоров, перестроенная карта строк или None)"""
+    if not changes:
+        return set(), None
+    worksheet = get_worksheet("Проекты")
+    rows, project_rows = locate_project_rows(worksheet, list(changes))
+    missing = [str(tag) for tag in changes if tag not in rows]
+    if missing:
+        logger.warning(f"Проекты не найдены на листе 'Проекты': {', '.join(missing)}")
+    data = [
+        {"range": rowcol_to_a1(rows[tag], HEADERS.index(header) + 1), "values": [[value]]}
+        for tag, fields in changes.items() if tag in rows
+        for header, value in fields.items()
+    ]
+    if not data:
+        return set(), project_rows
+    worksheet.batch_update(data, value_input_option="USER_ENTERED")
+    return set(rows), project_rows
+
+def cache_project_fields(changes, written, project_rows=None):
+    if project_rows is not None:
+        caches["project_rows"] = project_rows
+    # Индексы хранят те же словари, что и список проектов, — достаточно обновить записи
+    for tag in written:
+        project = get_project(number=tag)
+        if project:
+            project.update(changes[tag])
+    invalidate_project_views()
+
+def apply_project_fields(changes, written, project_rows):
+    # Карту строк после сборки не повторяем: новая карта с листа свежее
+    apply_local_edit(
+        lambda: cache_project_fields(changes, written, project_rows),
+        lambda: cache_project_fields(changes, written)
+    )
+    return written
+
+def update_project_fields(changes):
+    """Меняет поля проектов на листе и в кэше. Возвращает множество номеров договоров, которые записаны"""
+    return apply_project_fields(changes, *write_project_fields(changes))
+
 def update_project_report_link(tag, url):
     try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Проекты")
-        cell = worksheet.find(str(tag))
-        if cell:
-            worksheet.update_cell(cell.row, HEADERS.index("Ссылка на отчёт") + 1, url)
-            for proj in caches["projects"]:
-                if proj["Номер договора"] == tag:
-                    proj["Ссылка на отчёт"] = url
-            return True
-        return False
+        return tag in update_project_fields({tag: {"Ссылка на отчёт": url}})
     except Exception as e:
         logger.error(f"Ошибка обновления ссылки отчета: {e}")
         return False
 
 def get_projects_list(role=None):
+    """Проекты, видимые роли. Список собирается один раз на роль и версию кэша — не изменяйте его"""
     try:
+        views = caches.get("role_views")
+        if views is None:
+            views = caches["role_views"] = {}
+        key = role.lower() if role else None
+        if key in views:
+            return views[key]
+
         projects = caches["projects"] or []
-        logger.info(f"Всего проектов в кэше: {len(projects)}")
         if not role:
-            logger.info("Роль не указана, возвращаем все проекты")
-            return [dict(p, id=p.get("ID проекта"), number=p.get("Номер договора")) for p in projects]
-
-        role_lower = role.lower()
-        perms = next((row for row in caches["permissions"] if row and row[0].lower() == role_lower), None)
-        if not perms or len(perms) < 2:
-            logger.warning(f"Разрешения для роли {role} не найдены.")
-            return []
-
-        visible_statuses_raw = perms[1] if perms[1] else ""
-        visible_statuses = visible_statuses_raw.split()
-        statuses = []
-        i = 0
-        while i < len(visible_statuses):
-            if i + 1 < len(visible_statuses) and visible_statuses[i] in ["В", "Продукция"]:
-                statuses.append(f"{visible_statuses[i]} {visible_statuses[i+1]}")
-                i += 2
-            else:
-                statuses.append(visible_statuses[i])
-                i += 1
-        logger.info(f"Видимые статусы для роли '{role}': {statuses}")
-
-        filtered_projects = []
-        for p in projects:
-            project_status = p.get("Статус", "").lower().replace(" ", "")
-            for status in statuses:
-                if project_status == status.lower().replace(" ", ""):
-                    filtered_projects.append(dict(p, id=p.get("ID проекта"), number=p.get("Номер договора")))
-                    break
-        logger.info(f"Для роли '{role}' найдено {len(filtered_projects)} проектов.")
-        return filtered_projects
+            view = [dict(p, id=p.get("ID проекта"), number=p.get("Номер договора")) for p in projects]
+        else:
+            perms = get_compiled_role(role)
+            if not perms or len(perms["row"]) < 2:
+                logger.warning(f"Разрешения для роли {role} не найдены.")
+                return []
+            view = [
+                dict(p, id=p.get("ID проекта"), number=p.get("Номер договора"))
+                for p in projects if normalize_status(p.get("Статус", "")) in perms["status_set"]
+            ]
+        views[key] = view
+        logger.info(f"Для роли '{role}' подготовлено {len(view)} проектов из {len(projects)} (версия кэша {caches.get('version')}).")
+        return view
     except Exception as e:
         logger.error(f"Ошибка получения списка проектов: {e}")
         return []
 
 def update_project_status(tag, new_status):
     try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Проекты")
-        cell = worksheet.find(str(tag))
-        if cell:
-            worksheet.update_cell(cell.row, HEADERS.index("Статус") + 1, new_status)
-            for proj in caches["projects"]:
-                if proj["Номер договора"] == tag:
-                    proj["Статус"] = new_status
-            return True
-        return False
+        return tag in update_project_fields({tag: {"Статус": new_status}})
     except Exception as e:
         logger.error(f"Ошибка обновления статуса: {e}")
         return False
 
+def update_project_statuses(statuses):
+    """Меняет статусы многих проектов одним запросом. statuses: {номер договора: статус}.
+    Возвращает множество номеров договоров, которые записаны"""
+    try:
+        updated = update_project_fields({tag: {"Статус": status} for tag, status in statuses.items()})
+        logger.info(f"Статусы обновлены: {len(updated)} из {len(statuses)} проектов")
+        return updated
+    except Exception as e:
+        logger.error(f"Ошибка пакетного обновления статусов: {e}")
+        return set()
+
+def write_project_record(customer_name, tag, direction):
+    """Дописывает проект на лист 'Проекты', кэш только читает. Возвращает (проект, номер строки или None)"""
+    worksheet = get_worksheet("Проекты")
+    new_id = max([float(row["ID проекта"]) for row in caches["projects"] if row["ID проекта"]], default=0) + 1
+    status = "В работе"
+    date_created = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    new_row = [new_id, customer_name, tag, direction, status, date_created, "", ""]
+    response = worksheet.append_row(new_row)
+    match = UPDATED_RANGE_ROW.search(response.get("updates", {}).get("updatedRange", ""))
+    return dict(zip(HEADERS, new_row)), int(match.group(1)) if match else None
+
+def cache_project_record(project, row):
+    tag = project["Номер договора"]
+    if row is not None and caches.get("project_rows") is not None:
+        caches["project_rows"].setdefault(normalize_tag(tag), row)
+    # Проект мог уже прийти с листа при обновлении кэша
+    known = get_project(number=tag)
+    if caches["projects"] is None or (known and known.get("Ф.И.О заказчика") == project["Ф.И.О заказчика"]):
+        return
+    caches["projects"].append(project)
+    index_project(project)
+    add_to_search("search_projects", project["ID проекта"], project_search_text(project), project)
+    invalidate_project_views()
+
+def apply_project_record(project, row):
+    apply_local_edit(lambda: cache_project_record(project, row))
+    return True
+
 def create_project_record(customer_name, tag, direction):
     try:
-        worksheet = client.open_by_key(SPREADSHEET_ID).worksheet("Проекты")
-        new_id = max([float(row["ID проекта"]) for row in caches["projects"] if row["ID проекта"]], default=0) + 1
-        status = "В работе"
-        date_created = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        new_row = [new_id, customer_name, tag, direction, status, date_created, "", ""]
-        worksheet.append_row(new_row)
-        caches["projects"].append(dict(zip(HEADERS, new_row)))
-        return True
+        return apply_project_record(*write_project_record(customer_name, tag, direction))
     except Exception as e:
         logger.error(f"Ошибка создания проекта: {e}")
         return False
@@ -535,33 +1241,15 @@ def get_materials_by_direction(direction):
         return []
 
 def get_instruments():
-    try:
-        instruments = []
-        for row in caches["instruments"]:
-            if row.get("Инструмент") and row["Инструмент"].strip():
-                try:
-                    stock = float(row["Кол-во на складе"] or 0)
-                except (ValueError, TypeError):
-                    stock = 0
-                instruments.append({
-                    "id": row["ID инструмента"],
-                    "name": row["Инструмент"],
-                    "unit": row["Ед. измерения"],
-                    "stock": stock
-                })
-        logger.info(f"Инструменты загружены, записей: {len(instruments)}")
-        return instruments
-    except Exception as e:
-        logger.error(f"Ошибка получения инструментов: {e}")
-        return []
+    """Все инструменты с названием (id, name, unit, stock). Список готовится вместе с индексами"""
+    return list(caches.get("instrument_list") or [])
 
 def get_employee_data(login, password):
     try:
-        for emp in caches["employees"]:
-            if str(emp["Логин"]).strip() == str(login).strip() and str(emp["Пароль"]).strip() == str(password).strip():
-                if str(emp["Доступ"]).lower() in ["true", "1", "yes"]:
-                    return emp["Роль"], emp["Отдел"]
-                return None, None
+        emp = get_employee_by_login(login)
+        if emp and str(emp["Пароль"]).strip() == str(password).strip():
+            if str(emp["Доступ"]).lower() in ["true", "1", "yes"]:
+                return emp["Роль"], emp["Отдел"]
         return None, None
     except Exception as e:
         logger.error(f"Ошибка проверки учетных данных: {e}")
@@ -569,36 +1257,21 @@ def get_employee_data(login, password):
 
 def get_role_permissions(role):
     try:
-        perms_row = next((row for row in caches["permissions"] if row and row[0].lower() == role.lower()), None)
-        if not perms_row or len(perms_row) < 3:
+        perms = get_compiled_role(role)
+        if not perms or len(perms["row"]) < 3:
             logger.warning(f"Роль '{role}' не найдена в таблице.")
             return {}
-
-        actions_str = perms_row[2].strip().replace("  ", " ")
-        possible_actions = [
-            "Смена статуса проекта", "Создать проект", "Списать материалы",
-            "Списание материалов (веб-форма)", "Списать материалы на фермы",
-            "Добавить расход", "Доставка", "Инструмент", "Новый инструмент",
-            "Закупка материалов", "Внести объемы материалов", "Обновление КЭШ-а"
-        ]
-
-        permissions_dict = {action: action in actions_str for action in possible_actions}
-        logger.info(f"Права для роли '{role}': {permissions_dict}")
-        return permissions_dict
+        return perms["permissions"]
     except Exception as e:
         logger.error(f"Ошибка получения прав роли '{role}': {e}")
         return {}
 
 def can_write_off_at_status(role, status, action="Списать материалы"):
     try:
-        perms_row = next((row for row in caches["permissions"] if row and row[0].lower() == role.lower()), None)
-        if not perms_row or len(perms_row) < 3:
+        perms = get_compiled_role(role)
+        if not perms or len(perms["row"]) < 3:
             return False
-        statuses = perms_row[1].split() if perms_row[1] else []
-        status_lower = status.lower().replace(" ", "")
-        allowed_status = any(status_lower == s.lower().replace(" ", "") for s in statuses)
-        allowed_action = action in perms_row[2]
-        return allowed_status and allowed_action
+        return normalize_status(status) in perms["status_set"] and action in perms["actions"]
     except Exception as e:
         logger.error(f"Ошибка проверки статуса для списания: {e}")
         return False
@@ -610,17 +1283,174 @@ def get_web_form_url(action):
         logger.error(f"Ошибка получения URL для {action}: {e}")
         return ""
 
-def schedule_cache_update():
-    while True:
-        now = datetime.datetime.now()
-        next_update = now.replace(hour=8, minute=0, second=0, microsecond=0)
-        if now > next_update:
-            next_update += datetime.timedelta(days=1)
-        time.sleep((next_update - now).total_seconds())
-        load_caches(force=True)
-        time.sleep(43200)
-
-threading.Thread(target=schedule_cache_update, daemon=True).start()
+# --- АСИНХРОННЫЙ ФАСАД: блокирующий gspread уходит в ограниченный пул потоков ---
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets")
+    return _executor
+
+_journal_executor = None
+
+def get_journal_executor():
+    """Один поток для постановки в очередь записи: журнал пишется с fsync не в цикле событий
+    и не ждёт за долгими вызовами Sheets в общем пуле. Отправки идут по одной — повтор корзины
+    застаёт первую уже учтённой и получает её Future"""
+    global _journal_executor
+    with _executor_lock:
+        if _journal_executor is None:
+            _journal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+    return _journal_executor
+
+async def run_blocking(func, *args, timeout=SHEETS_CALL_TIMEOUT, **kwargs):
+    """Выполняет блокирующий вызов в пуле потоков, не останавливая цикл событий бота.
+    По истечении timeout прекращается только ожидание: поток доводит вызов до конца"""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    return await asyncio.wait_for(loop.run_in_executor(get_executor(), call), timeout)
+
+async def run_write(func, *args, timeout=SHEETS_CALL_TIMEOUT):
+    """Запись в таблицу в пуле потоков; правку кэша по её результату вызывающий делает
+    уже в цикле событий. None — запись не удалась (причина в логе)"""
+    try:
+        return await run_blocking(func, *args, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Превышено время ожидания Google Sheets ({timeout} с) в {func.__name__}")
+    except Exception as e:
+        logger.error(f"Ошибка записи в таблицу в {func.__name__}: {e}")
+    return None
+
+async def await_ledger(future, timeout=SHEETS_CALL_TIMEOUT):
+    """Ждёт Future отправки. shield: по таймауту прекращается только ожидание — отправка
+    не отменяется и остаётся в очереди, повтор той же корзины получит тот же Future"""
+    try:
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Превышено время ожидания записи в журнал ({timeout} с), отправка остаётся в очереди")
+        return False
+
+def is_refreshing():
+    return _refresh_task is not None and not _refresh_task.done()
+
+def start_refresh(force=False, full=False):
+    """Запускает обновление кэша в цикле событий или возвращает уже идущее.
+    Возвращает (задача, ход обновления); задача завершается True, если данные изменились"""
+    global _refresh_task, _refresh_progress
+    if not is_refreshing():
+        _refresh_progress = RefreshProgress()
+        _refresh_task = asyncio.ensure_future(refresh_caches(force, full, _refresh_progress))
+    return _refresh_task, _refresh_progress
+
+async def aload_caches(force=False, full=False):
+    """Обновление кэша из цикла событий. Если обновление уже идёт (по расписанию, по кнопке,
+    после тёплого старта), ждём его результат. True — данные изменились"""
+    task, _ = start_refresh(force, full)
+    return await asyncio.shield(task)
+
+async def refresh_caches(force=False, full=False, progress=None):
+    global _builds_running
+    try:
+        if _builds_running:
+            # Сборка прошлого обновления превысила SHEETS_LOAD_TIMEOUT и ещё идёт: вторая ждала бы
+            # её блокировку в ещё одном потоке пула. Её результат применится сам (apply_late_build)
+            locked = " и держит блокировку сборки" if _load_lock.locked() else ""
+            logger.warning(f"Сборка кэша прошлого обновления ещё идёт в пуле{locked}, обновление пропущено.")
+            return False
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(get_executor(), build_caches, force, full, progress)
+        _builds_running += 1
+        try:
+            fresh, changed = await asyncio.wait_for(asyncio.shield(job), SHEETS_LOAD_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if isinstance(e, asyncio.TimeoutError):
+                logger.error(
+                    f"Сборка кэша не уложилась в {SHEETS_LOAD_TIMEOUT} с и продолжается в пуле, держа блокировку "
+                    f"сборки; новые обновления пропускаются, её результат будет применён по готовности."
+                )
+            job.add_done_callback(apply_late_build)
+            raise
+        except Exception:
+            _builds_running -= 1
+            take_local_edits()
+            raise
+        _builds_running -= 1
+        # Подмена — здесь, в потоке цикла событий, между шагами обработчиков
+        updated = apply_caches(fresh, changed)
+        if needs_snapshot(fresh):
+            if progress:
+                progress.step("Сохранение снимка")
+            await run_blocking(save_caches_snapshot)
+        return updated
+    finally:
+        if progress:
+            progress.finish()
+
+def apply_late_build(job):
+    """Применяет результат сборки, которую её обновление перестало ждать (таймаут, отмена)"""
+    global _builds_running
+    _builds_running -= 1
+    if job.cancelled() or job.exception() is not None:
+        take_local_edits()
+        return
+    fresh, changed = job.result()
+    apply_caches(fresh, changed)
+    if needs_snapshot(fresh):
+        get_executor().submit(save_caches_snapshot)
+    logger.info("Результат затянувшейся сборки кэша применён.")
+
+async def asubmit_ledger(submit, data_list, cart_id=None, timeout=SHEETS_CALL_TIMEOUT):
+    """Ставит отправку в очередь из потока журнала и ждёт её результат"""
+    deadline = time.monotonic() + timeout
+    loop = asyncio.get_running_loop()
+    job = loop.run_in_executor(get_journal_executor(), submit, data_list, cart_id)
+    try:
+        future = await asyncio.wait_for(asyncio.shield(job), timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Превышено время ожидания журнала записи ({timeout} с)")
+        return False
+    return await await_ledger(future, max(0, deadline - time.monotonic()))
+
+async def arecord_write_off(data_list, cart_id=None):
+    return await asubmit_ledger(submit_write_off, data_list, cart_id)
+
+async def arecord_expense(data_list, cart_id=None):
+    return await asubmit_ledger(submit_expense, data_list, cart_id)
+
+async def arecord_delivery(data_list, cart_id=None):
+    return await asubmit_ledger(submit_delivery, data_list, cart_id)
+
+async def arecord_ferma_write_off(data_list, cart_id=None):
+    return await asubmit_ledger(submit_ferma_write_off, data_list, cart_id)
+
+async def arecord_instrument_transaction(data_list, cart_id=None):
+    return await asubmit_ledger(submit_instrument_transaction, data_list, cart_id)
+
+async def aadd_new_instrument(name, unit, quantity=0):
+    instrument = await run_write(write_instrument, name, unit, quantity)
+    return instrument is not None and apply_instrument(instrument)
+
+async def aupdate_project_fields(changes):
+    written = await run_write(write_project_fields, changes)
+    return apply_project_fields(changes, *written) if written is not None else set()
+
+async def aupdate_project_status(tag, new_status):
+    return tag in await aupdate_project_fields({tag: {"Статус": new_status}})
+
+async def aupdate_project_statuses(statuses):
+    updated = await aupdate_project_fields({tag: {"Статус": status} for tag, status in statuses.items()})
+    logger.info(f"Статусы обновлены: {len(updated)} из {len(statuses)} проектов")
+    return updated
+
+async def aupdate_project_report_link(tag, url):
+    return tag in await aupdate_project_fields({tag: {"Ссылка на отчёт": url}})
+
+async def acreate_project_record(customer_name, tag, direction):
+    record = await run_write(write_project_record, customer_name, tag, direction)
+    return record is not None and apply_project_record(*record)
 
 if __name__ == "__main__":
     load_caches()
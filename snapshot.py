@@ -0,0 +1,140 @@
+# snapshot.py
+import datetime
+import logging
+import marshal
+import os
+import struct
+import sys
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Заголовок файла: сигнатура, версия схемы, версия формата marshal и Python (major, minor),
+# CRC32 и длина сжатых данных. Формат marshal меняется между версиями Python, поэтому снимок
+# другой версии не читается, а считается отсутствующим: кэш загрузится из таблицы
+SNAPSHOT_MAGIC = b"SVBC"
+SNAPSHOT_SCHEMA_VERSION = 2
+PREFIX = struct.Struct(">4sH")
+HEADER = struct.Struct(">4sHHBBIQ")
+RUNTIME = (marshal.version, sys.version_info.major, sys.version_info.minor)
+
+DATETIME_TAG = "__datetime__"
+
+
+class SnapshotError(Exception):
+    """Снимок отсутствует, повреждён или записан другой версией схемы"""
+
+
+def encode_value(value):
+    # marshal не знает datetime — сохраняем его помеченной строкой ISO
+    if isinstance(value, datetime.datetime):
+        return {DATETIME_TAG: value.isoformat()}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict) and len(value) == 1 and DATETIME_TAG in value:
+        return datetime.datetime.fromisoformat(value[DATETIME_TAG])
+    return value
+
+
+def dumps(data):
+    payload = zlib.compress(marshal.dumps({key: encode_value(value) for key, value in data.items()}), 6)
+    return HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_SCHEMA_VERSION, *RUNTIME, zlib.crc32(payload), len(payload)) + payload
+
+
+def loads(raw):
+    if len(raw) < PREFIX.size:
+        raise SnapshotError("файл снимка обрезан")
+    magic, version = PREFIX.unpack_from(raw)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("неизвестный формат файла снимка")
+    if version != SNAPSHOT_SCHEMA_VERSION:
+        raise SnapshotError(f"версия схемы снимка {version}, ожидается {SNAPSHOT_SCHEMA_VERSION}")
+    if len(raw) < HEADER.size:
+        raise SnapshotError("файл снимка обрезан")
+    _, _, marshal_version, major, minor, crc, length = HEADER.unpack_from(raw)
+    if (marshal_version, major, minor) != RUNTIME:
+        raise SnapshotError(
+            f"снимок записан Python {major}.{minor} (marshal {marshal_version}), "
+            f"а запущен {RUNTIME[1]}.{RUNTIME[2]} (marshal {RUNTIME[0]})"
+        )
+    payload = raw[HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise SnapshotError("контрольная сумма снимка не совпадает")
+    try:
+        data = marshal.loads(zlib.decompress(payload))
+    except (ValueError, EOFError, TypeError, zlib.error) as e:
+        raise SnapshotError(f"не удалось разобрать снимок: {e}")
+    return {key: decode_value(value) for key, value in data.items()}
+
+
+def save_snapshot(data, path):
+    """Атомарно записывает снимок: временный файл, fsync, rename. Возвращает размер в байтах"""
+    raw = dumps(data)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass  # fsync каталога доступен не на всех платформах
+    return len(raw)
+
+
+def load_snapshot(path):
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except OSError as e:
+        raise SnapshotError(f"не удалось прочитать снимок: {e}")
+    return loads(raw)
+
+
+if __name__ == "__main__":
+    # Сравнение со старым форматом: python snapshot.py [cach.json]
+    import json
+    import tempfile
+    import time
+
+    source = sys.argv[1] if len(sys.argv) > 1 else "cach.json"
+    with open(source, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data.get("last_updated"), str):
+        data["last_updated"] = datetime.datetime.fromisoformat(data["last_updated"])
+
+    def measure(func, repeat=20):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        return result, (time.perf_counter() - start) / repeat * 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "cache.json")
+        snap_path = os.path.join(tmp, "cache.snapshot")
+
+        def write_json():
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4, default=str)
+            return os.path.getsize(json_path)
+
+        def read_json():
+            with open(json_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        json_size, json_write = measure(write_json)
+        _, json_read = measure(read_json)
+        snap_size, snap_write = measure(lambda: save_snapshot(data, snap_path))
+        restored, snap_read = measure(lambda: load_snapshot(snap_path))
+
+    print(f"{'формат':<10}{'размер, КБ':>12}{'запись, мс':>12}{'чтение, мс':>12}")
+    print(f"{'json':<10}{json_size / 1024:>12.1f}{json_write:>12.2f}{json_read:>12.2f}")
+    print(f"{'snapshot':<10}{snap_size / 1024:>12.1f}{snap_write:>12.2f}{snap_read:>12.2f}")
+    print(f"Типы сохранены: {restored == data} (last_updated: {type(restored.get('last_updated')).__name__})")
@@ -0,0 +1,48 @@
+# conftest.py
+# Тесты работают без Google: хранилище — backend.FakeClient в памяти, журнал — во временном каталоге
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SHEETS_BACKEND", "fake")
+
+import backend  # noqa: E402
+
+
+@pytest.fixture
+def fake_client():
+    """Подменяет клиент хранилища на FakeClient без ограничителя; листы задаёт тест"""
+    def make(sheets=None, **kwargs):
+        client = backend.FakeClient(sheets, **kwargs)
+        backend.set_client(client, throttled=False)
+        return client
+
+    yield make
+    backend.set_client(None, throttled=False)
+
+
+@pytest.fixture
+def worksheet():
+    """Лист FakeClient напрямую, минуя пул и учёт вызовов (подготовка данных и проверки)"""
+    def get(client, title):
+        return client._spreadsheets[backend.SPREADSHEET_ID]._worksheets[title]
+    return get
+
+
+@pytest.fixture
+def cache_client(fake_client, monkeypatch):
+    """FakeClient с листами из cach.json (те же данные, что у замеров в bench/) и кэш sheets,
+    который тест заполняет с нуля. Снимок на диск не пишется"""
+    import sheets
+    saved = dict(sheets.caches)
+    monkeypatch.setattr(sheets, "save_caches_snapshot", lambda path=None: True)
+    monkeypatch.setattr(sheets, "_source_skips", 0)
+    with open(os.path.join(ROOT, "cach.json"), encoding="utf-8") as f:
+        client = fake_client(backend.cache_to_sheets(json.load(f)))
+    yield client
+    sheets.caches.clear()
+    sheets.caches.update(saved)
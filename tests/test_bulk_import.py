@@ -0,0 +1,110 @@
+# test_bulk_import.py
+import pytest
+
+import bulk_import
+from bulk_import import ImportFileError, csv_dialect, find_columns, parse_quantity, read_write_offs
+
+ROWS = "Наименование;Кол-во\nБрус 150x150;6\nКлей;2,5\n"
+
+
+@pytest.fixture
+def write_file(tmp_path):
+    def write(data, name="import.csv"):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    """Каталог из двух материалов; «брус» находится только приблизительно"""
+    materials = {"Брус 150x150": {"ID": 1, "Наименование": "Брус 150x150"},
+                 "Клей": {"ID": 2, "Наименование": "Клей"}}
+    calls = []
+
+    def resolve(material_id, name):
+        calls.append(name)
+        if name in materials:
+            return materials[name], True
+        if name.lower() == "брус":
+            return materials["Брус 150x150"], False
+        return None, False
+
+    monkeypatch.setattr(bulk_import, "resolve_material", resolve)
+    return calls
+
+
+@pytest.mark.parametrize("data, expected", [
+    (ROWS.encode("utf-8-sig"), ("utf-8-sig", ";")),
+    (ROWS.encode("utf-8"), ("utf-8-sig", ";")),
+    (ROWS.replace(";", ",").replace("2,5", '"2,5"').encode("cp1251"), ("cp1251", ",")),
+    (ROWS.replace(";", "\t").encode("cp1251"), ("cp1251", "\t")),
+    (b"", ("utf-8-sig", ";")),
+])
+def test_csv_dialect(write_file, data, expected):
+    assert csv_dialect(write_file(data)) == expected
+
+
+def test_utf8_character_cut_by_sample_is_not_cp1251(write_file, monkeypatch):
+    data = ROWS.encode("utf-8")
+    # Граница образца приходится на середину двухбайтовой «Б» во второй строке
+    cut = data.index("Брус".encode("utf-8")) + 1
+    monkeypatch.setattr(bulk_import, "CSV_SAMPLE_SIZE", cut)
+    assert csv_dialect(write_file(data)) == ("utf-8-sig", ";")
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("6", 6.0), ("2,5", 2.5), ("1 234,5", 1234.5), ("1\xa0000", 1000.0),
+    (3, 3.0), (0.5, 0.5), ("", None), ("шт", None), (True, None),
+])
+def test_parse_quantity(value, expected):
+    assert parse_quantity(value) == expected
+
+
+@pytest.mark.parametrize("row, expected", [
+    (["Наименование", "Кол-во"], {"name": 0, "quantity": 1}),
+    (["Код", "", "Материал", "Количество"], {"id": 0, "name": 2, "quantity": 3}),
+    (["ID", "qty"], {"id": 0, "quantity": 1}),
+    (["Наименование", "Ед."], None),
+    (["Брус", "6"], None),
+])
+def test_find_columns(row, expected):
+    assert find_columns(row) == expected
+
+
+def test_read_write_offs_sums_by_material(write_file, catalog):
+    data = "Материал;Ед.;Количество\nБрус 150x150;м;6\nбрус;м;1,5\n;;\nКлей;кг;2\nБрус 150x150;м;2\nЛак;л;1\nКлей;кг;\n"
+    result = read_write_offs(write_file(data.encode("cp1251")), "csv")
+    assert result["quantities"] == {"1": 9.5, "2": 2.0}
+    assert result["fuzzy"] == {"брус": "Брус 150x150"} and result["fuzzy_rows"] == 1
+    assert result["unknown"] == {"Лак": 1} and result["unknown_rows"] == 1
+    assert result["invalid_lines"] == [8] and result["invalid_rows"] == 1
+    assert result["rows"] == 6
+    # Повторное название сопоставляется один раз
+    assert catalog.count("Брус 150x150") == 1
+
+
+def test_file_without_header_is_name_then_quantity(write_file, catalog):
+    result = read_write_offs(write_file("Клей,2\nКлей,3\n".encode("utf-8")), "csv")
+    assert result["quantities"] == {"2": 5.0}
+    assert result["rows"] == 2
+
+
+def test_summaries_are_capped(write_file, catalog, monkeypatch):
+    monkeypatch.setattr(bulk_import, "UNKNOWN_LIMIT", 2)
+    monkeypatch.setattr(bulk_import, "INVALID_LINES_LIMIT", 1)
+    monkeypatch.setattr(bulk_import, "RESOLVED_LIMIT", 1)
+    data = "".join(f"Лак {i};1\n" for i in range(4)) + "Клей;\nКлей;0\nЛак 0;1\n"
+    result = read_write_offs(write_file(data.encode("utf-8")), "csv")
+    assert result["unknown"] == {"Лак 0": 2, "Лак 1": 1}
+    assert result["unknown_rows"] == 5
+    assert result["invalid_lines"] == [5] and result["invalid_rows"] == 2
+    # Сопоставления сверх RESOLVED_LIMIT не запоминаются — строка сопоставляется заново
+    assert catalog == ["Лак 0", "Лак 1", "Лак 2", "Лак 3"]
+
+
+def test_row_limit(write_file, catalog, monkeypatch):
+    monkeypatch.setattr(bulk_import, "IMPORT_MAX_ROWS", 2)
+    with pytest.raises(ImportFileError):
+        read_write_offs(write_file("Клей;1\nКлей;1\nКлей;1\n".encode("utf-8")), "csv")
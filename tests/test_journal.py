@@ -0,0 +1,76 @@
+# test_journal.py
+import json
+
+from journal import Journal
+
+
+def read_ops(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["op"] for line in f if line.strip()]
+
+
+def test_pending_survives_restart(tmp_path):
+    path = str(tmp_path / "ledger.journal")
+    journal = Journal(path)
+    first = journal.put("Данные", [["a"]], key="k1")
+    journal.put("Данные", [["b"]], key="k2")
+    journal.done([first["key"]])
+
+    # Процесс упал: новый журнал на том же файле отдаёт только незавершённое
+    replayed = Journal(path).pending()
+    assert [entry["key"] for entry in replayed] == ["k2"]
+    assert replayed[0]["rows"] == [["b"]]
+
+
+def test_put_with_known_key_is_deduplicated_after_restart(tmp_path):
+    path = str(tmp_path / "ledger.journal")
+    assert Journal(path).put("Данные", [["a"]], key="cart-1") is not None
+
+    journal = Journal(path)
+    assert journal.put("Данные", [["a"]], key="cart-1") is None
+    assert len(journal.pending()) == 1
+
+
+def test_pending_filters_by_sheet(tmp_path):
+    journal = Journal(str(tmp_path / "ledger.journal"))
+    journal.put("Данные", [["a"]], key="k1")
+    journal.put("Где инструмент", [["b"]], key="k2")
+    assert [entry["key"] for entry in journal.pending("Где инструмент")] == ["k2"]
+
+
+def test_broken_tail_line_is_skipped(tmp_path):
+    path = str(tmp_path / "ledger.journal")
+    Journal(path).put("Данные", [["a"]], key="k1")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"op": "put", "key": "k2", "sh')   # запись оборвалась на середине
+
+    journal = Journal(path)
+    assert [entry["key"] for entry in journal.pending()] == ["k1"]
+
+
+def test_file_is_compacted_when_everything_is_done(tmp_path):
+    path = str(tmp_path / "ledger.journal")
+    journal = Journal(path)
+    journal.put("Данные", [["a"]], key="k1")
+    journal.put("Данные", [["b"]], key="k2")
+    journal.done(["k1"])
+    assert read_ops(path) == ["put", "put", "done"]
+    journal.done(["k2"])
+    assert read_ops(path) == []
+
+
+def test_dead_entries_are_kept_but_not_replayed(tmp_path):
+    path = str(tmp_path / "ledger.journal")
+    journal = Journal(path)
+    journal.put("Данные", [["a"]], key="k1")
+    journal.put("Данные", [["b"]], key="k2")
+    moved = journal.dead(["k2", "unknown"], "400 Invalid value")
+    assert [entry["key"] for entry in moved] == ["k2"]
+    journal.done(["k1"])
+
+    restarted = Journal(path)
+    assert restarted.pending() == []
+    dead = restarted.dead_letters("Данные")
+    assert [(entry["key"], entry["rows"], entry["error"]) for entry in dead] == [("k2", [["b"]], "400 Invalid value")]
+    # Отложенная отправка не мешает поставить новую с другим ключом и не пишется повторно
+    assert restarted.dead(["k2"], "again") == []
@@ -0,0 +1,91 @@
+# test_keyboards.py
+import pytest
+
+pytest.importorskip("telegram")
+
+import sheets  # noqa: E402
+import utils  # noqa: E402
+
+MATERIALS = [
+    {"ID": "1-1", "Наименование": "Доска 45х90х6000мм", "Ед. измерения": "шт"},
+    {"ID": "1-2", "Наименование": "Доска 45х140х6000мм", "Ед. измерения": "шт"},
+]
+INSTRUMENTS = [{"ID инструмента": 1, "Инструмент": "Дрель"}, {"ID инструмента": 2, "Инструмент": "Перфоратор"}]
+
+
+@pytest.fixture(autouse=True)
+def memo(monkeypatch):
+    monkeypatch.setitem(sheets.caches, "version", 1)
+    monkeypatch.setattr(utils, "_rows_cache", {})
+    monkeypatch.setattr(utils, "_markups", {})
+    monkeypatch.setattr(utils, "_rows_version", None)
+    return utils._rows_cache
+
+
+def counting(build_button):
+    calls = []
+
+    def build(item):
+        calls.append(item)
+        return build_button(item)
+    return build, calls
+
+
+def material_button(item):
+    return item["ID"], utils.catalog_button("mat_", item)
+
+
+def labels(markup):
+    return [button.text for row in markup.inline_keyboard for button in row]
+
+
+def test_rows_are_built_once_per_version():
+    build, calls = counting(material_button)
+    rows, _ = utils.cached_rows("mat_", "Доска", MATERIALS, build)
+    assert utils.cached_rows("mat_", "Доска", MATERIALS, build)[0] is rows
+    assert len(calls) == 2
+
+
+def test_new_cache_version_rebuilds_rows(monkeypatch):
+    build, calls = counting(material_button)
+    utils.cached_rows("mat_", "Доска", MATERIALS, build)
+    monkeypatch.setitem(sheets.caches, "version", 2)
+    utils.cached_rows("mat_", "Доска", MATERIALS, build)
+    assert len(calls) == 4
+
+
+def test_new_list_object_rebuilds_rows():
+    # Список проектов роли пересобирается после смены статуса — в той же версии кэша
+    build, calls = counting(material_button)
+    utils.cached_rows("mat_", "Доска", MATERIALS, build)
+    utils.cached_rows("mat_", "Доска", list(MATERIALS), build)
+    assert len(calls) == 4
+
+
+def test_memo_is_bounded(memo, monkeypatch):
+    monkeypatch.setattr(utils, "ROWS_CACHE_LIMIT", 3)
+    for key in range(10):
+        utils.cached_rows("mat_", key, MATERIALS, material_button)
+        assert len(memo) <= 4
+
+
+def test_selected_quantity_does_not_leak_into_memo():
+    selected = utils.build_material_keyboard(MATERIALS, {"1-1": {"quantity": 5}}, cache_key="Доска")
+    plain = utils.build_material_keyboard(MATERIALS, cache_key="Доска")
+    assert "Доска 45х90х6000мм (5)" in labels(selected)
+    assert "Доска 45х90х6000мм (шт)" in labels(plain)
+
+
+def test_category_markup_is_reused_until_version_changes(monkeypatch):
+    categories = ["Доска Строганная", "Брус"]
+    markup = utils.build_category_keyboard(categories)
+    assert utils.build_category_keyboard(categories) is markup
+    monkeypatch.setitem(sheets.caches, "version", 2)
+    rebuilt = utils.build_category_keyboard(categories)
+    assert rebuilt is not markup and labels(rebuilt) == labels(markup)
+
+
+def test_instrument_pages_share_memo_by_normalized_query(memo):
+    utils.build_instrument_keyboard(INSTRUMENTS, {}, query="Дрель")
+    utils.build_instrument_keyboard(INSTRUMENTS, {}, query="  дрель ")
+    assert len(memo) == 1
@@ -0,0 +1,205 @@
+# test_ledger.py
+import asyncio
+import concurrent.futures
+import threading
+
+import pytest
+
+import sheets
+
+from backend import BackendError
+from journal import Journal
+from ledger import LedgerWriter, SubmissionStore
+from sheets import await_ledger
+
+HEADER = ["№ строки", "Дата", "Кто"]
+
+
+@pytest.fixture
+def sheet(fake_client, worksheet):
+    client = fake_client({"Данные": [HEADER]})
+    return worksheet(client, "Данные")
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return Journal(str(tmp_path / "ledger.journal"))
+
+
+def make_ledger(journal=None):
+    return LedgerWriter("Данные", 2, journal=journal, flush_delay=0.01, retry_delay=0.01)
+
+
+def data_rows(sheet):
+    return sheet.read()[1:]
+
+
+def test_rows_are_numbered_and_keyed(sheet, journal):
+    ledger = make_ledger(journal)
+    assert ledger.submit([["01.01", "Иванов"], ["01.01", "Петров"]], key="cart").result(5)
+    assert ledger.drain(5)
+    assert data_rows(sheet) == [["2", "01.01", "Иванов", "cart:0"], ["3", "01.01", "Петров", "cart:1"]]
+    assert journal.pending() == []
+
+
+def test_lost_response_does_not_duplicate_rows(sheet, journal):
+    # Таблица приняла append, но ответ не дошёл: повтор сверяет ключи и не пишет строки второй раз
+    append_rows = sheet.append_rows
+    calls = []
+
+    def flaky_append(values, **kwargs):
+        calls.append(len(values))
+        result = append_rows(values, **kwargs)
+        if len(calls) == 1:
+            raise BackendError(503, "Backend Error")
+        return result
+
+    sheet.append_rows = flaky_append
+    ledger = make_ledger(journal)
+    ledger.submit([["01.01", "Иванов"]], key="cart")
+    assert ledger.drain(5)
+    assert calls == [1]
+    assert data_rows(sheet) == [["2", "01.01", "Иванов", "cart:0"]]
+    assert journal.pending() == []
+
+
+def test_partially_written_entry_is_resynced_on_recover(sheet, journal):
+    # До остановки в таблицу попала только первая строка отправки
+    journal.put("Данные", [["01.01", "Иванов"], ["01.01", "Петров"]], key="cart")
+    sheet.append_rows([[2, "01.01", "Иванов", "cart:0"]])
+
+    ledger = make_ledger(journal)
+    assert ledger.recover() == 1
+    assert ledger.drain(5)
+    assert data_rows(sheet) == [["2", "01.01", "Иванов", "cart:0"], ["3", "01.01", "Петров", "cart:1"]]
+    assert journal.pending() == []
+
+
+def test_row_number_is_fixed_after_foreign_append(sheet):
+    ledger = make_ledger()
+    assert ledger.submit([["01.01", "Иванов"]]).result(5)
+    sheet.append_rows([["", "вручную"]])
+    assert ledger.submit([["02.01", "Петров"]]).result(5)
+    assert [row[0] for row in data_rows(sheet)] == ["2", "", "4"]
+
+
+def test_rejected_submission_is_dead_lettered_and_queue_continues(sheet, journal):
+    append_rows = sheet.append_rows
+
+    def strict_append(values, **kwargs):
+        if any("BAD" in row for row in values):
+            raise BackendError(400, "Invalid value")
+        return append_rows(values, **kwargs)
+
+    sheet.append_rows = strict_append
+    ledger = make_ledger(journal)
+    ledger.submit([["01.01", "Иванов"]], key="k1")
+    ledger.submit([["01.01", "BAD"]], key="k2")
+    ledger.submit([["01.01", "Петров"]], key="k3")
+    assert ledger.drain(5)
+    assert [row[-1] for row in data_rows(sheet)] == ["k1:0", "k3:0"]
+    assert journal.pending() == []
+    assert [entry["key"] for entry in ledger.dead_letters()] == ["k2"]
+
+
+def test_rejected_submission_without_journal_fails_its_future(sheet):
+    def reject(values, **kwargs):
+        raise BackendError(400, "Invalid value")
+
+    sheet.append_rows = reject
+    ledger = make_ledger()
+    assert ledger.submit([["01.01", "Иванов"]]).result(5) is False
+
+
+def test_key_column_is_added_to_narrow_grid(sheet):
+    sheet._cols = 3
+    ledger = make_ledger()
+    assert ledger.submit([["01.01", "Иванов"]], key="cart").result(5)
+    assert sheet.col_count == 4
+    assert data_rows(sheet) == [["2", "01.01", "Иванов", "cart:0"]]
+
+
+def test_cancelled_submission_is_not_written(sheet):
+    ledger = LedgerWriter("Данные", 2, flush_delay=0.2)
+    cancelled = ledger.submit([["01.01", "Иванов"]], key="k1")
+    assert cancelled.cancel()
+    assert ledger.submit([["01.01", "Петров"]], key="k2").result(5)
+    assert [row[-1] for row in data_rows(sheet)] == ["k2:0"]
+
+
+def test_ledger_wait_timeout_does_not_cancel_submission():
+    future = concurrent.futures.Future()
+    assert asyncio.run(await_ledger(future, timeout=0.01)) is False
+    assert not future.cancelled()
+
+
+def test_async_submit_writes_journal_off_the_loop(sheet, journal, monkeypatch):
+    threads = []
+    put = journal.put
+
+    def tracked_put(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return put(*args, **kwargs)
+
+    monkeypatch.setattr(journal, "put", tracked_put)
+    monkeypatch.setattr(sheets, "data_ledger", make_ledger(journal))
+    monkeypatch.setattr(sheets, "submitted_carts", SubmissionStore(ttl=60))
+
+    async def submit():
+        return await sheets.arecord_expense([["01.01", "Иванов"]], "cart"), threading.current_thread()
+
+    written, loop_thread = asyncio.run(submit())
+    assert written
+    assert threads and threads[0] is not loop_thread
+    assert sheets.data_ledger.drain(5)
+    assert data_rows(sheet) == [["2", "01.01", "Иванов", "cart:0"]]
+
+
+class TestSubmissionStore:
+    @staticmethod
+    def done(result):
+        future = concurrent.futures.Future()
+        future.set_result(result)
+        return future
+
+    def test_same_cart_within_ttl_gets_first_future(self):
+        store = SubmissionStore(ttl=60)
+        first = self.done(True)
+        assert store.submit_once("cart", lambda: first) is first
+        assert store.submit_once("cart", lambda: pytest.fail("повторная отправка")) is first
+
+    def test_pending_submission_is_not_sent_twice(self):
+        store = SubmissionStore(ttl=60)
+        pending = concurrent.futures.Future()
+        assert store.submit_once("cart", lambda: pending) is pending
+        assert store.submit_once("cart", lambda: pytest.fail("повторная отправка")) is pending
+
+    def test_failed_submission_can_be_retried(self):
+        store = SubmissionStore(ttl=60)
+        store.submit_once("cart", lambda: self.done(False))
+        retry = self.done(True)
+        assert store.submit_once("cart", lambda: retry) is retry
+
+    def test_expired_submission_is_sent_again(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr("ledger.time.monotonic", lambda: now[0])
+        store = SubmissionStore(ttl=60)
+        first = self.done(True)
+        store.submit_once("cart", lambda: first)
+        now[0] += 61
+        second = self.done(True)
+        assert store.submit_once("cart", lambda: second) is second
+
+    def test_other_carts_are_independent(self):
+        store = SubmissionStore(ttl=60)
+        first, other = self.done(True), self.done(True)
+        store.submit_once("cart-1", lambda: first)
+        assert store.submit_once("cart-2", lambda: other) is other
+
+    def test_cancelled_submission_can_be_retried(self):
+        store = SubmissionStore(ttl=60)
+        cancelled = concurrent.futures.Future()
+        store.submit_once("cart", lambda: cancelled)
+        cancelled.cancel()
+        retry = self.done(True)
+        assert store.submit_once("cart", lambda: retry) is retry
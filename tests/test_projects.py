@@ -0,0 +1,64 @@
+# test_projects.py
+import pytest
+
+import sheets
+
+
+@pytest.fixture
+def projects(cache_client):
+    sheets.load_caches(force=True)
+    return cache_client._spreadsheets[sheets.SPREADSHEET_ID]._worksheets["Проекты"]
+
+
+def cell(worksheet, row, header):
+    return worksheet.read()[row - 1][sheets.HEADERS.index(header)]
+
+
+def calls(client, *methods):
+    return [client.calls[method] for method in methods]
+
+
+def tag_at(worksheet, row):
+    return cell(worksheet, row, "Номер договора")
+
+
+def test_status_is_written_to_cached_row(cache_client, projects):
+    tag = tag_at(projects, 3)
+    before = calls(cache_client, "batch_get", "col_values", "batch_update")
+    assert sheets.update_project_status(tag, "в работе")
+    # Сверка одной ячейки номера договора и одна запись; колонка целиком не читается
+    assert [a - b for a, b in zip(calls(cache_client, "batch_get", "col_values", "batch_update"), before)] == [1, 0, 1]
+    assert cell(projects, 3, "Статус") == "в работе"
+    assert sheets.get_project(number=tag)["Статус"] == "в работе"
+
+
+def test_shifted_rows_fall_back_to_column_scan(cache_client, projects):
+    tag = tag_at(projects, 3)
+    # Строку вставили над проектом вручную: карта из кэша указывает на чужой проект
+    projects._rows.insert(1, [""] * len(projects._rows[0]))
+    other = tag_at(projects, 3)
+    col_values = cache_client.calls["col_values"]
+    assert sheets.update_project_report_link(tag, "https://example.org/report")
+    assert cache_client.calls["col_values"] == col_values + 1
+    assert cell(projects, 4, "Ссылка на отчёт") == "https://example.org/report"
+    assert cell(projects, 3, "Ссылка на отчёт") != "https://example.org/report"
+    assert tag_at(projects, 3) == other
+    # Перестроенная карта попала в кэш: следующая запись снова сверяет одну ячейку
+    assert sheets.caches["project_rows"][sheets.normalize_tag(tag)] == 4
+    col_values = cache_client.calls["col_values"]
+    assert sheets.update_project_status(tag, "сдан")
+    assert cache_client.calls["col_values"] == col_values
+
+
+def test_many_statuses_use_one_check_and_one_write(cache_client, projects):
+    tags = [tag_at(projects, row) for row in (2, 3, 4)]
+    before = calls(cache_client, "batch_get", "batch_update")
+    assert sheets.update_project_statuses({tag: "архив" for tag in tags}) == set(tags)
+    assert [a - b for a, b in zip(calls(cache_client, "batch_get", "batch_update"), before)] == [1, 1]
+    assert [cell(projects, row, "Статус") for row in (2, 3, 4)] == ["архив"] * 3
+
+
+def test_unknown_project_is_not_written(cache_client, projects):
+    batch_update = cache_client.calls["batch_update"]
+    assert not sheets.update_project_status("нет-такого/00", "сдан")
+    assert cache_client.calls["batch_update"] == batch_update
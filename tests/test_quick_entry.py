@@ -0,0 +1,50 @@
+# test_quick_entry.py
+import pytest
+
+import quick_entry
+from quick_entry import parse_quick_entry, resolve_quick_entry
+
+
+@pytest.mark.parametrize("text, items, invalid", [
+    # "150x150" — часть названия, количество — последнее число
+    ("212: Брус 150x150 6", [("Брус 150x150", 6.0)], []),
+    ("212: Брус 150x150 x 6", [("Брус 150x150", 6.0)], []),
+    # Десятичная запятая не делит позиции
+    ("212: Саморез 4,2х25 500, Клей 2,5", [("Саморез 4,2х25", 500.0), ("Клей", 2.5)], []),
+    ("212: Брус - 6\nКлей=2.5кг", [("Брус", 6.0), ("Клей", 2.5)], []),
+    ("212: Саморез 500 шт; Гвоздь 1.", [("Саморез", 500.0), ("Гвоздь", 1.0)], []),
+    # Без количества или с нулём позиция не списывается, но и не теряется
+    ("212: Брус 150x150", [], ["Брус 150x150"]),
+    ("212: Брус 6, Клей", [("Брус", 6.0)], ["Клей"]),
+    ("212: Брус 0", [], ["Брус 0"]),
+    ("212: , ;", [], []),
+])
+def test_parse_items(text, items, invalid):
+    assert parse_quick_entry(text) == ("212", items, invalid)
+
+
+def test_text_without_colon_is_not_quick_entry():
+    assert parse_quick_entry("212-12/КК") == (None, [], [])
+
+
+def test_resolve_sums_repeated_items_and_collects_unknown(monkeypatch):
+    project = {"Номер договора": "212-12/КК"}
+    brus = {"ID": 7, "Наименование": "Брус 150x150", "Ед. измерения": "м"}
+    catalog = {"Брус 150x150": (brus, True), "брус 150х150": (brus, False)}
+    monkeypatch.setattr(quick_entry, "get_project", lambda number, role: None)
+    monkeypatch.setattr(quick_entry, "search_projects", lambda text, role, limit: [project])
+    monkeypatch.setattr(quick_entry, "match_catalog",
+                        lambda name, kinds: ("materials", *catalog[name]) if name in catalog else None)
+
+    result = resolve_quick_entry("212: Брус 150x150 6, брус 150х150 2,5; Клей 1; Гвоздь", role="admin")
+    assert result["project"] is project and not result["project_exact"]
+    entry = result["items"][("materials", "7")]
+    assert (entry["quantity"], entry["unit"], entry["exact"]) == (8.5, "м", False)
+    assert entry["typed"] == ["Брус 150x150", "брус 150х150"]
+    assert result["unknown"] == ["Клей"]
+    assert result["invalid"] == ["Гвоздь"]
+
+
+def test_resolve_ignores_plain_text():
+    assert resolve_quick_entry("212-12/КК", role="admin") is None
+    assert resolve_quick_entry("212:", role="admin") is None
@@ -0,0 +1,68 @@
+# test_refresh.py
+import datetime
+
+import sheets
+
+
+def spreadsheet(client):
+    return client._spreadsheets[sheets.SPREADSHEET_ID]
+
+
+def refresh(client):
+    """Принудительное обновление кэша; возвращает (изменился ли кэш, загружались ли листы)"""
+    fetches = client.calls["values_batch_get"]
+    version = sheets.caches["version"]
+    sheets.load_caches(force=True)
+    return sheets.caches["version"] != version, client.calls["values_batch_get"] != fetches
+
+
+def first_project(client):
+    projects = spreadsheet(client)._worksheets["Проекты"]
+    header = projects.read()[0]
+    return projects, header.index("Статус") + 1, projects.read()[1][header.index("Номер договора")]
+
+
+def test_unchanged_spreadsheet_is_not_downloaded(cache_client):
+    assert refresh(cache_client) == (True, True)
+    assert refresh(cache_client) == (False, False)
+
+
+def test_edit_in_spreadsheet_is_loaded(cache_client):
+    refresh(cache_client)
+    projects, status_col, number = first_project(cache_client)
+    projects.write(2, status_col, [["в работе (правка вручную)"]])
+    assert refresh(cache_client) == (True, True)
+    assert sheets.get_project(number=number)["Статус"] == "в работе (правка вручную)"
+
+
+def test_write_outside_cached_sheets_keeps_version(cache_client):
+    # Запись бота в "Данные" сдвигает время изменения: листы загружаются, но по контрольным суммам
+    # ничего не разбирается заново
+    refresh(cache_client)
+    spreadsheet(cache_client)._worksheets["Данные"].append_rows([[2, "01.01", "Иванов"]])
+    assert refresh(cache_client) == (False, True)
+    assert refresh(cache_client) == (False, False)
+
+
+def test_lagging_modified_time_is_caught_by_periodic_check(cache_client, monkeypatch):
+    monkeypatch.setattr(sheets, "SOURCE_SKIP_LIMIT", 2)
+    refresh(cache_client)
+    projects, status_col, number = first_project(cache_client)
+    # Drive ещё не сдвинул время изменения после правки
+    source = spreadsheet(cache_client)
+    modified = source._modified
+    projects.write(2, status_col, [["сдан"]])
+    source._modified = modified
+
+    assert refresh(cache_client) == (False, False)
+    assert refresh(cache_client) == (False, False)
+    assert refresh(cache_client) == (True, True)
+    assert sheets.get_project(number=number)["Статус"] == "сдан"
+
+
+def test_full_refresh_ignores_modified_time(cache_client):
+    refresh(cache_client)
+    fetches = cache_client.calls["values_batch_get"]
+    sheets.load_caches(force=True, full=True)
+    assert cache_client.calls["values_batch_get"] == fetches + 1
+    assert isinstance(sheets.caches["last_updated"], datetime.datetime)
@@ -0,0 +1,71 @@
+# test_scheduler.py
+import asyncio
+import datetime
+
+import pytest
+
+import scheduler
+from scheduler import next_run, parse_schedule
+
+MONDAY = datetime.date(2025, 3, 3)
+
+
+def at(day, hour, minute=0):
+    """Момент в неделе, начинающейся с понедельника MONDAY (day: 0 — понедельник)"""
+    return datetime.datetime.combine(MONDAY + datetime.timedelta(days=day), datetime.time(hour, minute))
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("", []),
+    ("08:00", [(frozenset(range(7)), datetime.time(8, 0))]),
+    ("пн-пт 08:00,20:30", [(frozenset(range(5)), datetime.time(8, 0)), (frozenset(range(5)), datetime.time(20, 30))]),
+    ("сб,вс 12:00; 7:05", [(frozenset({5, 6}), datetime.time(12, 0)), (frozenset(range(7)), datetime.time(7, 5))]),
+    ("сб-пн 09:00", [(frozenset({5, 6, 0}), datetime.time(9, 0))]),
+    ("Mon 06:00", [(frozenset({0}), datetime.time(6, 0))]),
+])
+def test_parse_schedule(spec, expected):
+    assert parse_schedule(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["пн-пт", "пн-пя 08:00", "24:00", "08:60", "8", "пн 08:00 09:00"])
+def test_parse_schedule_rejects_bad_entries(spec):
+    with pytest.raises(ValueError):
+        parse_schedule(spec)
+
+
+def test_next_run_is_strictly_after_now():
+    windows = parse_schedule("08:00,20:00")
+    assert next_run(windows, at(0, 7, 59)) == at(0, 8)
+    assert next_run(windows, at(0, 8)) == at(0, 20)
+    assert next_run(windows, at(0, 21)) == at(1, 8)
+
+
+def test_next_run_skips_days_off_and_wraps_the_week():
+    windows = parse_schedule("пн-пт 08:00; сб 12:00")
+    assert next_run(windows, at(4, 9)) == at(5, 12)
+    assert next_run(windows, at(5, 13)) == at(7, 8)
+    # Единственный запуск в неделю, только что прошедший, — через семь дней
+    assert next_run(parse_schedule("ср 10:00"), at(2, 10)) == at(9, 10)
+
+
+def test_next_run_without_windows():
+    assert next_run([], at(0, 8)) is None
+
+
+def test_run_schedule_survives_failed_refresh(monkeypatch):
+    moments = iter([0.01, 0.01, None])
+
+    def fake_next_run(windows, now):
+        delay = next(moments)
+        return None if delay is None else now + datetime.timedelta(seconds=delay)
+
+    monkeypatch.setattr(scheduler, "next_run", fake_next_run)
+    calls = []
+
+    async def refresh():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise RuntimeError("Google Sheets недоступен")
+
+    asyncio.run(asyncio.wait_for(scheduler.run_schedule(parse_schedule("08:00"), refresh), 5))
+    assert calls == [0, 1]
@@ -0,0 +1,78 @@
+# test_search.py
+import pytest
+
+from search import SearchIndex, normalize, trigrams
+
+MATERIALS = [
+    {"ID": "1", "Наименование": "Саморез 4.2x25"},
+    {"ID": "2", "Наименование": "Саморез 4.2x75"},
+    {"ID": "3", "Наименование": "Брус 150x150x6000"},
+    {"ID": "4", "Наименование": "Брус 100x150x6000"},
+    {"ID": "5", "Наименование": "Клей монтажный"},
+]
+
+
+@pytest.fixture
+def index():
+    return SearchIndex.build(MATERIALS, key=lambda m: m["ID"], text=lambda m: m["Наименование"])
+
+
+def ids(items):
+    return [item["ID"] for item in items]
+
+
+@pytest.mark.parametrize("text, words", [
+    ("212-12/КК", ["212", "12", "kk"]),
+    # Похожие кириллические буквы заменяются латинскими, остальные остаются
+    ("Саморез 4,2х25", ["camopeз", "4", "2x25"]),
+    ("  ЁЛКА!! ", ["eлka"]),
+])
+def test_normalize(text, words):
+    assert normalize(text) == words
+
+
+def test_cyrillic_and_latin_lookalikes_match(index):
+    # "х" кириллицей и "x" латиницей — одна и та же буква для поиска
+    assert ids(index.search("саморез 4.2х25", limit=1)) == ["1"]
+
+
+def test_typo_still_finds_item(index):
+    assert ids(index.search("клеи монтажнный", limit=1)) == ["5"]
+
+
+def test_exact_phrase_ranks_above_fuzzy(index):
+    assert ids(index.search("брус 100x150", limit=2)) == ["4", "3"]
+
+
+def test_unrelated_query_finds_nothing(index):
+    assert index.search("перфоратор") == []
+    assert index.search("!!!") == []
+
+
+def test_accept_filters_and_limit_counts_accepted(index):
+    found = index.search("саморез", limit=1, accept=lambda m: m["ID"] != "1")
+    assert ids(found) == ["2"]
+
+
+def test_scored_reports_exact_match(index):
+    (exact, coverage, _), item = index.scored("Клей монтажный", limit=1)[0]
+    assert (exact, coverage, item["ID"]) == (True, 1.0, "5")
+
+
+def test_first_item_wins_on_duplicate_key(index):
+    index.add("1", "Гвоздь 100", {"ID": "1", "Наименование": "Гвоздь 100"})
+    assert index.search("гвоздь") == []
+    assert len(index) == len(MATERIALS)
+
+
+def test_added_item_is_found(index):
+    index.add("6", "Гвоздь 100", {"ID": "6"})
+    assert ids(index.search("гвоздь")) == ["6"]
+
+
+def test_rebuild_reuses_trigrams_of_unchanged_texts(index):
+    grams = index.grams_by_text()
+    rebuilt = SearchIndex.build(MATERIALS[:2], key=lambda m: m["ID"], text=lambda m: m["Наименование"], previous=index)
+    text = " ".join(normalize(MATERIALS[0]["Наименование"]))
+    assert rebuilt.grams_by_text()[text] is grams[text]
+    assert grams[text] == trigrams(text.split())
@@ -0,0 +1,98 @@
+# test_snapshot.py
+import datetime
+import os
+import zlib
+
+import pytest
+
+import sheets
+import snapshot
+from sheets import save_caches_snapshot
+from snapshot import HEADER, SNAPSHOT_MAGIC, SNAPSHOT_SCHEMA_VERSION, SnapshotError, dumps, load_snapshot, loads, save_snapshot
+
+DATA = {
+    "projects": [{"ID проекта": 59, "Номер договора": "212-12/КК", "Сумма": 1.5, "Примечание": None}],
+    "plates_by_category": {"GNA": [{"ID": "11"}]},
+    "last_updated": datetime.datetime(2025, 3, 3, 8, 0, 15, 123456),
+    "version": 7,
+}
+
+
+def repack(raw, **fields):
+    """Снимок с подменёнными полями заголовка (данные и CRC прежние)"""
+    values = dict(zip(("magic", "schema", "marshal", "major", "minor", "crc", "length"), HEADER.unpack_from(raw)))
+    values.update(fields)
+    return HEADER.pack(*values.values()) + raw[HEADER.size:]
+
+
+def test_round_trip_keeps_types():
+    restored = loads(dumps(DATA))
+    assert restored == DATA
+    assert isinstance(restored["last_updated"], datetime.datetime)
+
+
+def test_damaged_payload_fails_crc():
+    raw = bytearray(dumps(DATA))
+    raw[-1] ^= 0xFF
+    with pytest.raises(SnapshotError, match="контрольная сумма"):
+        loads(bytes(raw))
+
+
+@pytest.mark.parametrize("cut", [0, 3, HEADER.size - 1, HEADER.size + 5])
+def test_truncated_file_is_rejected(cut):
+    with pytest.raises(SnapshotError):
+        loads(dumps(DATA)[:cut])
+
+
+def test_foreign_file_is_rejected():
+    with pytest.raises(SnapshotError, match="неизвестный формат"):
+        loads(b'{"projects": []}' + bytes(HEADER.size))
+
+
+def test_other_schema_version_is_rejected():
+    raw = repack(dumps(DATA), schema=SNAPSHOT_SCHEMA_VERSION + 1)
+    with pytest.raises(SnapshotError, match="версия схемы"):
+        loads(raw)
+
+
+def test_snapshot_of_other_python_is_rejected():
+    raw = repack(dumps(DATA), minor=snapshot.RUNTIME[2] + 1)
+    with pytest.raises(SnapshotError, match="marshal"):
+        loads(raw)
+
+
+def test_header_describes_payload():
+    raw = dumps(DATA)
+    magic, schema, *runtime, crc, length = HEADER.unpack_from(raw)
+    assert (magic, schema, tuple(runtime)) == (SNAPSHOT_MAGIC, SNAPSHOT_SCHEMA_VERSION, snapshot.RUNTIME)
+    assert (length, crc) == (len(raw) - HEADER.size, zlib.crc32(raw[HEADER.size:]))
+
+
+def test_save_replaces_file_atomically(tmp_path):
+    path = str(tmp_path / "cach.snapshot")
+    save_snapshot({"version": 1}, path)
+    size = save_snapshot(DATA, path)
+    assert os.path.getsize(path) == size
+    assert os.listdir(tmp_path) == ["cach.snapshot"]
+    assert load_snapshot(path) == DATA
+
+
+def test_missing_file_is_snapshot_error(tmp_path):
+    with pytest.raises(SnapshotError):
+        load_snapshot(str(tmp_path / "нет.snapshot"))
+
+
+def test_cache_round_trip_rebuilds_indexes(cache_client, tmp_path):
+    sheets.load_caches(force=True)
+    path = str(tmp_path / "cach.snapshot")
+    assert save_caches_snapshot(path)
+    saved = {key: value for key, value in sheets.caches.items() if key not in sheets.INDEX_KEYS}
+    # Индексы в снимок не попадают
+    assert not set(load_snapshot(path)) & set(sheets.INDEX_KEYS)
+
+    for key in sheets.caches:
+        sheets.caches[key] = None
+    sheets.restore_caches_snapshot(path)
+    assert {key: sheets.caches[key] for key in saved} == saved
+    tag = saved["projects"][0]["Номер договора"]
+    assert sheets.get_project(number=tag) is not None
@@ -0,0 +1,95 @@
+# test_tail_sync.py
+import pytest
+
+import sheets
+from sheets import WHERE_INSTRUMENT_HEADERS, apply_tail, full_sync_state
+
+SHEET = "Где инструмент"
+
+
+def where_row(number, tool="Шуруповёрт"):
+    return [number, "03.03.2025", "Выдача", "Иванов", "212-12/КК", "Петров", tool, 1]
+
+
+VALUES = [WHERE_INSTRUMENT_HEADERS] + [[str(cell) for cell in where_row(n)] for n in (2, 3)]
+
+
+def records(values):
+    return sheets.parse_where_instruments_sheet(values)["where_instruments"]
+
+
+class TestApplyTail:
+    def test_new_rows_are_appended_to_records(self):
+        state = full_sync_state(SHEET, VALUES, records(VALUES))
+        tail = [VALUES[-1], [str(cell) for cell in where_row(4, "Перфоратор")]]
+        merged, new_state = apply_tail(tail, state, records(VALUES))
+        assert [record["Инструмент"] for record in merged] == ["Шуруповёрт", "Шуруповёрт", "Перфоратор"]
+        assert (new_state["rows"], new_state["records"], new_state["syncs"]) == (4, 3, 1)
+
+    def test_empty_tail_after_last_row_changes_nothing(self):
+        state = full_sync_state(SHEET, VALUES, records(VALUES))
+        merged, new_state = apply_tail([VALUES[-1]], state, records(VALUES))
+        assert merged == records(VALUES) and new_state["rows"] == state["rows"]
+
+    def test_changed_watermark_row_needs_full_load(self):
+        state = full_sync_state(SHEET, VALUES, records(VALUES))
+        edited = [str(cell) for cell in where_row(3, "Болгарка")]
+        assert apply_tail([edited], state, records(VALUES)) is None
+
+    def test_rows_wider_than_headers_need_full_load(self):
+        state = full_sync_state(SHEET, VALUES, records(VALUES))
+        assert apply_tail([VALUES[-1], VALUES[-1] + ["лишнее"]], state, records(VALUES)) is None
+
+    def test_lost_local_records_need_full_load(self):
+        state = full_sync_state(SHEET, VALUES, records(VALUES))
+        assert apply_tail([VALUES[-1]], state, records(VALUES)[:1]) is None
+
+
+@pytest.fixture
+def where(cache_client, monkeypatch):
+    """Лист 'Где инструмент' и список диапазонов, запрошенных для него при каждой загрузке"""
+    requested = []
+    fetch = sheets.fetch_sheets_values
+
+    def tracked_fetch(sheet_names, ranges=None):
+        if SHEET in sheet_names:
+            requested.append((ranges or {}).get(SHEET))
+        return fetch(sheet_names, ranges)
+
+    monkeypatch.setattr(sheets, "fetch_sheets_values", tracked_fetch)
+    sheets.load_caches(force=True)
+    return cache_client._spreadsheets[sheets.SPREADSHEET_ID]._worksheets[SHEET], requested
+
+
+def test_refresh_fetches_only_the_tail(where):
+    worksheet, requested = where
+    count = len(sheets.caches["where_instruments"])
+    rows = len(worksheet.read())
+    # Ключ очереди записи в колонке I в кэш не попадает
+    worksheet.append_rows([where_row(rows + 1, "Перфоратор") + ["cart:0"]])
+    sheets.load_caches(force=True)
+    assert requested == [None, f"'{SHEET}'!A{rows}:H"]
+    assert len(sheets.caches["where_instruments"]) == count + 1
+    assert sheets.caches["where_instruments"][-1]["Инструмент"] == "Перфоратор"
+    assert "" not in sheets.caches["where_instruments"][-1]
+    assert sheets.caches["sync_state"][SHEET]["rows"] == rows + 1
+
+
+def test_edit_above_watermark_falls_back_to_full_load(where):
+    worksheet, requested = where
+    rows = len(worksheet.read())
+    worksheet.write(rows, 7, [["Болгарка"]])
+    sheets.load_caches(force=True)
+    # Хвост не сошёлся по контрольной сумме — лист загружен целиком
+    assert requested == [None, f"'{SHEET}'!A{rows}:H", None]
+    assert sheets.caches["where_instruments"][-1]["Инструмент"] == "Болгарка"
+    assert sheets.caches["sync_state"][SHEET]["syncs"] == 0
+
+
+def test_full_reload_every_n_syncs(where, monkeypatch):
+    worksheet, requested = where
+    monkeypatch.setattr(sheets, "SYNC_FULL_RELOAD_EVERY", 2)
+    for _ in range(3):
+        worksheet.append_rows([where_row(len(worksheet.read()) + 1)])
+        sheets.load_caches(force=True)
+    assert [range_name is None for range_name in requested] == [True, False, False, True]
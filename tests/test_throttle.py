@@ -0,0 +1,123 @@
+# test_throttle.py
+import pytest
+from gspread.exceptions import WorksheetNotFound
+
+from backend import BackendError
+from throttle import CircuitBreaker, CircuitOpenError, RateLimiter, is_permanent_error
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("throttle.time.monotonic", lambda: now[0])
+    return now
+
+
+def make_limiter(attempts=3, threshold=2, cooldown=30):
+    return RateLimiter(
+        reads_per_minute=6000, writes_per_minute=6000, burst=100, attempts=attempts,
+        base_delay=0, max_delay=0, breaker_threshold=threshold, breaker_cooldown=cooldown
+    )
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold_failures(self, clock):
+        breaker = CircuitBreaker(threshold=2, cooldown=30)
+        assert not breaker.record_failure()
+        assert breaker.state == "closed" and breaker.allow()
+        assert breaker.record_failure()
+        assert breaker.state == "open"
+        assert not breaker.allow()
+
+    def test_half_open_lets_one_trial_through(self, clock):
+        breaker = CircuitBreaker(threshold=1, cooldown=30)
+        breaker.record_failure()
+        clock[0] += 30
+        assert breaker.state == "half_open"
+        assert breaker.allow()
+        assert not breaker.allow()
+
+    def test_successful_trial_closes(self, clock):
+        breaker = CircuitBreaker(threshold=1, cooldown=30)
+        breaker.record_failure()
+        clock[0] += 30
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == "closed"
+        assert breaker.allow() and breaker.allow()
+
+    def test_failed_trial_reopens_for_full_cooldown(self, clock):
+        breaker = CircuitBreaker(threshold=3, cooldown=30)
+        for _ in range(3):
+            breaker.record_failure()
+        clock[0] += 30
+        assert breaker.allow()
+        # Одной неудачи пробного вызова достаточно, порог не важен
+        assert breaker.record_failure()
+        assert breaker.state == "open"
+        clock[0] += 29
+        assert not breaker.allow()
+        clock[0] += 1
+        assert breaker.allow()
+
+    def test_success_resets_failure_count(self, clock):
+        breaker = CircuitBreaker(threshold=2, cooldown=30)
+        breaker.record_failure()
+        breaker.record_success()
+        assert not breaker.record_failure()
+        assert breaker.state == "closed"
+
+
+class TestRateLimiter:
+    @staticmethod
+    def failing(*errors, result="ok"):
+        errors = list(errors)
+
+        def call():
+            if errors:
+                raise errors.pop(0)
+            return result
+        return call
+
+    def test_read_is_retried_on_quota_and_server_errors(self):
+        limiter = make_limiter()
+        assert limiter.call("read", "get_all_values", self.failing(BackendError(429, "quota"), BackendError(503, "down"))) == "ok"
+        assert limiter.snapshot()["retried"] == 2
+
+    def test_write_is_retried_only_on_quota(self):
+        limiter = make_limiter()
+        assert limiter.call("write", "append_rows", self.failing(BackendError(429, "quota"))) == "ok"
+        # При 5xx строки могли уже лечь в таблицу — повтор решает очередь записи
+        with pytest.raises(BackendError):
+            limiter.call("write", "append_rows", self.failing(BackendError(503, "down")))
+
+    def test_breaker_rejects_calls_without_touching_api(self, clock):
+        limiter = make_limiter(attempts=1, threshold=2)
+        for _ in range(2):
+            with pytest.raises(BackendError):
+                limiter.call("read", "get_all_values", self.failing(BackendError(503, "down")))
+        assert limiter.snapshot()["breaker"] == "open"
+        with pytest.raises(CircuitOpenError):
+            limiter.call("read", "get_all_values", pytest.fail)
+        clock[0] += 30
+        assert limiter.call("read", "get_all_values", self.failing()) == "ok"
+        assert limiter.snapshot()["breaker"] == "closed"
+
+    def test_request_errors_do_not_open_breaker(self):
+        limiter = make_limiter(attempts=1, threshold=1)
+        with pytest.raises(BackendError):
+            limiter.call("write", "update", self.failing(BackendError(400, "Invalid value")))
+        assert limiter.snapshot()["breaker"] == "closed"
+
+
+@pytest.mark.parametrize("error, permanent", [
+    (BackendError(400, "Invalid value"), True),
+    (BackendError(404, "Not found"), True),
+    (WorksheetNotFound("Данные"), True),
+    (BackendError(429, "quota"), False),
+    (BackendError(403, "rateLimitExceeded"), False),
+    (BackendError(503, "down"), False),
+    (ValueError("не ошибка API"), False),
+])
+def test_is_permanent_error(error, permanent):
+    assert is_permanent_error(error) is permanent
@@ -0,0 +1,230 @@
+# throttle.py
+# Ограничение обращений к Google Sheets: token bucket на чтение и запись (под поминутную квоту),
+# повторы с экспоненциальной задержкой на 429/5xx и автомат-предохранитель (circuit breaker).
+import functools
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from gspread.exceptions import APIError, WorksheetNotFound
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+logger = logging.getLogger(__name__)
+
+# Какие методы клиента gspread ходят в API и какой квотой они расходуются
+API_CALLS = {
+    "open_by_key": "read",
+    "worksheet": "read",
+    "worksheets": "read",
+    "values_batch_get": "read",
+    "get_all_values": "read",
+    "col_values": "read",
+    "batch_get": "read",
+    "find": "read",
+    "get_lastUpdateTime": "read",
+    "get_file_drive_metadata": "read",
+    "update": "write",
+    "update_cell": "write",
+    "append_row": "write",
+    "append_rows": "write",
+    "batch_update": "write",
+    "add_worksheet": "write",
+    "add_cols": "write",
+}
+# Результаты этих вызовов — таблица или лист, их методы тоже идут через ограничитель
+WRAPPED_RESULTS = {"open_by_key", "worksheet", "add_worksheet"}
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def error_status(error):
+    """HTTP-статус ошибки хранилища или None, если это не ошибка API"""
+    if isinstance(error, APIError):
+        return error.code
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status
+    if isinstance(error, (RequestsConnectionError, Timeout)):
+        return 503
+    return None
+
+
+def is_permanent_error(error):
+    """Повтор не поможет: таблица отклонила запрос или листа больше нет.
+    401/403 (доступ, квота Drive), 408 и 429 проходят со временем — их повторяем"""
+    if isinstance(error, WorksheetNotFound):
+        return True
+    status = error_status(error)
+    return status is not None and 400 <= status < 500 and status not in (401, 403, 408, 429)
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут: Google Sheets недоступен, вызов отклонён без обращения к API"""
+
+    status = 503
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Забирает один токен, при необходимости ждёт. Возвращает время ожидания (сек)"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class CircuitBreaker:
+    """После threshold подряд неудачных вызовов отклоняет всё на cooldown секунд,
+    затем пропускает один пробный вызов: успех замыкает цепь, неудача снова размыкает"""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Google Sheets снова отвечает, предохранитель замкнут.")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        """Возвращает True, если цепь только что разомкнулась"""
+        with self._lock:
+            self.failures += 1
+            reopened = self.trial_in_flight
+            self.trial_in_flight = False
+            if reopened or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class RateLimiter:
+    def __init__(self, reads_per_minute, writes_per_minute, burst, attempts, base_delay, max_delay,
+                 breaker_threshold, breaker_cooldown):
+        self.buckets = {
+            "read": TokenBucket(reads_per_minute, burst),
+            "write": TokenBucket(writes_per_minute, burst),
+        }
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def backoff(self, attempt):
+        # Экспоненциальная задержка с полным джиттером
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def is_retryable(self, kind, status):
+        # Запись повторяем только на 429: при 5xx строки могли уже лечь в таблицу
+        if kind == "write":
+            return status == 429
+        return status in RETRYABLE_STATUSES
+
+    def call(self, kind, name, func, *args, **kwargs):
+        if not self.breaker.allow():
+            self.count("rejected")
+            raise CircuitOpenError(f"Google Sheets временно недоступен, вызов {name} отклонён")
+        attempt = 0
+        while True:
+            waited = self.buckets[kind].acquire()
+            self.count(f"{kind}_calls")
+            if waited:
+                self.count("throttled")
+                self.count("throttle_wait_ms", int(waited * 1000))
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                status = error_status(e)
+                if status is None or status not in RETRYABLE_STATUSES:
+                    # Ошибка запроса, а не недоступность сервиса: предохранитель не трогаем
+                    self.breaker.record_success()
+                    raise
+                if self.is_retryable(kind, status) and attempt + 1 < self.attempts:
+                    delay = self.backoff(attempt)
+                    attempt += 1
+                    self.count("retried")
+                    logger.warning(f"Sheets {name}: ошибка {status}, повтор {attempt} через {delay:.1f} с")
+                    time.sleep(delay)
+                    continue
+                self.count("failed")
+                if self.breaker.record_failure():
+                    self.count("breaker_opened")
+                    logger.error(f"Sheets {name}: ошибка {status}, предохранитель разомкнут на {self.breaker.cooldown} с")
+                raise
+            self.breaker.record_success()
+            return result
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["breaker"] = self.breaker.state
+        return stats
+
+
+class ThrottledProxy:
+    """Обёртка над клиентом/таблицей/листом gspread: вызовы API идут через RateLimiter"""
+
+    def __init__(self, target, limiter):
+        self._target = target
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == "http_client":
+            return ThrottledProxy(attr, self._limiter)
+        kind = API_CALLS.get(name)
+        if kind is None or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            result = self._limiter.call(kind, name, attr, *args, **kwargs)
+            return ThrottledProxy(result, self._limiter) if name in WRAPPED_RESULTS else result
+        return call
@@ -1,43 +1,125 @@
+import uuid
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from sheets import get_cache_version, instrument_query_key
 
-def build_project_keyboard(projects, include_manual=False):
-    keyboard = [
-        [InlineKeyboardButton(
-            f"{p['Номер договора']} ({p['Ф.И.О заказчика']})",
-            callback_data=f"proj_{p['ID проекта']}")
-        ]
-        for p in projects if p.get('ID проекта')
-    ]
+# Готовые кнопки каталогов: (вид, ключ) -> (исходный список, строки, позиции).
+# Собираются один раз на версию кэша; выбранные количества накладываются на копию строк
+_rows_cache = {}
+_markups = {}
+_rows_version = None
+# При обычной работе ключей на версию намного меньше; это страховка от роста без предела
+ROWS_CACHE_LIMIT = 1024
+
+def cached_rows(kind, key, items, build_button):
+    """Строки по одной кнопке на позицию и позиции: ID -> (номер строки, позиция).
+    build_button(item) -> (ID, кнопка) или (ID, None), если позицию не показываем.
+    Собираются заново, только если сменилась версия кэша или сам список items
+    (список проектов роли пересобирается после смены статуса или нового проекта)"""
+    global _rows_version
+    version = get_cache_version()
+    if version != _rows_version or len(_rows_cache) > ROWS_CACHE_LIMIT:
+        _rows_cache.clear()
+        _markups.clear()
+        _rows_version = version
+    entry = _rows_cache.get((kind, key))
+    if entry is None or entry[0] is not items:
+        entry = _rows_cache[(kind, key)] = (items,) + collect_rows(items, build_button)
+    return entry[1], entry[2]
+
+def collect_rows(items, build_button):
+    rows, positions = [], {}
+    for item in items:
+        item_id, button = build_button(item)
+        if button is None:
+            continue
+        positions.setdefault(item_id, (len(rows), item))
+        rows.append((button,))
+    return tuple(rows), positions
+
+def item_rows(kind, cache_key, items, selected, build_button, selected_button):
+    """Строки позиций с выбранными количествами. Пересобираются только кнопки выбранных позиций.
+    Без cache_key (результаты поиска) строки собираются заново"""
+    if cache_key is None:
+        rows, positions = collect_rows(items, build_button)
+    else:
+        rows, positions = cached_rows(kind, cache_key, items, build_button)
+    rows = list(rows)
+    for item_id, value in (selected or {}).items():
+        position = positions.get(item_id)
+        if position is not None:
+            rows[position[0]] = (selected_button(position[1], value),)
+    return rows
+
+def project_button(p):
+    if not p.get('ID проекта'):
+        return None, None
+    return p['ID проекта'], InlineKeyboardButton(f"{p['Номер договора']} ({p['Ф.И.О заказчика']})", callback_data=f"proj_{p['ID проекта']}")
+
+def build_project_keyboard(projects, include_manual=False, cache_key=None):
+    # cache_key — роль: список её проектов из get_projects_list превращается в кнопки один раз
+    rows = item_rows("projects", cache_key, projects, None, project_button, None)
     if include_manual:
-        keyboard.append([InlineKeyboardButton("Ввести номер договора вручную", callback_data="manual")])
-    keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
-    return InlineKeyboardMarkup(keyboard)
+        rows.append([InlineKeyboardButton("Ввести номер договора вручную", callback_data="manual")])
+    rows.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
+    return InlineKeyboardMarkup(rows)
+
+def build_category_keyboard(categories, prefix="cat_", name="materials"):
+    """Меню категорий (name — каталог): одна и та же разметка до следующего обновления кэша"""
+    rows, _ = cached_rows("categories", name, categories, lambda cat: (cat, InlineKeyboardButton(cat, callback_data=f"{prefix}{cat}")))
+    markup = _markups.get(name)
+    if markup is None or markup[0] is not rows:
+        markup = _markups[name] = (rows, InlineKeyboardMarkup(list(rows) + [[build_cancel_button()]]))
+    return markup[1]
+
+def catalog_button(prefix, item, selected=None):
+    """Кнопка материала или пластины: 'Название (ед.)', после ввода — 'Название (кол-во)'"""
+    item_id = str(item.get("ID") or item.get("id", ""))
+    name = item.get("Наименование") or item.get("name")
+    unit = item.get("Ед. измерения", item.get("unit", "шт"))
+    qty = (selected or {}).get("quantity", "")
+    label = f"{name} ({qty})" if qty else f"{name} ({unit})"
+    return InlineKeyboardButton(label, callback_data=f"{prefix}{item_id}")
 
-def build_material_keyboard(materials, mat_inputs=None, show_submit=False):
+def catalog_rows(prefix, cache_key, items, selected):
+    return item_rows(
+        prefix, cache_key, items, selected,
+        lambda item: (str(item.get("ID") or item.get("id", "")), catalog_button(prefix, item)),
+        lambda item, value: catalog_button(prefix, item, value)
+    )
+
+def build_material_keyboard(materials, mat_inputs=None, show_submit=False, cache_key=None, extra_rows=None):
+    # cache_key — категория: кнопки её материалов собираются один раз на версию кэша
     mat_inputs = mat_inputs or {}
-    keyboard = []
-    keyboard.append([InlineKeyboardButton("Ввести материал вручную", callback_data="manual_material")])
-    for mat in materials:
-        mat_id = str(mat.get("ID") or mat.get("id"))
-        mat_name = mat.get("Наименование", mat.get("name"))
-        unit = mat.get("Ед. измерения", mat.get("unit", "шт"))
-        qty = mat_inputs.get(mat_id, {}).get('quantity', '')
-        label = f"{mat_name} ({qty})" if qty else f"{mat_name} ({unit})"
-        keyboard.append([InlineKeyboardButton(label, callback_data=f"mat_{mat_id}")])
+    keyboard = [[InlineKeyboardButton("Ввести материал вручную", callback_data="manual_material")]]
+    keyboard += catalog_rows("mat_", cache_key, materials, mat_inputs)
     if show_submit and mat_inputs:
         keyboard.append([InlineKeyboardButton("Отправить отчёт", callback_data="submit")])
+    keyboard += extra_rows or []
     # КНОПКУ "Вернуться в меню" добавляем только один раз — в конце!
     keyboard.append([build_cancel_button()])
     return InlineKeyboardMarkup(keyboard)
 
-def build_instrument_keyboard(instruments, selected_instruments, show_submit=True):
-    keyboard = []
-    for instr in instruments:
-        instr_id = str(instr.get('ID инструмента') or instr.get('id'))
-        name = instr.get("Инструмент") or instr.get("name")
-        qty = selected_instruments.get(instr_id, 0)
-        button_text = f"{name} ({qty})" if qty else f"{name}"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"inst_{instr_id}")])
+def instrument_button(instr, qty=0):
+    instr_id = str(instr.get('ID инструмента') or instr.get('id'))
+    name = instr.get("Инструмент") or instr.get("name")
+    button_text = f"{name} ({qty})" if qty else f"{name}"
+    return InlineKeyboardButton(button_text, callback_data=f"inst_{instr_id}")
+
+def build_instrument_keyboard(instruments, selected_instruments, show_submit=True, page=0, pages=1, query=""):
+    # instruments — одна страница (см. sheets.get_instrument_page), а не весь склад; её кнопки
+    # собираются один раз на запрос (в том же нормализованном виде, что и страницы), страницу и версию кэша
+    keyboard = item_rows(
+        "instruments", (instrument_query_key(query), page), instruments, selected_instruments,
+        lambda instr: (str(instr.get('ID инструмента') or instr.get('id')), instrument_button(instr)), instrument_button
+    )
+    if pages > 1:
+        keyboard.append([
+            InlineKeyboardButton("◀", callback_data=f"instpage_{page - 1}" if page > 0 else "instpage_noop"),
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="instpage_noop"),
+            InlineKeyboardButton("▶", callback_data=f"instpage_{page + 1}" if page + 1 < pages else "instpage_noop"),
+        ])
+    if query:
+        keyboard.append([InlineKeyboardButton("Показать все инструменты", callback_data="instpage_all")])
     if show_submit and selected_instruments:
         keyboard.append([InlineKeyboardButton("Отправить отчёт", callback_data="submit")])
     keyboard.append([InlineKeyboardButton("Вернуться в меню", callback_data="main_menu")])
@@ -50,6 +132,10 @@ def build_cancel_button():
 def get_cancel_keyboard():
     return InlineKeyboardMarkup([[build_cancel_button()]])
 
+def new_cart_id():
+    # ID корзины выдаётся при входе в диалог: по нему повторное "Отправить" не пишет строки дважды
+    return uuid.uuid4().hex
+
 def decode_callback_data(data):
     # Универсальный декодер: proj_*, mat_*, cat_*, inst_* и т.д.
     return data.split("_", 1)[-1] if "_" in data else data